@@ -7,6 +7,8 @@ import torch.distributed as dist
 from parameters import get_args
 from pcode.master import Master
 from pcode.worker import Worker
+from pcode.edge import EdgeAggregator, is_edge_rank
+from pcode.gossip import GossipMonitor, GossipWorker
 import pcode.utils.topology as topology
 import pcode.utils.checkpoint as checkpoint
 import pcode.utils.logging as logging
@@ -26,7 +28,14 @@ def main(conf):
     init_config(conf)
 
     # start federated learning.
-    process = Master(conf) if conf.graph.rank == 0 else Worker(conf)
+    if conf.gossip:
+        process = GossipMonitor(conf) if conf.graph.rank == 0 else GossipWorker(conf)
+    elif conf.graph.rank == 0:
+        process = Master(conf)
+    elif is_edge_rank(conf, conf.graph.rank):
+        process = EdgeAggregator(conf)
+    else:
+        process = Worker(conf)
     process.run()
 
 
@@ -90,7 +99,7 @@ def init_config(conf):
     checkpoint.init_checkpoint(conf, rank=str(conf.graph.rank))
 
     # configure logger.
-    conf.logger = logging.Logger(conf.checkpoint_dir)
+    conf.logger = logging.define_logger(conf)
 
     # display the arguments' info.
     if conf.graph.rank == 0:
@@ -40,6 +40,12 @@ def get_args():
         type=str,
         help="decide if each worker will access to all data.",
     )
+    parser.add_argument(
+        "--partition_cache_dir",
+        default=None,
+        type=str,
+        help="cache the (randomized) data partitions on disk, keyed by the partition config.",
+    )
     parser.add_argument("--pin_memory", default=True, type=str2bool)
 
     parser.add_argument(
@@ -49,6 +55,30 @@ def get_args():
         type=int,
         help="number of data loading workers (default: 4)",
     )
+    parser.add_argument(
+        "--lmdb_batch_read",
+        default=False,
+        type=str2bool,
+        help="read lmdb datasets by batches of sorted, contiguous keys.",
+    )
+    parser.add_argument(
+        "--token_cache_dir",
+        default=None,
+        type=str,
+        help="tokenize the text datasets (once) into the memory-mapped token caches in this dir.",
+    )
+    parser.add_argument(
+        "--length_bucketing",
+        default=False,
+        type=str2bool,
+        help="batch the pre-tokenized text samples of similar lengths together.",
+    )
+    parser.add_argument(
+        "--tensor_transform",
+        default=False,
+        type=str2bool,
+        help="use the tensor-native transforms (no PIL) for the numpy-backed datasets.",
+    )
     parser.add_argument(
         "--pn_normalize", default=True, type=str2bool, help="normalize by mean/std."
     )
@@ -61,6 +91,7 @@ def get_args():
     parser.add_argument("--dynamic", type = str2bool, default=False)
     parser.add_argument("--pruning", type= str2bool, default=False)
     parser.add_argument("--split_mix", type = str2bool, default=False)
+    parser.add_argument("--fused_split_mix", type = str2bool, default=False)
     parser.add_argument("--scaler_rate", type=float, default=1)
     parser.add_argument(
         "--arch",
@@ -86,6 +117,24 @@ def get_args():
     parser.add_argument("--random_reinit_local_model", default=None, type=str)
     parser.add_argument("--local_prox_term", type=float, default=0)
     parser.add_argument("--min_local_epochs", type=float, default=None)
+    parser.add_argument(
+        "--local_n_steps",
+        type=int,
+        default=None,
+        help="the max # of local optimizer steps per round (on top of the local epochs).",
+    )
+    parser.add_argument(
+        "--local_time_budget",
+        type=float,
+        default=None,
+        help="the wall-clock budget (in seconds) of the local training per round.",
+    )
+    parser.add_argument(
+        "--fednova",
+        type=str2bool,
+        default=False,
+        help="normalize the local updates by the # of local steps (FedNova) before the aggregation.",
+    )
     parser.add_argument("--reshuffle_per_epoch", default=False, type=str2bool)
     parser.add_argument(
         "--batch_size",
@@ -109,6 +158,64 @@ def get_args():
         help="number of participated ratio per communication rounds",
     )
     parser.add_argument("--n_participated", default=None, type=int)
+    parser.add_argument(
+        "--client_selection",
+        default="random",
+        type=str,
+        choices=["random", "drop_stragglers", "oversample", "adaptive_steps"],
+        help="the (straggler-aware) client selection, based on the measured training time of the clients.",
+    )
+    parser.add_argument(
+        "--client_oversample_ratio",
+        default=0.5,
+        type=float,
+        help="oversample: draw (1 + ratio) * n_participated candidates and keep the predicted fastest.",
+    )
+    parser.add_argument(
+        "--round_deadline",
+        default=None,
+        type=float,
+        help="the deadline (in seconds) of the local training (default: relative to the median client).",
+    )
+    parser.add_argument("--straggler_deadline_factor", default=1.5, type=float)
+    parser.add_argument(
+        "--arch_planning",
+        default=False,
+        type=str2bool,
+        help="(re-)assign the client archs from their flops and the measured client speed, to meet the deadline.",
+    )
+    parser.add_argument("--arch_plan_every_n_rounds", default=5, type=int)
+    parser.add_argument(
+        "--n_edge_aggregators",
+        default=0,
+        type=int,
+        help="# of the edge aggregator ranks (after the workers), which pre-aggregate the local models.",
+    )
+    parser.add_argument(
+        "--gossip",
+        default=False,
+        type=str2bool,
+        help="serverless gossip training: the workers average their models with the topology neighbors, and rank 0 only evaluates.",
+    )
+    parser.add_argument(
+        "--gossip_topology",
+        default="ring",
+        type=str,
+        choices=["ring", "exponential", "complete"],
+    )
+    parser.add_argument(
+        "--gossip_n_steps",
+        default=1,
+        type=int,
+        help="# of the gossip (neighbor averaging) steps after each local training.",
+    )
+    parser.add_argument(
+        "--gossip_eval_freq",
+        default=1,
+        type=int,
+        help="the workers send their models to the monitor (for the evaluation) every # rounds.",
+    )
+    parser.add_argument("--throughput_ema_decay", default=0.5, type=float)
     parser.add_argument("--fl_aggregate", default=None, type=str)
     parser.add_argument("--non_iid_alpha", default=0, type=float)
     parser.add_argument("--train_fast", type=str2bool, default=True)
@@ -201,12 +308,87 @@ def get_args():
     )
     parser.add_argument("--summary_freq", default=256, type=int)
     parser.add_argument("--timestamp", default=None, type=str)
-    parser.add_argument("--track_time", default=False, type=str2bool)
+    parser.add_argument(
+        "--n_eval_users",
+        type=int,
+        default=None,
+        help="for the datasets partitioned by user: the # of users sampled per round for the evaluation (default: all).",
+    )
+    parser.add_argument(
+        "--eval_batch_size",
+        type=int,
+        default=1024,
+        help="batch size of the (shared) test loader of the users.",
+    )
+    parser.add_argument(
+        "--eval_subset_size",
+        type=int,
+        default=None,
+        help="evaluate on a fixed stratified test subset (with a confidence interval) between the full evaluations.",
+    )
+    parser.add_argument("--full_eval_every_n_rounds", type=int, default=10)
+    parser.add_argument("--full_eval_last_k_rounds", type=int, default=5)
+    parser.add_argument("--eval_confidence", type=float, default=0.95)
+    parser.add_argument(
+        "--test_tensor_cache",
+        type=str,
+        default=None,
+        choices=["float32", "float16", "uint8"],
+        help="materialize the preprocessed test set once into a contiguous tensor (of the dtype).",
+    )
+    parser.add_argument(
+        "--test_tensor_cache_dir",
+        type=str,
+        default=None,
+        help="memory-map the cached test tensors from the directory (default: in memory).",
+    )
+    parser.add_argument(
+        "--bn_recalibration",
+        type=str2bool,
+        default=False,
+        help="recalibrate the bn statistics of the aggregated models (on a small training subset) before each evaluation.",
+    )
+    parser.add_argument(
+        "--bn_calibration_size",
+        type=int,
+        default=2048,
+        help="the # of training samples used for the bn recalibration.",
+    )
+    parser.add_argument(
+        "--track_time",
+        default=False,
+        type=str2bool,
+        help="profile the phases of each comm round (exported to trace.json and phases.prom).",
+    )
+    parser.add_argument(
+        "--profiler_cuda_sync",
+        default=False,
+        type=str2bool,
+        help="synchronize cuda at the phase boundaries (accurate but slower).",
+    )
     parser.add_argument("--track_detailed_time", default=False, type=str2bool)
     parser.add_argument("--display_tracked_time", default=False, type=str2bool)
+    parser.add_argument(
+        "--log_backend",
+        default="json",
+        type=str,
+        choices=["json", "jsonl"],
+        help="json: rewrite the log-*.json shards (read by the analysis scripts); jsonl: append to a streaming log.jsonl.",
+    )
 
     # checkpoint
-    parser.add_argument("--resume", default=None, type=str)
+    parser.add_argument(
+        "--resume",
+        default=None,
+        type=str,
+        help="the checkpoint_root of the previous run to (exactly) resume from.",
+    )
+    parser.add_argument(
+        "--save_resume_state",
+        type=str2bool,
+        default=False,
+        help="save the full master/worker state of each comm round (required by the exact `--resume`).",
+    )
     parser.add_argument(
         "--checkpoint",
         "-c",
@@ -217,6 +399,25 @@ def get_args():
     parser.add_argument("--checkpoint_index", type=str, default=None)
     parser.add_argument("--save_all_models", type=str2bool, default=False)
     parser.add_argument("--save_some_models", type=str, default=None)
+    parser.add_argument(
+        "--async_checkpoint",
+        type=str2bool,
+        default=True,
+        help="snapshot the state to cpu and write the checkpoint in a background thread.",
+    )
+    parser.add_argument("--checkpoint_fp16", type=str2bool, default=False)
+    parser.add_argument(
+        "--checkpoint_every_n_rounds",
+        type=int,
+        default=None,
+        help="keep the checkpoint of every n comm rounds.",
+    )
+    parser.add_argument(
+        "--checkpoint_keep_last_k",
+        type=int,
+        default=None,
+        help="only keep the last k round checkpoints (except the save_some_models).",
+    )
 
     # device
     parser.add_argument(
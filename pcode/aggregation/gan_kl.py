@@ -138,6 +138,15 @@ def aggregate(
             return_best_model_on_val=True
             if "return_best_model_on_val" not in fl_aggregate
             else fl_aggregate["return_best_model_on_val"],
+            generator_cache=get_generator_cache(conf, arch)
+            if "reuse_generator" in fl_aggregate and fl_aggregate["reuse_generator"]
+            else None,
+            generator_finetune_batches=None
+            if "generator_finetune_batches" not in fl_aggregate
+            else int(fl_aggregate["generator_finetune_batches"]),
+            replay_ratio=0.5
+            if "replay_ratio" not in fl_aggregate
+            else fl_aggregate["replay_ratio"],
         )
         kt.distillation()
         _client_models[arch] = kt.server_student.cpu()
@@ -155,6 +164,55 @@ def aggregate(
     return _client_models
 
 
+def get_generator_cache(conf, arch):
+    if not hasattr(conf, "generator_caches"):
+        conf.generator_caches = {}
+
+    if arch not in conf.generator_caches:
+        conf.generator_caches[arch] = GeneratorCache(
+            replay_buffer_size=0
+            if "replay_buffer_size" not in conf.fl_aggregate
+            else int(conf.fl_aggregate["replay_buffer_size"])
+        )
+    return conf.generator_caches[arch]
+
+
+class GeneratorCache(object):
+    """ Keep the generator, its optimizer and the synthesized batches alive across comm. rounds."""
+
+    def __init__(self, replay_buffer_size=0):
+        self.replay_buffer_size = replay_buffer_size
+        self.reset()
+
+    def reset(self):
+        self.generator = None
+        self.optimizer = None
+        self.n_rounds = 0
+        # each entry is [pseudo_data, teacher_logits, comm_round].
+        self.replay_buffer = (
+            collections.deque(maxlen=self.replay_buffer_size)
+            if self.replay_buffer_size > 0
+            else None
+        )
+
+    @property
+    def is_warm(self):
+        return self.generator is not None
+
+    @property
+    def use_replay(self):
+        return self.replay_buffer is not None and len(self.replay_buffer) > 0
+
+    def push(self, pseudo_data, teacher_logits, comm_round):
+        if self.replay_buffer is not None:
+            self.replay_buffer.append(
+                [pseudo_data.detach(), teacher_logits.detach(), comm_round]
+            )
+
+    def sample(self, random_state):
+        return self.replay_buffer[random_state.randint(len(self.replay_buffer))]
+
+
 import torch.nn as nn
 import math
 
@@ -229,6 +287,9 @@ class GanKTSolver(object):
             server_teaching_scheme=None,
             return_best_model_on_val=False,
             beta=0.1,
+            generator_cache=None,
+            generator_finetune_batches=None,
+            replay_ratio=0.5,
     ):
         # general init.
         self.conf = conf
@@ -252,7 +313,20 @@ class GanKTSolver(object):
         # init student and teacher nets.
         self.numb_teachers = len(teacher_models)
 
-        self.generator = self.prepare_gen(Generator(nz=100, nc=3, img_size=32))
+        # reuse the generator (and its optimizer) from the previous comm. rounds if possible.
+        self.generator_cache = generator_cache
+        self.replay_ratio = replay_ratio
+        if self.generator_cache is not None and self.generator_cache.is_warm:
+            self.generator = self.generator_cache.generator
+            self.generator.train()
+            self.generator_budget = (
+                self.total_n_server_pseudo_batches
+                if generator_finetune_batches is None
+                else generator_finetune_batches
+            )
+        else:
+            self.generator = self.prepare_gen(Generator(nz=100, nc=3, img_size=32))
+            self.generator_budget = self.total_n_server_pseudo_batches
         student_model = student_model.cuda()
         self.init_server_student = copy.deepcopy(student_model)
 
@@ -275,9 +349,14 @@ class GanKTSolver(object):
         self.optimizer_server_student = optim.SGD(
             self.server_student.parameters(), lr = 0.1, weight_decay=5e-4, momentum = 0.9
         )
-        self.optimizer_generator = optim.Adam(
-            self.generator.parameters(), lr=1e-3
-        )
+        if self.generator_cache is not None and self.generator_cache.is_warm:
+            self.optimizer_generator = self.generator_cache.optimizer
+            for param_group in self.optimizer_generator.param_groups:
+                param_group["lr"] = 1e-3
+        else:
+            self.optimizer_generator = optim.Adam(
+                self.generator.parameters(), lr=1e-3
+            )
         # init the training scheduler.
         self.server_teaching_scheme = server_teaching_scheme
         self.use_server_model_scheduler = use_server_model_scheduler
@@ -288,7 +367,7 @@ class GanKTSolver(object):
         )
         self.scheduler_generator = optim.lr_scheduler.CosineAnnealingLR(
             self.optimizer_generator,
-            self.total_n_server_pseudo_batches ,
+            max(self.generator_budget, 1),
             last_epoch=-1
         )
 
@@ -342,43 +421,41 @@ class GanKTSolver(object):
         #     self.optimizer_generator.step()
         # self.scheduler_generator.step()
 
+        loss_g, is_diverged = torch.tensor(0.0), False
         while batch_count < self.total_n_server_pseudo_batches:
 
-            z = torch.randn((self.batch_size, 100, 1, 1)).cuda()
-            pseudo_data = self.generator(z)
-            teacher_logits = 0
-            feature_loss = 0
-            for i, _teacher in enumerate(self.client_teachers):
-                feature, logit = _teacher(pseudo_data)
-                teacher_logits = logit + teacher_logits
-                feature_loss = feature_loss - feature.abs().mean()
-
-            student_feature, student_logits = self.server_student(pseudo_data)
-            feature_loss = feature_loss / self.numb_teachers
-            teacher_logits = teacher_logits / self.numb_teachers
-            loss_g = -F.l1_loss(student_logits, teacher_logits) + self.beta * feature_loss
-            if loss_g <= -20:
-                self.log_fn(f"gan diverge, current loss_g:{loss_g:.4f}")
-                break
-            # loss_g = loss_g / self.numb_teachers
-            self.optimizer_generator.zero_grad()
-            loss_g.backward()
-            # torch.nn.utils.clip_grad_norm_(self.generator.parameters(), 5)
-            self.optimizer_generator.step()
-
-            for student_iter in range(5):
-                # steps on the same pseudo data
+            # the (warm) generator is only fine-tuned within its budget.
+            if batch_count < self.generator_budget:
                 z = torch.randn((self.batch_size, 100, 1, 1)).cuda()
-                pseudo_data = self.generator(z).detach()
+                pseudo_data = self.generator(z)
+                teacher_logits = 0
+                feature_loss = 0
+                for i, _teacher in enumerate(self.client_teachers):
+                    feature, logit = _teacher(pseudo_data)
+                    teacher_logits = logit + teacher_logits
+                    feature_loss = feature_loss - feature.abs().mean()
 
-                # get the logits.
-                with torch.no_grad():
-                    teacher_logits = 0
-                    for i, _teacher in enumerate(self.client_teachers):
-                        feature, logit = _teacher(pseudo_data)
-                        teacher_logits = logit + teacher_logits
+                student_feature, student_logits = self.server_student(pseudo_data)
+                feature_loss = feature_loss / self.numb_teachers
+                teacher_logits = teacher_logits / self.numb_teachers
+                loss_g = -F.l1_loss(student_logits, teacher_logits) + self.beta * feature_loss
+                if loss_g <= -20:
+                    self.log_fn(f"gan diverge, current loss_g:{loss_g:.4f}")
+                    if self.generator_cache is not None:
+                        self.generator_cache.reset()
+                    is_diverged = True
+                    break
+                # loss_g = loss_g / self.numb_teachers
+                self.optimizer_generator.zero_grad()
+                loss_g.backward()
+                # torch.nn.utils.clip_grad_norm_(self.generator.parameters(), 5)
+                self.optimizer_generator.step()
+                if self.use_server_model_scheduler:
+                    self.scheduler_generator.step()
 
-                    teacher_logits = teacher_logits * (1.0 / self.numb_teachers)
+            for student_iter in range(5):
+                # steps on the same pseudo data
+                pseudo_data, teacher_logits = self._get_student_batch()
                 student_feature, student_logits = self.server_student(pseudo_data)
                 loss_s = F.l1_loss(student_logits, teacher_logits)
 
@@ -391,7 +468,6 @@ class GanKTSolver(object):
                 # after each batch.
             if self.use_server_model_scheduler:
                 self.scheduler_server_student.step()
-                self.scheduler_generator.step()
 
             batch_count += 6
 
@@ -440,6 +516,46 @@ class GanKTSolver(object):
         self.server_student.load_state_dict(best_server_dict)
         self.server_student = self.server_student.cpu()
 
+        # keep the generator for the next comm. round.
+        if self.generator_cache is not None and not is_diverged:
+            self.generator_cache.generator = self.generator
+            self.generator_cache.optimizer = self.optimizer_generator
+            self.generator_cache.n_rounds += 1
+
+    def _get_student_batch(self):
+        # replay a synthesized batch (relabel it if the teachers have changed).
+        if (
+            self.generator_cache is not None
+            and self.generator_cache.use_replay
+            and self.conf.random_state.rand() < self.replay_ratio
+        ):
+            entry = self.generator_cache.sample(self.conf.random_state)
+            if entry[2] != self.conf.graph.comm_round:
+                entry[1] = self._get_teacher_logits(entry[0])
+                entry[2] = self.conf.graph.comm_round
+            return entry[0], entry[1]
+
+        with torch.no_grad():
+            z = torch.randn((self.batch_size, 100, 1, 1)).cuda()
+            pseudo_data = self.generator(z).detach()
+        teacher_logits = self._get_teacher_logits(pseudo_data)
+        if self.generator_cache is not None:
+            self.generator_cache.push(
+                pseudo_data, teacher_logits, self.conf.graph.comm_round
+            )
+        return pseudo_data, teacher_logits
+
+    def _get_teacher_logits(self, pseudo_data):
+        # get the logits.
+        with torch.no_grad():
+            teacher_logits = 0
+            for i, _teacher in enumerate(self.client_teachers):
+                feature, logit = _teacher(pseudo_data)
+                teacher_logits = logit + teacher_logits
+
+            teacher_logits = teacher_logits * (1.0 / self.numb_teachers)
+        return teacher_logits
+
     def prepare_model(self, model, device, is_teacher):
         model = model.to(device)
         model = copy.deepcopy(model)
@@ -34,8 +34,7 @@ class MixAggregator():
         self.master_model, self.client_models = master_model, client_models
         self.clientid2arch = self.conf.clientid2arch
         self.label_split = label_split
-        self._model_accum = SlimmableModelAccumulator(master_model, self.conf.n_participated,
-                                                      self.conf.n_clients)
+        self._model_accum = FlatSlimmableAccumulator(master_model, self.conf.n_participated)
         if conf.pruning:
             self.train_slim_ratios = [eval(arch.split('_')[-1]) for arch in self.used_client_archs]
         else:
@@ -49,13 +48,29 @@ class MixAggregator():
         self.user_base_sampler = shuffle_sampler(list(range(self.num_base)))
 
         self.slim_shifts = {}
+        self.refresh_client_slims()
+
+    def refresh_client_slims(self):
+        # the # of bases of each client follows its (possibly re-planned) arch.
         self.user_max_slim_ratios = {}
         for client_id, arch in self.clientid2arch.items():
-            if conf.pruning:
+            if self.conf.pruning:
                 self.user_max_slim_ratios[client_id] = eval(arch.split('_')[-1])
             else:
                 self.user_max_slim_ratios[client_id] = 1.0 / float(eval(arch.split('_')[-1]))
 
+    def state_dict(self):
+        # the `user_base_sampler` reshuffles with the global np.random (restored with the rng state).
+        return {
+            "server_buffer": self._model_accum.server_buffer,
+            "user_base_sampler": self.user_base_sampler.__dict__,
+            "slim_shifts": self.slim_shifts,
+        }
+
+    def load_state_dict(self, state_dict):
+        self._model_accum.server_buffer.copy_(state_dict["server_buffer"])
+        self.user_base_sampler.__dict__.update(state_dict["user_base_sampler"])
+        self.slim_shifts = state_dict["slim_shifts"]
 
     def get_client_slim(self, client_idx):
         max_slim_ratio = self.user_max_slim_ratios[client_idx]
@@ -71,8 +86,8 @@ class MixAggregator():
 
         slim_shifts = [self.user_base_sampler.next()]
         if user_n_base > 1:
-            _sampler = shuffle_sampler([v for v in self.user_base_sampler.arr if v != slim_shifts[0]])
-            slim_shifts += [_sampler.next() for _ in range(user_n_base - 1)]
+            _other_bases = np.delete(np.arange(self.num_base), slim_shifts[0])
+            slim_shifts += np.random.permutation(_other_bases)[:(user_n_base - 1)].tolist()
         slim_ratios = [self.atom_slim_ratio] * user_n_base
         self.slim_shifts[client_idx] = slim_shifts
 
@@ -84,6 +99,7 @@ class MixAggregator():
         for arch in self.used_client_archs:
             self.client_models[arch].switch_slim_mode(self.max_ratio)
             client_models[arch].load_state_dict(self._model_accum.server_state_dict)
+            client_models[arch].refresh_slim_cache()
             # self._model_accum.load_model(client_models[arch], 0)
             # client_models[arch] = copy.deepcopy(master_model)
             client_models[arch] = client_models[arch].cpu()
@@ -94,16 +110,8 @@ class MixAggregator():
         weight = 1.0 / float(self.conf.n_clients)
 
         for client_idx, flatten_local_model in flatten_local_models.items():
-            _arch = self.clientid2arch[client_idx]
-            self.client_models[_arch] = self.client_models[_arch].cuda()
-
-            _model = copy.deepcopy(self.client_models[_arch])
-            _model_state_dict = _model.state_dict()
-            flatten_local_model.unpack(_model_state_dict.values())
-            _model.load_state_dict(_model_state_dict)
-
-            self._model_accum.add(client_idx, _model, weight,
-                                  max_slim_ratio=self.atom_slim_ratio, slim_bias_idx=self.slim_shifts[client_idx])
+            self._model_accum.add(flatten_local_model.buffer, weight,
+                                  slim_bias_idx=self.slim_shifts[client_idx])
 
         self._model_accum.update_server_and_reset()
         self.master_model = self.master_model.cuda()
@@ -367,3 +375,99 @@ class SlimmableModelAccumulator(ModelAccumulator):
                 self._weight_sum[k].data.zero_()
             for k in self._accum_state_dict:
                 self._accum_state_dict[k].data.zero_()
+
+
+class FlatSlimmableAccumulator(object):
+    """Accumulate the flattened client ensembles base by base.
+    The full-width running model is flattened once (in the `state_dict` order, i.e., the
+    layout of the `TensorBuffer` received from the clients) and the flat indices of every
+    base are pre-computed. Each client then adds all its trained bases with one `index_add_`
+    and the server is divided by the per-base summed weights once per round.
+
+    Args:
+        running_model: Full-width ensemble used to init the flat layout.
+        n_accum: Number of models to accumulate per round.
+        raise_err_on_early_accum: Raise error if update model when not all users are accumulated.
+    """
+
+    def __init__(self, running_model: nn.Module, n_accum, raise_err_on_early_accum=True):
+        self.n_accum = n_accum
+        self._cnt = 0
+        self.raise_err_on_early_accum = raise_err_on_early_accum
+        with torch.no_grad():
+            state_dict = running_model.state_dict()
+            self._keys = list(state_dict.keys())
+            self._shapes = [v.shape for v in state_dict.values()]
+            self._dtypes = [v.dtype for v in state_dict.values()]
+            self.server_buffer = torch.cat(
+                [v.detach().reshape(-1).float() for v in state_dict.values()]
+            )
+            self._accum_buffer = torch.zeros_like(self.server_buffer)
+
+            # pre-index the mapping from bases to the flat elements (keys are `{base_idx}.xxx`).
+            device = self.server_buffer.device
+            base_of_keys = torch.tensor([int(k.split('.')[0]) for k in self._keys])
+            numels = torch.tensor([int(np.prod(shape)) for shape in self._shapes])
+            self._elem2base = torch.repeat_interleave(base_of_keys, numels).to(device)
+            self.num_base = int(base_of_keys.max()) + 1
+            self._base_indices = [
+                torch.nonzero(self._elem2base == base_idx).view(-1)
+                for base_idx in range(self.num_base)
+            ]
+            self._base_weight_sum = torch.zeros(self.num_base, device=device)
+
+    def add(self, flatten_local_model, weight, slim_bias_idx=0):
+        """Add the bases (defined by slim_bias_idx) of the flattened client model.
+        Use weight = 1/n_accum to average.
+        """
+        if self._cnt >= self.n_accum:  # note cnt starts from 0
+            raise RuntimeError(f"Try to accumulate {self._cnt}, while only {self.n_accum} models"
+                               f" are allowed. Did you forget to reset after accumulated?")
+        slim_bias_idxs = slim_bias_idx
+        if np.isscalar(slim_bias_idxs):
+            slim_bias_idxs = [slim_bias_idxs]
+        slim_bias_idxs = torch.tensor([int(idx) for idx in slim_bias_idxs], device=self._base_weight_sum.device)
+        with torch.no_grad():
+            index = torch.cat([self._base_indices[idx] for idx in slim_bias_idxs.tolist()])
+            source = flatten_local_model.to(self._accum_buffer.device).index_select(0, index)
+            self._accum_buffer.index_add_(0, index, source.mul_(weight))
+            self._base_weight_sum.index_add_(
+                0, slim_bias_idxs, torch.full_like(slim_bias_idxs, weight, dtype=self._base_weight_sum.dtype))
+        self._cnt += 1  # DO THIS at the END such that start from 0.
+
+    @property
+    def server_state_dict(self):
+        state_dict = OrderedDict()
+        pointer = 0
+        for key, shape, dtype in zip(self._keys, self._shapes, self._dtypes):
+            numel = int(np.prod(shape))
+            tensor = self.server_buffer[pointer:(pointer + numel)].view(shape)
+            state_dict[key] = tensor if dtype.is_floating_point else tensor.round().to(dtype)
+            pointer += numel
+        return state_dict
+
+    def load_model(self, running_model: nn.Module, model_idx=0, strict=True):
+        """Load server model into the given (full-width) running_model."""
+        running_model.load_state_dict(self.server_state_dict, strict=strict)
+
+    def update_server_and_reset(self):
+        """Divide the accumulated bases by their summed weights, update the server
+        (only the trained bases) and reset accumulated values."""
+        self.check_full_accum()
+        with torch.no_grad():
+            weight_sum = self._base_weight_sum[self._elem2base]
+            weight_nz_mask = weight_sum > 1e-6  # updated entries
+            self.server_buffer[weight_nz_mask] = \
+                self._accum_buffer[weight_nz_mask] / weight_sum[weight_nz_mask]
+
+            # reset
+            self._cnt = 0
+            self._base_weight_sum.zero_()
+            self._accum_buffer.zero_()
+
+    def check_full_accum(self):
+        """Check if the number of accumulated models reaches the expected value (n_accum)."""
+        if self.raise_err_on_early_accum:
+            assert self._cnt == self.n_accum, f"Retrieve before all models are accumulated. " \
+                                              f"Expect to accumulate {self.n_accum} but only" \
+                                              f" get {self._cnt}"
@@ -13,6 +13,12 @@ class HeteroAggregator():
 
         self.init_index()
 
+    def state_dict(self):
+        return {"param_idx": self.param_idx}
+
+    def load_state_dict(self, state_dict):
+        self.param_idx = state_dict["param_idx"]
+
     def init_index(self):
         with torch.no_grad():
             idx_i = dict((arch, None)
@@ -144,10 +150,21 @@ class HeteroAggregator():
             master_model = master_model.cpu()
         return client_models
 
-    def aggregate_model(self, flatten_local_models):
+    def init_partial(self):
+        """the (zero) partial aggregate, i.e. the sums and the counts of the master parameters."""
+        global_params = self.master_model.state_dict()
+        sums = OrderedDict(
+            (k, v.new_zeros(v.size(), dtype=torch.float32)) for k, v in global_params.items()
+        )
+        counts = OrderedDict(
+            (k, v.new_zeros(v.size(), dtype=torch.float32)) for k, v in global_params.items()
+        )
+        return sums, counts
+
+    def accumulate(self, flatten_local_models):
+        """Sum the local models (embedded in the master parameters) and count the clients of each entry;
+        the partial aggregates of the disjoint sets of clients add up to the one of their union."""
         with torch.no_grad():
-            count = OrderedDict()
-            self.master_model = self.master_model.cuda()
             global_params = self.master_model.state_dict()
             local_client_parameters = {}
             # client tensor -> arch + state_dict
@@ -158,12 +175,11 @@ class HeteroAggregator():
                 label_split = torch.tensor(self.label_split[client_idx])
                 local_client_parameters[client_idx] = (_arch, _model_state_dict, label_split)
 
-            # client state_dict -> avg
-            reload_state_dict = {}
+            # client state_dict -> sum
+            sums, count = self.init_partial()
             for k, v in global_params.items():
                 parameter_type = k.split('.')[-1]
-                count[k] = v.new_zeros(v.size(), dtype=torch.float32)
-                tmp_v = v.new_zeros(v.size(), dtype=torch.float32)
+                tmp_v = sums[k]
 
                 for client_idx, client_parameters in local_client_parameters.items():
                     _arch, local_parameters, label_split = client_parameters
@@ -195,14 +211,29 @@ class HeteroAggregator():
                         count[k][self.param_idx[_arch][k]] += 1
                     else:
                         pass
+            return sums, count
+
+    def aggregate_partials(self, partials, client_ids=None):
+        """Average the (summed) partial aggregates into the master model."""
+        with torch.no_grad():
+            self.master_model = self.master_model.cuda()
+            global_params = self.master_model.state_dict()
+            reload_state_dict = {}
+            for k, v in global_params.items():
+                tmp_v = sum(sums[k].to(v.device) for sums, _ in partials)
+                count = sum(counts[k].to(v.device) for _, counts in partials)
 
-                tmp_v[count[k] > 0] = tmp_v[count[k] > 0].div_(count[k][count[k] > 0])
-                v[count[k] > 0] = tmp_v[count[k] > 0].to(v.dtype)
+                tmp_v[count > 0] = tmp_v[count > 0].div_(count[count > 0])
+                v[count > 0] = tmp_v[count > 0].to(v.dtype)
                 reload_state_dict[k] = copy.deepcopy(v)
 
             self.master_model.load_state_dict(reload_state_dict)
             return self.master_model
 
+    def aggregate_model(self, flatten_local_models):
+        self.master_model = self.master_model.cuda()
+        return self.aggregate_partials([self.accumulate(flatten_local_models)])
+
     def get_client_model_weights(self, local_models):
         # for non i.i.d situation, change the weights
         if self.conf.partition_data == "non_iid_dirichlet" or not self.conf.dynamic:
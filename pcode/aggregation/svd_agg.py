@@ -2,6 +2,7 @@ from collections import OrderedDict
 from pcode.utils.module_state import ModuleState
 import torch
 import copy
+import math
 import re
 
 attn_weight_pattern = '.*attn\.\w+\.weight'
@@ -29,6 +30,17 @@ class SVDAggregator:
         else:
             self.init_transformer(master_model)
 
+    def state_dict(self):
+        return {
+            "index_map": getattr(self, "index_map", None),
+            "initial_weight": self.initial_weight,
+        }
+
+    def load_state_dict(self, state_dict):
+        if state_dict["index_map"] is not None:
+            self.index_map = state_dict["index_map"]
+        self.initial_weight = state_dict["initial_weight"]
+
     def init_transformer(self, master_model):
         self.initial_weight = ModuleState(copy.deepcopy(master_model.state_dict()))
 
@@ -190,17 +202,29 @@ class SVDAggregator:
             reload_state_dict[param_name] += weights[client_idx] * local_model_state[param_name]
         return reload_state_dict
 
-    def aggregate_model(self, flatten_local_models):
+    def init_partial(self):
+        """the (zero) partial aggregate, i.e. the weighted sums of the (reconstructed) master
+        parameters and the sum of the weights."""
+        sums = OrderedDict(
+            (param_name, torch.zeros_like(param.data))
+            for param_name, param in self.master_model.state_dict().items()
+        )
+        return sums, {"weight": torch.zeros(1)}
+
+    def get_unnormalized_weight(self, rank_factor):
+        # the softmax weights (over -rank_factor) of the dynamic deployment, up to their normalization.
+        if not self.conf.dynamic:
+            return 1.0
+        return math.exp(-(rank_factor - 1) / self.conf.softmax_temperature)
+
+    def accumulate(self, flatten_local_models):
+        """Sum the (full-rank reconstructions of the) local models with their unnormalized weights;
+        the partial aggregates of the disjoint sets of clients add up to the one of their union."""
         with torch.no_grad():
-            self.master_model = self.master_model.cuda()
             global_params = list(self.master_model.state_dict().items())
-            reload_state_dict = {}
-            for (param_name, param) in global_params:
-                reload_state_dict[param_name] = torch.zeros_like(param.data)
+            reload_state_dict, total_weight = self.init_partial()
 
-            # weight = 1.0 / float(len(flatten_local_models))
             local_models = {}
-            factors_num = set()
             for client_idx, flatten_local_model in flatten_local_models.items():
                 _arch = self.clientid2arch[client_idx]
 
@@ -208,28 +232,21 @@ class SVDAggregator:
                 if len(_arch.split('_')) > 1:
                     rank_factor = eval(_arch.split('_')[-1])
 
-                factors_num.add(rank_factor)
-
                 _model = copy.deepcopy(self.client_models[_arch])
                 _model_state_dict = self.client_models[_arch].state_dict()
                 flatten_local_model.unpack(_model_state_dict.values())
                 _model.load_state_dict(_model_state_dict)
-                _model = _model.eval()  # for lora weights
+                _model.eval()  # for lora weights
 
                 local_models[client_idx] = (_model, rank_factor, _arch)
 
-            factors_num = list(factors_num)
-            factors_num.sort(reverse=True)
-
-            # preserve higher dimension history info
-            min_rank_factor = int(self.conf.arch_info["worker"][0].split('_')[-1])
-            if factors_num[-1] > min_rank_factor:
-                local_models[0] = (copy.deepcopy(self.master_model), 1, self.conf.arch_info["worker"][0])
-
-            weights = self.get_client_model_weights(local_models)
+            weights = dict(
+                (client_idx, self.get_unnormalized_weight(rank_factor))
+                for client_idx, (_, rank_factor, _) in local_models.items()
+            )
 
             for client_idx, (_model, rank_factor, _arch) in local_models.items():
-                _model = _model.cuda()
+                _model = _model.to(global_params[0][1].device)
                 local_model_params = list(_model.state_dict().values())
                 if rank_factor > 1:
                     if 'vit' in self.conf.arch_info["master"]:
@@ -243,28 +260,44 @@ class SVDAggregator:
                         reload_state_dict[param_name] = reload_state_dict[param_name] + weights[client_idx] * \
                                                         local_model_params[index]
 
-            self.master_model.load_state_dict(reload_state_dict)
-            return self.master_model
+            total_weight["weight"] += sum(weights.values())
+            return reload_state_dict, total_weight
 
-    def get_client_model_weights(self, local_models):
-        if not self.conf.dynamic:
-            return dict((k, float(1.0 / len(local_models))) for k in local_models.keys())
-
-        weights_values = []
-        index_map = {}
-
-        for index, (client_idx, (_model, rank_factor, _arch)) in enumerate(local_models.items()):
-            weights_values.append(-rank_factor)
-            index_map[client_idx] = index
-
-        temperature = self.conf.softmax_temperature
+    def aggregate_partials(self, partials, client_ids):
+        """Normalize the (summed) partial aggregates of the clients into the master model."""
+        with torch.no_grad():
+            self.master_model = self.master_model.cuda()
+            global_params = list(self.master_model.state_dict().items())
+            reload_state_dict = dict(
+                (param_name, sum(sums[param_name].to(param.device) for sums, _ in partials))
+                for param_name, param in global_params
+            )
+            total_weight = sum(weights["weight"].item() for _, weights in partials)
 
-        weights_values = torch.softmax(torch.tensor(weights_values) / temperature, dim=0)
-        weights = {}
-        for client_idx in local_models.keys():
-            weights[client_idx] = weights_values[index_map[client_idx]]
+            # preserve higher dimension history info
+            rank_factors = [
+                eval(self.clientid2arch[client_idx].split('_')[-1])
+                if len(self.clientid2arch[client_idx].split('_')) > 1
+                else 1
+                for client_idx in client_ids
+            ]
+            min_rank_factor = int(self.conf.arch_info["worker"][0].split('_')[-1])
+            if min(rank_factors) > min_rank_factor:
+                master_weight = self.get_unnormalized_weight(1)
+                for param_name, param in global_params:
+                    reload_state_dict[param_name] = reload_state_dict[param_name] + master_weight * param
+                total_weight += master_weight
+
+            for param_name in reload_state_dict.keys():
+                reload_state_dict[param_name] = reload_state_dict[param_name] / total_weight
+            self.master_model.load_state_dict(reload_state_dict)
+            return self.master_model
 
-        return weights
+    def aggregate_model(self, flatten_local_models):
+        self.master_model = self.master_model.cuda()
+        return self.aggregate_partials(
+            [self.accumulate(flatten_local_models)], list(flatten_local_models.keys())
+        )
 
     def decide_upper_bound(self, rank_factor):
 
@@ -61,6 +61,57 @@ def sample_from_swag(conf, model, client_models, loader=None):
     return sampled_models
 
 
+def sample_from_flat_swag(conf, model, client_models, loader=None):
+    swag_model_root = swag.FlatSWAG(
+        model.cuda() if conf.graph.on_cuda else model,
+        no_cov_mat=False,
+        max_num_models=len(client_models),
+    )
+
+    # collect models.
+    for _id, client_model in client_models.items():
+        swag_model_root.collect_model(client_model)
+
+    # sample from swag_model: only the seeds (and the bn buffers) are kept.
+    conf.logger.log("sampling model from (flat) swag.")
+    n_sampled_models = int(conf.fl_aggregate["swag_n_sampled_model"])
+    seeds = conf.random_state.randint(0, 2 ** 31 - 1, size=n_sampled_models).tolist()
+    buffers = None
+    if loader is not None:
+        buffers = torch.stack(
+            [
+                torch.nn.utils.parameters_to_vector(
+                    swag._floating_buffers(_model)
+                ).cpu()
+                for _, _model in swag_model_root.stream_samples(
+                    seeds,
+                    scale=conf.fl_aggregate["swag_sample_scale"],
+                    cov=True,
+                    loader=loader,
+                )
+            ]
+        )
+
+    # include client models or not.
+    extra_models = None
+    if (
+        "include_client_models" in conf.fl_aggregate
+        and conf.fl_aggregate["include_client_models"]
+    ):
+        extra_models = list(client_models.values())
+
+    sampled_models = swag.FlatSWAGTeachers(
+        swag_model_root,
+        seeds,
+        scale=conf.fl_aggregate["swag_sample_scale"],
+        cov=True,
+        buffers=buffers,
+        extra_models=extra_models,
+    )
+    conf.logger.log(f"sampled {len(sampled_models)} model from SWAG.")
+    return sampled_models
+
+
 def aggregate(
     conf,
     fedavg_models,
@@ -126,14 +177,20 @@ def aggregate(
         # sample models.
         assert len(fedavg_models) == 1, "right now, we only support homo-arch case."
         # TODO.
-        sampled_models = sample_from_swag(
-            conf, fedavg_model, local_models, loader=val_data_loader
-        )
+        if "swag_flat" in fl_aggregate and fl_aggregate["swag_flat"]:
+            teacher_models = sample_from_flat_swag(
+                conf, fedavg_model, local_models, loader=val_data_loader
+            )
+        else:
+            sampled_models = sample_from_swag(
+                conf, fedavg_model, local_models, loader=val_data_loader
+            )
+            teacher_models = list(sampled_models.values())
 
         # initialize knowledge distillation solver.
         kt = SWAKTSolver(
             conf=conf,
-            teacher_models=list(sampled_models.values()),
+            teacher_models=teacher_models,
             student_model=fedavg_model,
             criterion=criterion,
             metrics=metrics,
@@ -176,7 +233,7 @@ def aggregate(
         _client_models[arch] = kt.server_student.cpu()
 
     # free the memory.
-    del local_models, sampled_models, kt
+    del local_models, teacher_models, kt
     torch.cuda.empty_cache()
     return _client_models
 
@@ -227,12 +284,22 @@ class SWAKTSolver(object):
         self.server_student = self.base_solver.prepare_model(
             conf, student_model, self.device, _is_teacher=False
         )
-        self.client_teachers = [
-            self.base_solver.prepare_model(
-                conf, _teacher, self.device, _is_teacher=True
+        if isinstance(teacher_models, swag.FlatSWAGTeachers):
+            # the sampled teachers share one model, so only the logits can be used.
+            assert update_student_scheme != "avg_losses"
+            teacher_models.prepare(
+                lambda _teacher: self.base_solver.prepare_model(
+                    conf, _teacher, self.device, _is_teacher=True
+                )
             )
-            for _teacher in teacher_models
-        ]
+            self.client_teachers = teacher_models
+        else:
+            self.client_teachers = [
+                self.base_solver.prepare_model(
+                    conf, _teacher, self.device, _is_teacher=True
+                )
+                for _teacher in teacher_models
+            ]
 
         # init the loaders.
         self.val_data_loader = val_data_loader
@@ -333,6 +333,155 @@ class SWAG(torch.nn.Module):
             return self.full_logll(param_list, mean_list, var_list, covar_mat_root_list)
 
 
+"""flat-vector SWAG."""
+
+
+def _floating_buffers(model):
+    return [buf for buf in model.buffers() if buf.is_floating_point()]
+
+
+class FlatSWAG(object):
+    """
+        SWAG over the flattened parameter vector of the base model.
+        The first/second moments are [P] vectors and the low-rank deviations
+        are kept in a single [K, P] matrix (used as a ring buffer),
+        so the memory is O(K * P) and no model copy is made per sample.
+    """
+
+    def __init__(self, base_model, no_cov_mat=True, max_num_models=0, var_clamp=1e-30):
+        self.no_cov_mat = no_cov_mat
+        self.max_num_models = max_num_models
+        self.var_clamp = var_clamp
+        self.n_models = 0
+
+        # the (only) model that samples are written into.
+        self.base = copy.deepcopy(base_model)
+        for param in self.base.parameters():
+            param.requires_grad = False
+
+        vector = torch.nn.utils.parameters_to_vector(self.base.parameters()).detach()
+        self.mean = torch.zeros_like(vector)
+        self.sq_mean = torch.zeros_like(vector)
+        if not self.no_cov_mat:
+            self.cov_mat_sqrt = vector.new_zeros((self.max_num_models, vector.numel()))
+
+    @property
+    def rank(self):
+        return 0 if self.no_cov_mat else min(self.n_models, self.max_num_models)
+
+    def collect_model(self, base_model):
+        vector = torch.nn.utils.parameters_to_vector(base_model.parameters()).detach()
+        vector = vector.to(self.mean.device)
+
+        # first and second moment.
+        self.mean.mul_(self.n_models / (self.n_models + 1.0)).add_(
+            vector / (self.n_models + 1.0)
+        )
+        self.sq_mean.mul_(self.n_models / (self.n_models + 1.0)).add_(
+            vector ** 2 / (self.n_models + 1.0)
+        )
+
+        # deviation from the current mean; overwrite the oldest row if full.
+        if not self.no_cov_mat and self.max_num_models > 0:
+            self.cov_mat_sqrt[self.n_models % self.max_num_models].copy_(
+                vector - self.mean
+            )
+        self.n_models += 1
+
+    def sample_vector(self, scale=1.0, cov=False, seed=None, fullrank=True):
+        generator = None
+        if seed is not None:
+            generator = torch.Generator(device=self.mean.device)
+            generator.manual_seed(int(seed))
+
+        # draw diagonal variance sample
+        var = torch.clamp(self.sq_mean - self.mean ** 2, self.var_clamp)
+        rand_sample = var.sqrt() * torch.randn(
+            var.size(), generator=generator, dtype=var.dtype, device=var.device
+        )
+
+        # if covariance draw low rank sample
+        if cov and fullrank and self.rank > 0:
+            eps = torch.randn(
+                (self.rank,), generator=generator, dtype=var.dtype, device=var.device
+            )
+            cov_sample = self.cov_mat_sqrt[: self.rank].t().mv(eps)
+            rand_sample += cov_sample / max(self.max_num_models - 1, 1) ** 0.5
+
+        # update sample with mean and scale
+        return self.mean + scale ** 0.5 * rand_sample
+
+    def sample(self, scale=1.0, cov=False, seed=None, fullrank=True, model=None):
+        model = self.base if model is None else model
+        torch.nn.utils.vector_to_parameters(
+            self.sample_vector(scale=scale, cov=cov, seed=seed, fullrank=fullrank),
+            model.parameters(),
+        )
+        return model
+
+    def stream_samples(self, seeds, scale=1.0, cov=False, loader=None, model=None):
+        """
+            Sample-and-evaluate one model at a time:
+            yields (seed, model) where `model` is the reused base holding the sample.
+        """
+        for seed in seeds:
+            _model = self.sample(scale=scale, cov=cov, seed=seed, model=model)
+
+            # update bn.
+            if loader is not None:
+                bn_update(_model, loader)
+            yield seed, _model
+
+
+class FlatSWAGTeachers(object):
+    """
+        A list-like view over the SWAG samples (and optional extra models).
+        Each sample is re-drawn from its seed into one shared model on access,
+        so iterating over it streams the teachers instead of holding copies.
+    """
+
+    def __init__(self, swag_model, seeds, scale=1.0, cov=False, buffers=None, extra_models=None):
+        self.swag_model = swag_model
+        self.model = swag_model.base
+        self.seeds = list(seeds)
+        self.scale = scale
+        self.cov = cov
+        self.buffers = buffers
+        self.extra_models = [] if extra_models is None else list(extra_models)
+
+    def prepare(self, prepare_fn):
+        self.model = prepare_fn(self.model)
+        self.extra_models = [prepare_fn(model) for model in self.extra_models]
+
+    def __len__(self):
+        return len(self.seeds) + len(self.extra_models)
+
+    def __getitem__(self, idx):
+        if idx >= len(self.seeds):
+            return self.extra_models[idx - len(self.seeds)]
+
+        self.swag_model.sample(
+            scale=self.scale, cov=self.cov, seed=self.seeds[idx], model=self.model
+        )
+        if self.buffers is not None:
+            torch.nn.utils.vector_to_parameters(
+                self.buffers[idx].to(self.swag_model.mean.device),
+                _floating_buffers(self.model),
+            )
+        return self.model
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def pop(self, idx):
+        if idx >= len(self.seeds):
+            return self.extra_models.pop(idx - len(self.seeds))
+        self.seeds.pop(idx)
+        if self.buffers is not None:
+            self.buffers = torch.cat([self.buffers[:idx], self.buffers[idx + 1 :]])
+
+
 """bn update."""
 
 
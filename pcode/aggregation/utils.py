@@ -124,3 +124,32 @@ def get_random_guess_perf(conf):
         return 1 / 1000 * SCALING_FACTOR
     else:
         raise NotImplementedError
+
+
+def get_fednova_norm(conf, n_local_steps):
+    """The (effective) # of local steps of a client for FedNova (Wang et al., 2020):
+    the momentum of the local sgd accumulates the gradients of the previous steps."""
+    rho = conf.momentum_factor if conf.optimizer == "sgd" else 0.0
+    if rho <= 0:
+        return float(n_local_steps)
+    return (n_local_steps - rho * (1 - rho ** n_local_steps) / (1 - rho)) / (1 - rho)
+
+
+def normalize_local_updates(conf, flatten_local_models, flatten_global_models, local_steps):
+    """FedNova: rescale each local update (x_i - x) by tau_eff / a_i in place, where a_i is the
+    normalized # of local steps of the client and tau_eff the average over the clients;
+    then the (uniform) averaging of the local models is not biased to the clients with more local steps.
+    """
+    norms = dict(
+        (client_id, get_fednova_norm(conf, n_local_steps))
+        for client_id, n_local_steps in local_steps.items()
+    )
+    tau_eff = np.mean(list(norms.values()))
+    for client_id, flatten_local_model in flatten_local_models.items():
+        if norms[client_id] <= 0:
+            continue
+        global_buffer = flatten_global_models[client_id].buffer
+        flatten_local_model.buffer.sub_(global_buffer).mul_(
+            tau_eff / norms[client_id]
+        ).add_(global_buffer)
+    return tau_eff
@@ -20,8 +20,15 @@ class Coordinator(object):
             )
 
     def update_perf(self, performance):
+        # the performance can be a `MathDict` (which has no `.get`).
+        performance = dict(performance.items())
         for name, perf in performance.items():
-            self.best_trackers[name].update(perf, self.conf.graph.comm_round)
+            # the `{name}_ci` of an estimated performance is its confidence interval (half-width).
+            if name.endswith("_ci"):
+                continue
+            self.best_trackers[name].update(
+                perf, self.conf.graph.comm_round, interval=performance.get(f"{name}_ci")
+            )
 
     def __call__(self):
         return dict(
@@ -1,8 +1,17 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 import torch
 
-from pcode.datasets.partition_data import DataPartitioner
+from pcode.datasets.partition_data import DataPartitioner, Partition
 from pcode.datasets.prepare_data import get_dataset
+from pcode.datasets.loader.utils import get_lmdb_dataset, LMDBBatchSampler
+from pcode.datasets.loader.tensor_cache import get_cached_tensor_loader
+from pcode.datasets.loader.token_cache import (
+    get_token_dataset,
+    get_token_lengths,
+    pad_token_batch,
+    LengthBucketBatchSampler,
+)
 import pcode.datasets.mixup_data as mixup
 
 
@@ -178,19 +187,52 @@ def define_data_loader(
             data_to_load = dataset
         conf.logger.log("Data partition for validation/test.")
 
+    # the pre-tokenized text datasets (only built with `token_cache_dir`).
+    token_dataset = (
+        get_token_dataset(data_to_load) if conf.token_cache_dir is not None else None
+    )
     if conf.batch_padding:
         from pcode.datasets.loader.entity_datasets import pad
         padding = pad
+    elif token_dataset is not None:
+        # the pre-tokenized samples are unpadded.
+        padding = pad_token_batch
     else:
         padding = None
     # use Dataloader.
+    if conf.length_bucketing and token_dataset is not None:
+        # batch the samples of similar lengths together to minimize the padding.
+        batching_kwargs = {
+            "batch_sampler": LengthBucketBatchSampler(
+                get_token_lengths(data_to_load),
+                batch_size=conf.batch_size,
+                shuffle=shuffle,
+                drop_last=False,
+                random_state=conf.random_state,
+            )
+        }
+    elif conf.lmdb_batch_read and get_lmdb_dataset(data_to_load) is not None:
+        # read each batch from lmdb by (sorted) contiguous cursor walks.
+        batching_kwargs = {
+            "batch_sampler": LMDBBatchSampler(
+                data_to_load,
+                batch_size=conf.batch_size,
+                shuffle=shuffle,
+                drop_last=False,
+                random_state=conf.random_state,
+            )
+        }
+    else:
+        batching_kwargs = {
+            "batch_size": conf.batch_size,
+            "shuffle": shuffle,
+            "drop_last": False,
+        }
     data_loader = torch.utils.data.DataLoader(
         data_to_load,
-        batch_size=conf.batch_size,
-        shuffle=shuffle,
+        **batching_kwargs,
         num_workers=conf.num_workers,
         pin_memory=conf.pin_memory,
-        drop_last=False,
         collate_fn = padding,
         multiprocessing_context = 'fork'
     )
@@ -210,3 +252,137 @@ def define_data_loader(
         conf.num_batches_per_device_per_epoch * conf.local_n_epochs
     )
     return data_loader, data_partitioner
+
+
+def define_user_test_loader(conf, dataset, localdata_ids):
+    """Define one (shared) test loader over the samples of several users of a partitioned_by_user
+    dataset (instead of one loader per user); the samples are evaluated in large mixed batches,
+    and `data_loader.group_indices` maps each sample (in order) to its user for the per-user stat."""
+    dataset.use_all_users()
+    user_sample_indices = dataset.get_user_indices(localdata_ids)
+    data_to_load = Partition(
+        dataset,
+        np.concatenate(user_sample_indices).tolist()
+        if len(user_sample_indices) > 0
+        else [],
+    )
+    data_loader = torch.utils.data.DataLoader(
+        data_to_load,
+        batch_size=conf.eval_batch_size,
+        shuffle=False,
+        drop_last=False,
+        num_workers=conf.num_workers,
+        pin_memory=conf.pin_memory,
+        multiprocessing_context="fork" if conf.num_workers > 0 else None,
+    )
+    data_loader.group_indices = np.repeat(
+        np.arange(len(user_sample_indices)),
+        [len(indices) for indices in user_sample_indices],
+    )
+
+    conf.logger.log(
+        "\tData stat for validation/test: # of samples={} for {} users. # of batches={}. The batch size={}".format(
+            len(data_to_load), len(user_sample_indices), len(data_loader), conf.eval_batch_size
+        )
+    )
+    return data_loader
+
+
+def define_stratified_test_loader(conf, dataset, subset_size, random_state):
+    """Define the test loader of a fixed subset (stratified by the classes) of the test dataset;
+    the `group_*` attributes of the data_loader allow to estimate the performance on the whole
+    test dataset with a confidence interval."""
+    if not hasattr(dataset, "targets"):
+        return None
+    targets = np.asarray(dataset.targets)
+    _, class_of_samples, class_sizes = np.unique(
+        targets, return_inverse=True, return_counts=True
+    )
+
+    # proportional allocation (at least two samples per class to estimate the variance).
+    n_samples_per_class = np.minimum(
+        np.maximum(np.round(subset_size * class_sizes / len(targets)), 2), class_sizes
+    ).astype(int)
+    indices = [
+        np.sort(
+            random_state.choice(
+                np.nonzero(class_of_samples == class_idx)[0], n_samples, replace=False
+            )
+        )
+        for class_idx, n_samples in enumerate(n_samples_per_class)
+    ]
+    data_to_load = Partition(dataset, np.concatenate(indices).tolist())
+    data_loader = torch.utils.data.DataLoader(
+        data_to_load,
+        batch_size=conf.eval_batch_size,
+        shuffle=False,
+        drop_last=False,
+        num_workers=conf.num_workers,
+        pin_memory=conf.pin_memory,
+        multiprocessing_context="fork" if conf.num_workers > 0 else None,
+    )
+    data_loader.group_indices = np.repeat(
+        np.arange(len(class_sizes)), n_samples_per_class
+    )
+    data_loader.group_weights = class_sizes / len(targets)
+    data_loader.group_sizes = class_sizes
+    data_loader.confidence = conf.eval_confidence
+
+    conf.logger.log(
+        "\tData stat for validation/test: # of samples={} (stratified from {}). # of batches={}. The batch size={}".format(
+            len(data_to_load), len(targets), len(data_loader), conf.eval_batch_size
+        )
+    )
+    return data_loader
+
+
+def define_calibration_loader(conf, dataset, subset_size, random_state):
+    """Define the loader of a fixed small random subset of the training dataset,
+    to recalibrate the bn statistics of the (aggregated) models; the preprocessed samples
+    are materialized once, so that the recalibration is pure model compute."""
+    if conf.partitioned_by_user:
+        # the current (user) view of the dataset can be empty, i.e. sample from all users.
+        dataset.use_all_users()
+    indices = np.sort(
+        random_state.choice(len(dataset), min(subset_size, len(dataset)), replace=False)
+    )
+    data_loader = torch.utils.data.DataLoader(
+        Partition(dataset, indices.tolist()),
+        batch_size=conf.batch_size,
+        shuffle=False,
+        drop_last=False,
+        num_workers=conf.num_workers,
+        pin_memory=conf.pin_memory,
+        multiprocessing_context="fork" if conf.num_workers > 0 else None,
+    )
+    conf.logger.log(
+        "\tData stat for the bn recalibration: # of samples={}. # of batches={}. The batch size={}".format(
+            len(indices), len(data_loader), conf.batch_size
+        )
+    )
+    return get_cached_tensor_loader(
+        data_loader,
+        batch_size=conf.batch_size,
+        dtype="float32",
+        num_workers=conf.num_workers,
+    )
+
+
+def define_cached_test_loader(conf, data_loader):
+    """Materialize the preprocessed samples of the (reused) test loader once
+    (the test transforms are deterministic), so that the evaluation is pure model compute."""
+    if conf.test_tensor_cache is None:
+        return data_loader
+    cached_loader = get_cached_tensor_loader(
+        data_loader,
+        batch_size=conf.eval_batch_size,
+        dtype=conf.test_tensor_cache,
+        num_workers=conf.num_workers,
+        cache_dir=conf.test_tensor_cache_dir,
+        config={"data": conf.data, "img_size": conf.img_size, "pn_normalize": conf.pn_normalize},
+    )
+    if cached_loader is not data_loader:
+        conf.logger.log(
+            f"\tCached the test tensors ({conf.test_tensor_cache}): # of samples={len(data_loader.dataset)}."
+        )
+    return cached_loader
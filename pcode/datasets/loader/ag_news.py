@@ -1,8 +1,12 @@
 from tqdm import tqdm
+import numpy as np
+import torch
 from datasets import load_dataset
 from transformers import DistilBertTokenizer
 from torch.utils.data import Dataset
 
+from pcode.datasets.loader.token_cache import get_token_cache
+
 
 def tokenize(sentences, tokenizer):
     input_ids, input_masks, input_segments = [], [], []
@@ -15,7 +19,7 @@ def tokenize(sentences, tokenizer):
 
 
 class AG_news(Dataset):
-    def __init__(self, split,max_length=128):
+    def __init__(self, split,max_length=128,cache_prefix=None):
         self.tokenizer = DistilBertTokenizer.from_pretrained('distilbert-base-uncased', mirror='tuna',
                                                              do_lower_case=True, add_special_tokens=True,
                                                              pad_to_max_length=True,
@@ -25,9 +29,24 @@ class AG_news(Dataset):
         self.text = dataset['text']
         self.targets = dataset['label']
         self.max_length = max_length
+
+        # tokenize (once) into the memory-mapped cache; the cached samples are unpadded.
+        self.token_cache = (
+            get_token_cache(f"{cache_prefix}_{split}_{max_length}", self.text, self.encode)
+            if cache_prefix is not None
+            else None
+        )
         # tokenize(self.text,self.tokenizer)
         # self.tokenize(dataset['text'],self.tokenizer)
 
+    def encode(self, sentence):
+        return self.tokenizer.encode(sentence, add_special_tokens=True, truncation=True,
+                                     max_length=self.max_length)
+
+    @property
+    def token_lengths(self):
+        return self.token_cache.lengths
+
     def tokenize(self, sentence):
         inputs = self.tokenizer.encode_plus(sentence, add_special_tokens=True, return_tensors='pt',
                                             max_length=self.max_length, pad_to_max_length=True)
@@ -37,6 +56,9 @@ class AG_news(Dataset):
         return len(self.targets)
 
     def __getitem__(self, index):
-        input = self.tokenize(self.text[index])
+        if self.token_cache is not None:
+            input = torch.from_numpy(self.token_cache[index].astype(np.int64))
+        else:
+            input = self.tokenize(self.text[index])
         target = self.targets[index]
         return input, target
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import torchvision.datasets as datasets
+
+from pcode.datasets.loader.preprocess_toolkit import numpy_to_tensor
+
+
+def define_cifar_folder(
+    name, root, is_train, transform, target_transform, download, tensor_native=False
+):
+    if name == "cifar10":
+        dataset_loader = CIFAR10 if tensor_native else datasets.CIFAR10
+    elif name == "cifar100":
+        dataset_loader = CIFAR100 if tensor_native else datasets.CIFAR100
+    else:
+        raise NotImplementedError
+    return dataset_loader(
+        root=root,
+        train=is_train,
+        transform=transform,
+        target_transform=target_transform,
+        download=download,
+    )
+
+
+class TensorNativeCIFARMixin(object):
+    """Return the image as a uint8 [C, H, W] tensor (rather than a PIL Image),
+    to be consumed by the tensor-native transforms."""
+
+    def __getitem__(self, index):
+        img, target = numpy_to_tensor(self.data[index]), self.targets[index]
+
+        if self.transform is not None:
+            img = self.transform(img)
+
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return img, target
+
+
+class CIFAR10(TensorNativeCIFARMixin, datasets.CIFAR10):
+    pass
+
+
+class CIFAR100(TensorNativeCIFARMixin, datasets.CIFAR100):
+    pass
@@ -2,7 +2,10 @@ from tqdm import tqdm
 from datasets import load_dataset
 from transformers import DistilBertTokenizer
 from torch.utils.data import Dataset
+
+from pcode.datasets.loader.token_cache import get_token_cache
 import numpy as np
+import torch
 
 def tokenize(
     examples,
@@ -66,7 +69,7 @@ def tokenize(
 
 
 class dbpedia_14(Dataset):
-    def __init__(self, split,random_state,max_length=128):
+    def __init__(self, split,random_state,max_length=128,cache_prefix=None):
         self.tokenizer = DistilBertTokenizer.from_pretrained('distilbert-base-uncased', mirror='tuna',
                                                              do_lower_case=True, add_special_tokens=True,
                                                              pad_to_max_length=True,return_attention_mask=True,
@@ -77,6 +80,13 @@ class dbpedia_14(Dataset):
         self.text = dataset['content']
         self.targets = dataset['label']
         self.max_length = max_length
+
+        # tokenize (once) into the memory-mapped cache; the cached samples are unpadded.
+        self.token_cache = (
+            get_token_cache(f"{cache_prefix}_{split}_{max_length}", self.text, self.encode)
+            if cache_prefix is not None
+            else None
+        )
         self.features = []
         #self.features = tokenize(self.text,self.tokenizer,self.max_length)
         #self.tokenize_all(self.text,self.tokenizer)
@@ -84,6 +94,14 @@ class dbpedia_14(Dataset):
         # self.tokenize(dataset['text'],self.tokenizer)
 
 
+    def encode(self, sentence):
+        return self.tokenizer.encode(sentence, add_special_tokens=True, truncation=True,
+                                     max_length=self.max_length)
+
+    @property
+    def token_lengths(self):
+        return self.token_cache.lengths
+
     def tokenize(self, sentence):
         inputs = self.tokenizer.encode_plus(sentence, add_special_tokens=True, return_tensors='pt',
                                             max_length=self.max_length, pad_to_max_length=True)
@@ -93,7 +111,9 @@ class dbpedia_14(Dataset):
         return len(self.targets)
 
     def __getitem__(self, index):
-        if len(self.features) > 0:
+        if self.token_cache is not None:
+            input = torch.from_numpy(self.token_cache[index].astype(np.int64))
+        elif len(self.features) > 0:
             input = self.features[index]
         else:
             input = self.tokenize(self.text[index])
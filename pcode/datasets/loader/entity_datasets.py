@@ -95,11 +95,9 @@ class EntityDataset(data.Dataset):
         right_zs = [self.tokenizer.encode(text=attributes[1][i], add_special_tokens=True, max_length=self.max_len)
                     for i in range(self.attr_num)]
 
-        masks = [torch.zeros(self.tokenizer.vocab_size, dtype=torch.int)
-                 for _ in range(self.attr_num)]
+        masks = torch.zeros(self.attr_num, self.tokenizer.vocab_size, dtype=torch.int)
         for i in range(self.attr_num):
-            masks[i][xs[i]] = 1
-        masks = torch.stack(masks)
+            masks[i][torch.as_tensor(np.asarray(xs[i], dtype=np.int64))] = 1
 
         y = self.tag2idx[tags]  # label
 
@@ -114,17 +112,17 @@ class EntityDataset(data.Dataset):
 
 def pad(batch):
     f = lambda x: [sample[x] for sample in batch]
-    g = lambda x, seqlen, val: \
-        [[sample + [val] * (seqlen - len(sample)) \
-          for sample in samples[x]]
-         for samples in batch]  # 0: <pad>
 
     # get maximal sequence length
     seqlens = f(3)
     maxlen = np.array(seqlens).max()
 
     #words = f(0)
-    xs = torch.LongTensor(g(1, maxlen, 0))
+    # fill the (0: <pad>) padded [batch, attr_num, maxlen] tensor.
+    xs = torch.zeros(len(batch), len(batch[0][1]), maxlen, dtype=torch.long)
+    for batch_idx, sample in enumerate(batch):
+        for attr_idx, x in enumerate(sample[1]):
+            xs[batch_idx, attr_idx, :len(x)] = torch.as_tensor(np.asarray(x, dtype=np.int64))
     y = f(2)
     masks = torch.stack(f(4))
 
@@ -16,14 +16,19 @@ import torch.utils.data as data
 import torchvision
 import torchvision.datasets.utils as data_utils
 
+from pcode.datasets.loader.preprocess_toolkit import numpy_to_tensor
 
-def define_femnist_folder(root, is_train, transform, target_transform, download):
+
+def define_femnist_folder(
+    root, is_train, transform, target_transform, download, tensor_native=False
+):
     return FEMNIST(
         root=root,
         is_train=is_train,
         transform=transform,
         target_transform=target_transform,
         is_download=download,
+        tensor_native=tensor_native,
     )
 
 
@@ -53,12 +58,15 @@ class FEMNIST(data.Dataset):
         min_samples_per_user=128,
         split_by_sample=True,
         train_split_ratio=0.9,
+        tensor_native=False,
     ):
         self.root = root
         self.train = is_train
         self.transform = transform
         self.target_transform = target_transform
         self.download = is_download
+        # return uint8 [1, H, W] tensors instead of PIL Images.
+        self.tensor_native = tensor_native
 
         self.data_fraction = data_fraction
         self.is_iid_sample = is_iid_sample
@@ -754,34 +762,117 @@ class FEMNIST(data.Dataset):
             self.meta_data,
         ) = self._load_meta_data_and_display_stat(splitted_data_paths)
 
-    def set_user(self, client_id):
-        tr_users = self.meta_data["tr_meta_data"]["users"]
-        tr_num_samples = self.meta_data["tr_meta_data"]["num_samples"]
-        tr_users_and_num_samples = list(zip(tr_users, tr_num_samples))
-
-        # filter out users based on the train dataset.
-        tr_users_and_num_samples = [
-            (user, num_samples)
-            for user, num_samples in tr_users_and_num_samples
+        # pack the per-user json files (once) and build the per-user index.
+        self._load_packed_data(self._pack_data(self.data_path))
+
+    def _pack_data(self, data_path):
+        """Pack the per-user json files of one split into a single uint8 array.
+
+        The images are stored as `[N, img_size, img_size]` uint8 in `{data_path}_packed_x.npy`
+        (users are stored contiguously), the labels in `{data_path}_packed_y.npy`,
+        and the `(user, offset, num_samples)` index in `{data_path}_packed_index.json`.
+        The index is written last and acts as the completion marker.
+        """
+        packed_paths = {
+            "x": data_path + "_packed_x.npy",
+            "y": data_path + "_packed_y.npy",
+            "index": data_path + "_packed_index.json",
+        }
+        if all(os.path.exists(path) for path in packed_paths.values()):
+            return packed_paths
+
+        meta_data = self.meta_data["tr_meta_data" if self.train else "te_meta_data"]
+        users, num_samples = meta_data["users"], meta_data["num_samples"]
+        offsets = np.concatenate([[0], np.cumsum(num_samples)]).astype(np.int64)
+        print(
+            f"pack {len(users)} users ({offsets[-1]} samples) from {data_path} to {packed_paths['x']}."
+        )
+
+        # all ranks may pack the data concurrently: each process writes its own tmp files,
+        # and atomically renames them at the end (the index last).
+        tmp_paths = dict(
+            (name, f"{path}.{os.getpid()}.tmp") for name, path in packed_paths.items()
+        )
+        tmp_x_path = tmp_paths["x"] + ".npy"
+        packed_x = np.lib.format.open_memmap(
+            tmp_x_path,
+            mode="w+",
+            dtype=np.uint8,
+            shape=(int(offsets[-1]), self.img_size, self.img_size),
+        )
+        packed_y = np.zeros(int(offsets[-1]), dtype=np.int64)
+        for idx, user in enumerate(users):
+            data = load_json(os.path.join(data_path, f"{user}.json"))["user_data"]
+            start, end = offsets[idx], offsets[idx + 1]
+            assert len(data["y"]) == end - start
+            # the pixel values were scaled to [0, 1] when building the json files.
+            packed_x[start:end] = np.rint(
+                np.asarray(data["x"], dtype=np.float32).reshape(
+                    -1, self.img_size, self.img_size
+                )
+                * 255
+            ).astype(np.uint8)
+            packed_y[start:end] = data["y"]
+        packed_x.flush()
+        del packed_x
+        np.save(tmp_paths["y"] + ".npy", packed_y)
+        jump_json(
+            {"users": users, "offsets": offsets.tolist(), "num_samples": num_samples},
+            tmp_paths["index"],
+        )
+        os.replace(tmp_x_path, packed_paths["x"])
+        os.replace(tmp_paths["y"] + ".npy", packed_paths["y"])
+        os.replace(tmp_paths["index"], packed_paths["index"])
+        return packed_paths
+
+    def _load_packed_data(self, packed_paths):
+        self.packed_x = np.load(packed_paths["x"], mmap_mode="r")
+        self.packed_y = np.load(packed_paths["y"])
+        packed_index = load_json(packed_paths["index"])
+        user2offset = dict(zip(packed_index["users"], packed_index["offsets"][:-1]))
+        user2num_samples = dict(
+            zip(packed_index["users"], packed_index["num_samples"])
+        )
+
+        # filter out users based on the train dataset (i.e. the client_id -> user map),
+        # and resolve the (offset, num_samples) of the current split.
+        self.user_slices = [
+            (user, user2offset[user], user2num_samples[user])
+            for user, num_samples in zip(
+                self.meta_data["tr_meta_data"]["users"],
+                self.meta_data["tr_meta_data"]["num_samples"],
+            )
             if num_samples > self.min_samples_per_user
         ]
 
+    def set_user(self, client_id):
         # extract the correct user.
-        user, num_samples = tr_users_and_num_samples[client_id]
-
-        # load the data.
-        data_path = os.path.join(self.data_path, f"{user}.json")
-        data = load_json(data_path)
+        user, offset, num_samples = self.user_slices[client_id]
 
-        # build the self.data and self.target.
-        self.data = data["user_data"]["x"]
-        self.targets = data["user_data"]["y"]
+        # build the self.data and self.target (views of the packed arrays).
+        self.data = self.packed_x[offset : offset + num_samples]
+        self.targets = self.packed_y[offset : offset + num_samples]
 
         # some stat.
         self.data_size = len(self.data)
         unique_elements, counts_elements = np.unique(self.targets, return_counts=True)
         print(f"label stat: {list(zip(unique_elements, counts_elements))}")
 
+    def use_all_users(self):
+        """index the samples of all users, i.e. the (shared) view used with `get_user_indices`."""
+        self.data = self.packed_x
+        self.targets = self.packed_y
+        self.data_size = len(self.data)
+
+    def get_user_indices(self, client_ids):
+        """return the indices (of the `use_all_users` view) of the samples of each client."""
+        return [
+            np.arange(offset, offset + num_samples)
+            for _, offset, num_samples in (
+                self.user_slices[client_id] for client_id in client_ids
+            )
+        ]
+
     def __getitem__(self, index):
         """
         Args:
@@ -792,11 +883,13 @@ class FEMNIST(data.Dataset):
         """
         assert hasattr(self, "data") and hasattr(self, "targets")
         img, target = self.data[index], int(self.targets[index])
-        img = np.array(img).reshape(self.img_size, self.img_size)
 
-        # doing this so that it is consistent with all other datasets
-        # to return a PIL Image
-        img = Image.fromarray(img, mode="L")
+        if self.tensor_native:
+            img = numpy_to_tensor(img)
+        else:
+            # doing this so that it is consistent with all other datasets
+            # to return a PIL Image
+            img = Image.fromarray(np.asarray(img), mode="L")
 
         if self.transform is not None:
             img = self.transform(img)
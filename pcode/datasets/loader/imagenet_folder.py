@@ -8,7 +8,7 @@ import torch.utils.data as data
 import torchvision.datasets as datasets
 from torchvision.datasets.utils import check_integrity
 
-from pcode.datasets.loader.preprocess_toolkit import get_transform
+from pcode.datasets.loader.preprocess_toolkit import get_transform, numpy_to_tensor
 from pcode.datasets.loader.utils import LMDBPT
 
 
@@ -62,13 +62,21 @@ class ImageNetDS(data.Dataset):
     test_list = [["val_data", ""]]
 
     def __init__(
-        self, root, img_size, train=True, transform=None, target_transform=None
+        self,
+        root,
+        img_size,
+        train=True,
+        transform=None,
+        target_transform=None,
+        tensor_native=False,
     ):
         self.root = os.path.expanduser(root)
         self.transform = transform
         self.target_transform = target_transform
         self.train = train  # training set or test set
         self.img_size = img_size
+        # return uint8 [C, H, W] tensors instead of PIL Images.
+        self.tensor_native = tensor_native
 
         #self.base_folder = self.base_folder.format(img_size)
 
@@ -111,8 +119,11 @@ class ImageNetDS(data.Dataset):
         else:
             img, target = self.data[index], self.targets[index]
 
-        # doing this so that it is consistent with all other datasets to return a PIL Image
-        img = Image.fromarray(img)
+        if self.tensor_native:
+            img = numpy_to_tensor(img)
+        else:
+            # doing this so that it is consistent with all other datasets to return a PIL Image
+            img = Image.fromarray(img)
 
         if self.transform is not None:
             img = self.transform(img)
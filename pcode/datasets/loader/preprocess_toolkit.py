@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 import random
 
+import numpy as np
 import torch
+import torch.nn.functional as F
 import torchvision.transforms as transforms
 
 
@@ -134,6 +136,151 @@ def get_transform(
             )
 
 
+def define_tensor_transform(
+    augment,
+    input_size=None,
+    padding=0,
+    resize=None,
+    normalize=None,
+    color_process=False,
+):
+    """Compose the tensor-native transforms.
+
+    The input is a uint8 tensor of shape [C, H, W] or [B, C, H, W]
+    (the random transforms are then drawn per sample);
+    the crop/flip are performed on uint8, the rest on float in [0, 1].
+    """
+    t_list = []
+    if input_size is not None:
+        if augment:
+            t_list += [
+                TensorRandomCrop(input_size, padding=padding),
+                TensorRandomHorizontalFlip(),
+            ]
+        else:
+            t_list += [TensorCenterCrop(input_size)]
+    t_list += [TensorToFloat()]
+    if resize is not None:
+        t_list += [TensorResize(resize)]
+    if augment and color_process:
+        t_list += [
+            ColorJitter(brightness=0.4, contrast=0.4, saturation=0.4),
+            Lighting(0.1, __imagenet_pca["eigval"], __imagenet_pca["eigvec"]),
+        ]
+    if normalize is not None:
+        t_list += [normalize]
+    return transforms.Compose(t_list)
+
+
+def numpy_to_tensor(img, channel_last=True):
+    """Convert a uint8 numpy image ([H, W], or [H, W, C] if channel_last else [C, H, W])
+    to a uint8 tensor of shape [C, H, W], without going through PIL."""
+    img = np.asarray(img)
+    if img.ndim == 2:
+        img = img[None]
+    elif channel_last:
+        img = img.transpose((2, 0, 1))
+    return torch.from_numpy(np.ascontiguousarray(img))
+
+
+def _as_size(size):
+    return (size, size) if isinstance(size, int) else tuple(size)
+
+
+class TensorToFloat(object):
+    def __call__(self, img):
+        if img.dtype == torch.uint8:
+            return img.float().div_(255)
+        return img.float()
+
+
+class TensorRandomCrop(object):
+    """Zero-pad and randomly crop, with an independent offset per sample."""
+
+    def __init__(self, size, padding=0):
+        self.size = _as_size(size)
+        self.padding = padding
+
+    def __call__(self, img):
+        if self.padding > 0:
+            img = F.pad(img, [self.padding] * 4)
+        height, width = img.shape[-2:]
+        crop_h, crop_w = self.size
+
+        if img.dim() == 3:
+            i = random.randint(0, height - crop_h)
+            j = random.randint(0, width - crop_w)
+            return img[:, i : i + crop_h, j : j + crop_w]
+
+        batch_size = img.shape[0]
+        rows = torch.randint(0, height - crop_h + 1, (batch_size, 1)) + torch.arange(
+            crop_h
+        )
+        cols = torch.randint(0, width - crop_w + 1, (batch_size, 1)) + torch.arange(
+            crop_w
+        )
+        # the advanced indices give [B, crop_h, crop_w, C].
+        img = img[
+            torch.arange(batch_size)[:, None, None],
+            :,
+            rows[:, :, None].to(img.device),
+            cols[:, None, :].to(img.device),
+        ]
+        return img.permute(0, 3, 1, 2)
+
+
+class TensorCenterCrop(object):
+    def __init__(self, size):
+        self.size = _as_size(size)
+
+    def __call__(self, img):
+        height, width = img.shape[-2:]
+        crop_h, crop_w = self.size
+        if (height, width) == (crop_h, crop_w):
+            return img
+        i, j = (height - crop_h) // 2, (width - crop_w) // 2
+        return img[..., i : i + crop_h, j : j + crop_w]
+
+
+class TensorRandomHorizontalFlip(object):
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def __call__(self, img):
+        if img.dim() == 3:
+            return img.flip(-1) if random.random() < self.p else img
+
+        is_flipped = torch.rand(img.shape[0], device=img.device) < self.p
+        return torch.where(is_flipped[:, None, None, None], img.flip(-1), img)
+
+
+class TensorResize(object):
+    """Bilinear (antialiased) resize of a float tensor."""
+
+    def __init__(self, size):
+        self.size = _as_size(size)
+
+    def __call__(self, img):
+        if tuple(img.shape[-2:]) == self.size:
+            return img
+        is_batch = img.dim() == 4
+        img = F.interpolate(
+            img if is_batch else img[None],
+            size=self.size,
+            mode="bilinear",
+            align_corners=False,
+            antialias=True,
+        )
+        return img if is_batch else img[0]
+
+
+def _sample_alpha(img, var):
+    # a scalar for a single image, and a per-sample [B, 1, 1, 1] tensor for a batch.
+    if img.dim() == 3:
+        return random.uniform(0, var)
+    return img.new_empty(img.shape[0], 1, 1, 1).uniform_(0, var)
+
+
 class Lighting(object):
     """Lighting noise(AlexNet - style PCA - based noise)"""
 
@@ -146,26 +293,24 @@ class Lighting(object):
         if self.alphastd == 0:
             return img
 
-        alpha = img.new().resize_(3).normal_(0, self.alphastd)
+        alpha = img.new_empty(img.shape[:-3] + (3,)).normal_(0, self.alphastd)
         rgb = (
             self.eigvec.type_as(img)
-            .clone()
-            .mul(alpha.view(1, 3).expand(3, 3))
-            .mul(self.eigval.view(1, 3).expand(3, 3))
-            .sum(1)
-            .squeeze()
-        )
+            * alpha.unsqueeze(-2)
+            * self.eigval.type_as(img).view(1, 3)
+        ).sum(-1)
 
-        return img.add(rgb.view(3, 1, 1).expand_as(img))
+        return img + rgb[..., None, None]
 
 
 class Grayscale(object):
     def __call__(self, img):
-        gs = img.clone()
-        gs[0].mul_(0.299).add_(0.587, gs[1]).add_(0.114, gs[2])
-        gs[1].copy_(gs[0])
-        gs[2].copy_(gs[0])
-        return gs
+        gs = (
+            img.select(-3, 0) * 0.299
+            + img.select(-3, 1) * 0.587
+            + img.select(-3, 2) * 0.114
+        )
+        return gs.unsqueeze(-3).expand_as(img).clone()
 
 
 class Saturation(object):
@@ -174,7 +319,7 @@ class Saturation(object):
 
     def __call__(self, img):
         gs = Grayscale()(img)
-        alpha = random.uniform(0, self.var)
+        alpha = _sample_alpha(img, self.var)
         return img.lerp(gs, alpha)
 
 
@@ -183,8 +328,8 @@ class Brightness(object):
         self.var = var
 
     def __call__(self, img):
-        gs = img.new().resize_as_(img).zero_()
-        alpha = random.uniform(0, self.var)
+        gs = torch.zeros_like(img)
+        alpha = _sample_alpha(img, self.var)
         return img.lerp(gs, alpha)
 
 
@@ -194,8 +339,8 @@ class Contrast(object):
 
     def __call__(self, img):
         gs = Grayscale()(img)
-        gs.fill_(gs.mean())
-        alpha = random.uniform(0, self.var)
+        gs = gs.mean(dim=(-3, -2, -1), keepdim=True).expand_as(img)
+        alpha = _sample_alpha(img, self.var)
         return img.lerp(gs, alpha)
 
 
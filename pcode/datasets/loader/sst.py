@@ -1,11 +1,15 @@
 from tqdm import tqdm
+import numpy as np
+import torch
 from datasets import load_dataset
 from transformers import DistilBertTokenizer
 from torch.utils.data import Dataset
 import pytreebank
 
+from pcode.datasets.loader.token_cache import get_token_cache
+
 class SST(Dataset):
-    def __init__(self, split,max_length=128):
+    def __init__(self, split,max_length=128,cache_prefix=None):
         self.tokenizer = DistilBertTokenizer.from_pretrained('distilbert-base-uncased', mirror='tuna',
                                                              do_lower_case=True, add_special_tokens=True,
                                                              pad_to_max_length=True,
@@ -20,6 +24,21 @@ class SST(Dataset):
         self.targets = [tree.label for tree in data]
         self.max_length = max_length
 
+        # tokenize (once) into the memory-mapped cache; the cached samples are unpadded.
+        self.token_cache = (
+            get_token_cache(f"{cache_prefix}_{split}_{max_length}", self.text, self.encode)
+            if cache_prefix is not None
+            else None
+        )
+
+    def encode(self, sentence):
+        return self.tokenizer.encode(sentence, add_special_tokens=True, truncation=True,
+                                     max_length=self.max_length)
+
+    @property
+    def token_lengths(self):
+        return self.token_cache.lengths
+
     def tokenize(self, sentence):
         inputs = self.tokenizer.encode_plus(sentence, add_special_tokens=True, return_tensors='pt',
                                             max_length=self.max_length, pad_to_max_length=True)
@@ -29,6 +48,9 @@ class SST(Dataset):
         return len(self.targets)
 
     def __getitem__(self, index):
-        input = self.tokenize(self.text[index])
+        if self.token_cache is not None:
+            input = torch.from_numpy(self.token_cache[index].astype(np.int64))
+        else:
+            input = self.tokenize(self.text[index])
         target = self.targets[index]
         return input, target
@@ -8,14 +8,19 @@ import numpy as np
 import torch.utils.data as data
 from torchvision.datasets.utils import download_url, check_integrity
 
+from pcode.datasets.loader.preprocess_toolkit import numpy_to_tensor
 
-def define_svhn_folder(root, is_train, transform, target_transform, download):
+
+def define_svhn_folder(
+    root, is_train, transform, target_transform, download, tensor_native=False
+):
     return SVHN(
         root=root,
         is_train=is_train,
         transform=transform,
         target_transform=target_transform,
         is_download=download,
+        tensor_native=tensor_native,
     )
 
 
@@ -71,12 +76,15 @@ class SVHN(data.Dataset):
         transform=None,
         target_transform=None,
         is_download=False,
+        tensor_native=False,
     ):
         self.root = os.path.expanduser(root)
         self.transform = transform
         self.target_transform = target_transform
         self.is_train = is_train  # training set or test set or extra set
         self.is_download = is_download
+        # return uint8 [C, H, W] tensors instead of PIL Images.
+        self.tensor_native = tensor_native
 
         if self.is_train:
             tr_data = self.load_svhn_data("train")
@@ -167,9 +175,12 @@ class SVHN(data.Dataset):
         """
         img, target = self.data[index], int(self.labels[index])
 
-        # doing this so that it is consistent with all other datasets
-        # to return a PIL Image
-        img = Image.fromarray(np.transpose(img, (1, 2, 0)))
+        if self.tensor_native:
+            img = numpy_to_tensor(img, channel_last=False)
+        else:
+            # doing this so that it is consistent with all other datasets
+            # to return a PIL Image
+            img = Image.fromarray(np.transpose(img, (1, 2, 0)))
 
         if self.transform is not None:
             img = self.transform(img)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+import os
+import enum
+import json
+import hashlib
+
+import numpy as np
+
+import torch
+import torch.utils.data as data
+
+from pcode.datasets.partition_data import Partition
+
+
+"""materialized (preprocessed) test tensors for the repeated evaluation."""
+
+
+class CachedTensorLoader(object):
+    """Iterate the preprocessed samples of a (deterministic) data_loader, which are materialized
+    once into a contiguous tensor (in memory or memory-mapped), in zero-copy batches.
+
+    The inputs can be stored in float32, float16, or uint8 with a per-sample-channel affine
+    (i.e. input = uint8 * scale + offset), and are converted back to float32 per batch.
+    The attributes of the source data_loader (e.g. the `group_indices`) are kept.
+    """
+
+    def __init__(self, inputs, targets, batch_size, scale=None, offset=None):
+        self.inputs = inputs
+        self.targets = targets
+        self.batch_size = batch_size
+        self.scale = scale
+        self.offset = offset
+
+    def __len__(self):
+        return (len(self.targets) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        for start in range(0, len(self.targets), self.batch_size):
+            end = start + self.batch_size
+            _input = self.inputs[start:end]
+            if self.scale is not None:
+                shape = _input.shape[:2] + (1,) * (_input.dim() - 2)
+                _input = (
+                    _input.float()
+                    .mul_(self.scale[start:end].view(shape))
+                    .add_(self.offset[start:end].view(shape))
+                )
+            elif _input.dtype != torch.float32:
+                _input = _input.float()
+            yield _input, self.targets[start:end]
+
+
+def _describe(obj):
+    """a stable description of the (transform) object, i.e. without the object addresses of its repr."""
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (list, tuple)):
+        return [_describe(x) for x in obj]
+    if isinstance(obj, dict):
+        return dict((str(k), _describe(v)) for k, v in obj.items())
+    if isinstance(obj, (torch.Tensor, np.ndarray)):
+        return obj.tolist()
+    if isinstance(obj, enum.Enum):
+        return str(obj)
+    if callable(obj) and hasattr(obj, "__qualname__"):
+        # e.g. the functions (and lambdas) of `transforms.Lambda`.
+        return f"{obj.__module__}.{obj.__qualname__}"
+    if hasattr(obj, "__dict__"):
+        return {
+            "type": type(obj).__name__,
+            "attrs": dict(
+                (k, _describe(v)) for k, v in vars(obj).items() if not k.startswith("_")
+            ),
+        }
+    return type(obj).__name__
+
+
+def _unwrap_dataset(dataset):
+    # the (nested) partitions select the samples of the underlying dataset.
+    indices = None
+    while isinstance(dataset, Partition):
+        _indices = np.asarray(dataset.indices, dtype=np.int64)
+        indices = _indices if indices is None else _indices[indices]
+        dataset = dataset.data
+    return dataset, indices
+
+
+def _get_cache_prefix(cache_dir, data_loader, dtype, config=None):
+    dataset, indices = _unwrap_dataset(data_loader.dataset)
+    config = {
+        "config": _describe(config),
+        "dataset": type(dataset).__name__,
+        "root": _describe(getattr(dataset, "root", None)),
+        "split": _describe(getattr(dataset, "split", getattr(dataset, "train", None))),
+        "n_samples": len(dataset),
+        "transform": _describe(getattr(dataset, "transform", None)),
+        "target_transform": _describe(getattr(dataset, "target_transform", None)),
+        "indices": hashlib.md5(
+            (indices if indices is not None else np.zeros(0, dtype=np.int64)).tobytes()
+        ).hexdigest(),
+        "dtype": dtype,
+    }
+    return os.path.join(
+        cache_dir,
+        "test_cache_" + hashlib.md5(json.dumps(config, sort_keys=True).encode()).hexdigest(),
+    )
+
+
+def _quantize(_input):
+    # per-sample-channel affine to uint8.
+    flatten = _input.reshape(_input.size(0), _input.size(1), -1)
+    offset = flatten.min(dim=-1)[0]
+    scale = (flatten.max(dim=-1)[0] - offset).clamp(min=1e-8) / 255.0
+    shape = scale.shape + (1,) * (_input.dim() - 2)
+    quantized = (
+        (_input - offset.view(shape)).div_(scale.view(shape)).round_().clamp_(0, 255)
+    )
+    return quantized.to(torch.uint8), scale, offset
+
+
+def _materialize(data_loader, batch_size, num_workers, dtype, prefix=None):
+    # iterate the samples in order (the group_indices of the data_loader are positional).
+    source_loader = data.DataLoader(
+        data_loader.dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        drop_last=False,
+        num_workers=num_workers,
+        collate_fn=getattr(data_loader, "collate_fn", None),
+    )
+    inputs, targets, scales, offsets = None, [], [], []
+    pointer = 0
+    for _input, _target in source_loader:
+        if not isinstance(_input, torch.Tensor):
+            # e.g. the (padded) text inputs cannot be stored contiguously.
+            return None
+        if inputs is None:
+            shape = (len(data_loader.dataset),) + tuple(_input.shape[1:])
+            if prefix is None:
+                inputs = torch.empty(shape, dtype=getattr(torch, dtype))
+            else:
+                # write the inputs to the memmap directly (they may not fit in memory).
+                inputs_memmap = np.lib.format.open_memmap(
+                    prefix + "_inputs.tmp.npy", mode="w+", dtype=dtype, shape=shape
+                )
+                inputs = torch.from_numpy(inputs_memmap)
+        if dtype == "uint8":
+            _input, scale, offset = _quantize(_input.float())
+            scales.append(scale)
+            offsets.append(offset)
+        inputs[pointer : pointer + len(_input)] = _input
+        targets.append(torch.as_tensor(_target))
+        pointer += len(_input)
+
+    if inputs is None:
+        return None
+    if prefix is not None:
+        inputs_memmap.flush()
+    arrays = {"inputs": inputs, "targets": torch.cat(targets)}
+    if dtype == "uint8":
+        arrays["scale"] = torch.cat(scales)
+        arrays["offset"] = torch.cat(offsets)
+    return arrays
+
+
+def get_cached_tensor_loader(
+    data_loader, batch_size, dtype="float32", num_workers=0, cache_dir=None, config=None
+):
+    """Materialize the data_loader (once) into the `CachedTensorLoader`;
+    the tensors are memory-mapped from `cache_dir` if given (keyed by the dataset, its transform,
+    and the `config` of the preprocessing).
+    Return the original data_loader if its inputs cannot be cached."""
+    assert dtype in ["float32", "float16", "uint8"]
+    prefix = (
+        _get_cache_prefix(cache_dir, data_loader, dtype, config)
+        if cache_dir is not None
+        else None
+    )
+
+    if prefix is not None and os.path.exists(prefix + "_index.json"):
+        names = json.load(open(prefix + "_index.json"))["names"]
+        arrays = dict(
+            (name, torch.from_numpy(np.load(f"{prefix}_{name}.npy", mmap_mode="c")))
+            for name in names
+        )
+    else:
+        if prefix is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        arrays = _materialize(data_loader, batch_size, num_workers, dtype, prefix)
+        if arrays is None:
+            return data_loader
+        if prefix is not None:
+            for name, array in arrays.items():
+                # the inputs are already written to the memmap.
+                if name != "inputs":
+                    np.save(f"{prefix}_{name}.tmp.npy", array.numpy())
+                os.replace(f"{prefix}_{name}.tmp.npy", f"{prefix}_{name}.npy")
+            # the index is written last and acts as the completion marker.
+            with open(prefix + "_index.json", "w") as f:
+                json.dump({"names": list(arrays.keys())}, f)
+            arrays = dict(
+                (name, torch.from_numpy(np.load(f"{prefix}_{name}.npy", mmap_mode="c")))
+                for name in arrays.keys()
+            )
+
+    cached_loader = CachedTensorLoader(
+        arrays["inputs"],
+        arrays["targets"],
+        batch_size=batch_size,
+        scale=arrays.get("scale", None),
+        offset=arrays.get("offset", None),
+    )
+    # keep the dataset and the (group) attributes of the data_loader.
+    cached_loader.dataset = data_loader.dataset
+    for name in ["group_indices", "group_weights", "group_sizes", "confidence"]:
+        if hasattr(data_loader, name):
+            setattr(cached_loader, name, getattr(data_loader, name))
+    return cached_loader
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+import torch
+import torch.utils.data as data
+
+from pcode.datasets.partition_data import Partition
+
+
+"""pre-tokenized (memory-mapped) cache for the text datasets."""
+
+
+class TokenCache(object):
+    """The token ids of a list of sequences, stored (unpadded) in a flat int32 array
+    `{prefix}_ids.npy` (memory-mapped), with the offsets index `{prefix}_offsets.npy`.
+    The offsets file is written last and acts as the completion marker.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.ids = np.load(prefix + "_ids.npy", mmap_mode="r")
+        self.offsets = np.load(prefix + "_offsets.npy")
+        self.lengths = np.diff(self.offsets)
+
+    @staticmethod
+    def exists(prefix):
+        return os.path.exists(prefix + "_ids.npy") and os.path.exists(
+            prefix + "_offsets.npy"
+        )
+
+    @classmethod
+    def build(cls, prefix, sequences):
+        print(f"build the token cache: {prefix}.")
+        offsets, ids = [0], []
+        for sequence in sequences:
+            ids.append(np.asarray(sequence, dtype=np.int32))
+            offsets.append(offsets[-1] + len(sequence))
+
+        # the ranks may build the cache concurrently: write to the per-process tmp files.
+        ids = np.concatenate(ids) if len(ids) > 0 else np.zeros(0, dtype=np.int32)
+        for name, array in [("ids", ids), ("offsets", np.asarray(offsets, dtype=np.int64))]:
+            tmp_path = f"{prefix}_{name}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, f"{prefix}_{name}.npy")
+        return cls(prefix)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        return self.ids[self.offsets[index] : self.offsets[index + 1]]
+
+
+def get_token_cache(prefix, texts, encode_fn):
+    """Load the token cache, or tokenize the texts (once) to build it."""
+    if TokenCache.exists(prefix):
+        return TokenCache(prefix)
+    return TokenCache.build(prefix, (encode_fn(text) for text in tqdm(texts)))
+
+
+def get_token_dataset(dataset):
+    """Return the underlying text dataset backed by a token cache (if any)."""
+    while getattr(dataset, "token_cache", None) is None:
+        # only walk the `Partition.data` (the `.data` of e.g. MNIST is the tensor of images).
+        if not isinstance(dataset, Partition):
+            return None
+        dataset = dataset.data
+    return dataset
+
+
+def get_token_lengths(dataset):
+    """Return the token lengths of a (partitioned) text dataset backed by a token cache."""
+    if getattr(dataset, "token_cache", None) is not None:
+        return dataset.token_lengths
+    if not isinstance(dataset, Partition):
+        return None
+    lengths = get_token_lengths(dataset.data)
+    if lengths is None:
+        return None
+    return lengths[np.asarray(dataset.indices, dtype=np.int64)]
+
+
+def pad_token_batch(batch, pad_token=0):
+    """Pad a batch of ((input_ids), target) to the longest sequence in the batch,
+    and return ([input_ids, attention_mask], targets); the inputs are a list,
+    as they are moved to the device in place (see `load_data_batch`)."""
+    sequences, targets = zip(*batch)
+    lengths = torch.as_tensor([len(sequence) for sequence in sequences])
+    input_ids = torch.full(
+        (len(sequences), int(lengths.max())), pad_token, dtype=torch.long
+    )
+    for idx, sequence in enumerate(sequences):
+        input_ids[idx, : len(sequence)] = torch.as_tensor(sequence)
+    attention_mask = (
+        torch.arange(input_ids.shape[1])[None, :] < lengths[:, None]
+    ).long()
+    return [input_ids, attention_mask], torch.as_tensor(targets)
+
+
+class LengthBucketBatchSampler(data.Sampler):
+    """Group the samples of similar lengths into the same batch (to minimize the padding).
+
+    The (shuffled) indices are cut into buckets of `batch_size * bucket_size_multiplier`
+    samples; each bucket is sorted by length and cut into batches,
+    and the order of all batches is shuffled.
+    """
+
+    def __init__(
+        self,
+        lengths,
+        batch_size,
+        shuffle=True,
+        drop_last=False,
+        bucket_size_multiplier=100,
+        random_state=None,
+    ):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.bucket_size = batch_size * bucket_size_multiplier
+        self.random_state = (
+            np.random.RandomState() if random_state is None else random_state
+        )
+
+    def __iter__(self):
+        indices = np.arange(len(self.lengths))
+        if self.shuffle:
+            indices = self.random_state.permutation(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = indices[start : start + self.bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind="stable")]
+            for batch_start in range(0, len(bucket), self.batch_size):
+                batch = bucket[batch_start : batch_start + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch.tolist())
+
+        if self.shuffle:
+            batches = [
+                batches[idx] for idx in self.random_state.permutation(len(batches))
+            ]
+        return iter(batches)
+
+    def __len__(self):
+        num_batches = 0
+        for start in range(0, len(self.lengths), self.bucket_size):
+            bucket_size = min(self.bucket_size, len(self.lengths) - start)
+            num_batches += (
+                bucket_size // self.batch_size
+                if self.drop_last
+                else (bucket_size + self.batch_size - 1) // self.batch_size
+            )
+        return num_batches
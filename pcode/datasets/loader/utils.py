@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import lmdb
 import cv2
 import numpy as np
 from PIL import Image
 
+import torch
 import torch.utils.data as data
 
 import pcode.datasets.loader.serialize as serialize
+from pcode.datasets.partition_data import Partition
 
 
 if sys.version_info[0] == 2:
@@ -27,6 +30,18 @@ def uint8_to_float(x):
     return x.float() / 128.0 - 1.0
 
 
+_decode_pools = {}
+
+
+def get_decode_pool(num_threads):
+    """The (per-process) thread pool used to decode a batch of lmdb records;
+    cv2/PIL release the GIL during decoding."""
+    key = (os.getpid(), num_threads)
+    if key not in _decode_pools:
+        _decode_pools[key] = ThreadPoolExecutor(max_workers=num_threads)
+    return _decode_pools[key]
+
+
 class LMDBPT(data.Dataset):
     """A class to load the LMDB file for extreme large datasets.
     Args:
@@ -62,7 +77,6 @@ class LMDBPT(data.Dataset):
         # build up indices.
         self.indices = np.cumsum([len(db) for db in self.dbs])
         self.length = self.indices[-1]
-        self._get_index_zones = self._build_indices()
 
     def _get_valid_lmdb_files(self):
         """get valid lmdb based on given root."""
@@ -73,22 +87,10 @@ class LMDBPT(data.Dataset):
         else:
             yield self.root
 
-    def _build_indices(self):
-        indices = self.indices
-        from_to_indices = enumerate(zip(indices[:-1], indices[1:]))
-
-        def f(x):
-            if len(list(from_to_indices)) == 0:
-                return 0, x
-
-            for ind, (from_index, to_index) in from_to_indices:
-                if from_index <= x and x < to_index:
-                    return ind, x - from_index
-
-        return f
-
     def _get_matched_index(self, index):
-        return self._get_index_zones(index)
+        block_index = int(np.searchsorted(self.indices, index, side="right"))
+        from_index = self.indices[block_index - 1] if block_index > 0 else 0
+        return block_index, index - from_index
 
     def __getitem__(self, index):
         """
@@ -101,6 +103,26 @@ class LMDBPT(data.Dataset):
         image, target = self.dbs[block_index][item_index]
         return image, target
 
+    def __getitems__(self, indices):
+        """Batched read (used by the DataLoader): group the indices by lmdb file
+        and let each file serve its part in one pass of its cursor."""
+        indices = np.asarray(indices, dtype=np.int64)
+        block_indices = np.searchsorted(self.indices, indices, side="right")
+        samples = [None] * len(indices)
+        for block_index in np.unique(block_indices):
+            positions = np.nonzero(block_indices == block_index)[0]
+            from_index = self.indices[block_index - 1] if block_index > 0 else 0
+            for position, sample in zip(
+                positions,
+                self.dbs[block_index].__getitems__(indices[positions] - from_index),
+            ):
+                samples[position] = sample
+        return samples
+
+    def get_batch(self, indices):
+        """Return the stacked (images, targets) of the given indices."""
+        return stack_samples(self.__getitems__(indices))
+
     def __len__(self):
         return self.length
 
@@ -120,11 +142,19 @@ class LMDBPT(data.Dataset):
 
 
 class LMDBPTClass(data.Dataset):
-    def __init__(self, root, transform=None, target_transform=None, is_image=True):
+    def __init__(
+        self,
+        root,
+        transform=None,
+        target_transform=None,
+        is_image=True,
+        num_decode_threads=4,
+    ):
         self.root = os.path.expanduser(root)
         self.transform = transform
         self.target_transform = target_transform
         self.is_image = is_image
+        self.num_decode_threads = num_decode_threads
 
         # open lmdb env.
         self.env = self._open_lmdb()
@@ -135,6 +165,11 @@ class LMDBPTClass(data.Dataset):
         # prepare cache_file
         self._prepare_cache()
 
+        # the persistent read-only txn; (re-)opened lazily in each process,
+        # as the lmdb env cannot be shared with the forked dataloader workers.
+        self._pid = os.getpid()
+        self._txn = None
+
     def _open_lmdb(self):
         return lmdb.open(
             self.root,
@@ -163,15 +198,61 @@ class LMDBPTClass(data.Dataset):
                 self.keys = [key for key, _ in txn.cursor() if key != b"__keys__"]
             pickle.dump(self.keys, open(cache_file, "wb"))
 
+    def _get_txn(self):
+        if self._pid != os.getpid():
+            # drop the env inherited from the parent (lmdb allows one env per path
+            # and process); with lock=False closing it does not affect the parent.
+            if self.env is not None:
+                self.env.close()
+            self.env, self._txn = self._open_lmdb(), None
+            self._pid = os.getpid()
+        if self._txn is None:
+            self._txn = self.env.begin(write=False, buffers=False)
+        return self._txn
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["env"], state["_txn"], state["_pid"] = None, None, None
+        return state
+
+    def _read_sorted(self, keys):
+        """Read the values of (sorted) keys by walking a single cursor,
+        i.e., a contiguous run of keys only costs `cursor.next()`."""
+        cursor = self._get_txn().cursor()
+        bin_files = []
+        for key in keys:
+            if cursor.key() != key and not (cursor.next() and cursor.key() == key):
+                cursor.set_key(key)
+            bin_files.append(cursor.value())
+        return bin_files
+
     def _image_decode(self, x):
         image = cv2.imdecode(x, cv2.IMREAD_COLOR).astype("uint8")
         return Image.fromarray(image, "RGB")
 
     def __getitem__(self, index):
-        env = self.env
-        with env.begin(write=False) as txn:
-            bin_file = txn.get(self.keys[index])
+        return self._load_item(self._get_txn().get(self.keys[index]))
+
+    def __getitems__(self, indices):
+        """Batched read (used by the DataLoader): read the records in key order
+        through one cursor, then decode them in a thread pool."""
+        indices = np.asarray(indices, dtype=np.int64)
+        order = np.argsort(indices, kind="stable")
+        bin_files = self._read_sorted([self.keys[index] for index in indices[order]])
+
+        samples = [None] * len(indices)
+        loaded_samples = get_decode_pool(self.num_decode_threads).map(
+            self._load_item, bin_files
+        )
+        for position, sample in zip(order, loaded_samples):
+            samples[position] = sample
+        return samples
+
+    def get_batch(self, indices):
+        """Return the stacked (images, targets) of the given indices."""
+        return stack_samples(self.__getitems__(indices))
 
+    def _load_item(self, bin_file):
         image, target = serialize.loads(bin_file)
         if self.is_image:
             image = cv2.imdecode(image, cv2.IMREAD_COLOR).astype("uint8")
@@ -192,3 +273,89 @@ class LMDBPTClass(data.Dataset):
 
     def __repr__(self):
         return self.__class__.__name__ + " (" + self.root + ")"
+
+
+def stack_samples(samples):
+    images, targets = zip(*samples)
+    return torch.stack(images), torch.as_tensor(targets)
+
+
+def get_lmdb_dataset(dataset):
+    """Return the underlying lmdb dataset (if any) of a (partitioned) dataset."""
+    while not isinstance(dataset, (LMDBPT, LMDBPTClass)):
+        # only walk the `Partition.data` (the `.data` of e.g. MNIST is the tensor of images).
+        if not isinstance(dataset, Partition):
+            return None
+        dataset = dataset.data
+    return dataset
+
+
+def get_lmdb_indices(dataset):
+    """Return the indices in the underlying lmdb dataset (i.e. in the key order)
+    of the samples of a (partitioned) dataset."""
+    if isinstance(dataset, Partition):
+        return get_lmdb_indices(dataset.data)[np.asarray(dataset.indices, dtype=np.int64)]
+    return np.arange(len(dataset))
+
+
+class LMDBBatchSampler(data.Sampler):
+    """A batch sampler that favors sequential lmdb reads.
+
+    The (shuffled) samples are cut into windows of `window_n_batches` batches;
+    each window is sorted by the lmdb index of its samples and cut into batches,
+    and the order of all batches is shuffled. Each batch is thus a random subset
+    (for `window_n_batches=1`, a uniformly random batch) whose keys are read in order
+    by the cursor walks, and a larger window trades the randomness for the contiguity.
+    """
+
+    def __init__(
+        self,
+        data_source,
+        batch_size,
+        shuffle=True,
+        drop_last=False,
+        window_n_batches=1,
+        random_state=None,
+    ):
+        self.data_source = data_source
+        self.lmdb_indices = get_lmdb_indices(data_source)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.window_size = batch_size * window_n_batches
+        self.random_state = (
+            np.random.RandomState() if random_state is None else random_state
+        )
+
+    def __iter__(self):
+        positions = np.arange(len(self.data_source))
+        if not self.shuffle:
+            # the batches follow the order of the samples (each batch is read in key order).
+            windows = [positions]
+        else:
+            positions = self.random_state.permutation(positions)
+            windows = [
+                positions[start : start + self.window_size]
+                for start in range(0, len(positions), self.window_size)
+            ]
+
+        batches = []
+        for window in windows:
+            if self.shuffle:
+                window = window[np.argsort(self.lmdb_indices[window], kind="stable")]
+            for start in range(0, len(window), self.batch_size):
+                batch = window[start : start + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch.tolist())
+
+        if self.shuffle:
+            batches = [
+                batches[idx] for idx in self.random_state.permutation(len(batches))
+            ]
+        return iter(batches)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.data_source) // self.batch_size
+        return (len(self.data_source) + self.batch_size - 1) // self.batch_size
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import os
+import json
 import math
+import hashlib
 import functools
 
 import numpy as np
@@ -26,6 +29,22 @@ class Partition(object):
         else:
             return (self.data[data_idx][0], self.replaced_targets[index])
 
+    def __getitems__(self, indices):
+        # forward the batched read to the underlying dataset (e.g. lmdb) if supported.
+        data_indices = [self.indices[index] for index in indices]
+        if hasattr(self.data, "__getitems__"):
+            samples = self.data.__getitems__(data_indices)
+        else:
+            samples = [self.data[data_idx] for data_idx in data_indices]
+
+        if self.replaced_targets is None:
+            return samples
+        else:
+            return [
+                (sample[0], self.replaced_targets[index])
+                for sample, index in zip(samples, indices)
+            ]
+
     def update_replaced_targets(self, replaced_targets):
         self.replaced_targets = replaced_targets
 
@@ -118,6 +137,12 @@ class DataPartitioner(object):
         self.partition_indices(indices)
 
     def partition_indices(self, indices):
+        # load the partitions from the on-disk cache (if any).
+        cache_prefix = self._get_cache_prefix(indices)
+        if cache_prefix is not None and self._is_cached(cache_prefix):
+            self._load_partitions(cache_prefix)
+            return
+
         if self.conf.graph.rank == 0:
             indices = self._create_indices(indices)
         if self.consistent_indices:
@@ -139,6 +164,128 @@ class DataPartitioner(object):
         except:
             print("failed to display the distribution")
 
+        # save the partitions to the on-disk cache.
+        if cache_prefix is not None and self.conf.graph.rank == 0:
+            self._save_partitions(cache_prefix)
+
+    def _get_cache_prefix(self, indices):
+        """The partitions are cached under `{partition_cache_dir}/partition_{hash}`,
+        where the hash covers the config that determines the partitions."""
+        if (
+            self.conf.partition_cache_dir is None
+            or self.partition_type == "origin"
+            or (not self.consistent_indices and self.conf.graph.rank != 0)
+        ):
+            return None
+
+        # the partitions are created by rank 0, i.e., use the seed of rank 0.
+        seed = self.conf.manual_seed
+        if not self.conf.same_seed_process:
+            seed = seed - self.conf.graph.rank
+        config = {
+            "data": self.conf.data,
+            "data_size": self.data_size,
+            "indices": hashlib.md5(
+                np.asarray(indices, dtype=np.int64).tobytes()
+            ).hexdigest(),
+            "partition_type": self.partition_type,
+            "partition_sizes": [float(size) for size in self.partition_sizes],
+            "non_iid_alpha": self.conf.non_iid_alpha
+            if self.partition_type == "non_iid_dirichlet"
+            else None,
+            "seed": seed,
+        }
+        config_hash = hashlib.md5(
+            json.dumps(config, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        return os.path.join(self.conf.partition_cache_dir, f"partition_{config_hash}")
+
+    def _is_cached(self, cache_prefix):
+        is_cached = os.path.exists(cache_prefix + "_table.npz")
+        if self.consistent_indices and dist.is_initialized():
+            # all ranks have to agree, as the non-cached path broadcasts the indices.
+            is_cached = torch.IntTensor([int(is_cached)])
+            dist.all_reduce(is_cached, op=dist.ReduceOp.MIN)
+            is_cached = bool(is_cached.item())
+        return is_cached
+
+    def _save_partitions(self, cache_prefix):
+        """Save the partitions as one int32 index array (`{prefix}_indices.npy`),
+        and a table (`{prefix}_table.npz`) of the per-partition offsets
+        and label histograms (as well as the random state after the partitioning).
+        The table is written last and acts as the completion marker."""
+        os.makedirs(self.conf.partition_cache_dir, exist_ok=True)
+        indices = np.concatenate(
+            [np.asarray(partition, dtype=np.int32) for partition in self.partitions]
+        )
+        offsets = np.cumsum(
+            [0] + [len(partition) for partition in self.partitions]
+        ).astype(np.int64)
+        try:
+            targets = np.asarray(self.data.targets)
+            classes = np.unique(targets)
+            histogram = np.stack(
+                [
+                    np.bincount(
+                        np.searchsorted(classes, targets[indices[start:end]]),
+                        minlength=len(classes),
+                    )
+                    for start, end in zip(offsets[:-1], offsets[1:])
+                ]
+            )
+        except:
+            classes, histogram = np.zeros(0), np.zeros((len(self.partitions), 0))
+        _, rng_keys, rng_pos, rng_has_gauss, rng_cached_gaussian = (
+            self.conf.random_state.get_state()
+        )
+
+        np.save(cache_prefix + "_indices.tmp.npy", indices)
+        os.replace(cache_prefix + "_indices.tmp.npy", cache_prefix + "_indices.npy")
+        np.savez(
+            cache_prefix + "_table.tmp.npz",
+            offsets=offsets,
+            classes=classes,
+            histogram=histogram,
+            rng_keys=rng_keys,
+            rng_meta=np.array([rng_pos, rng_has_gauss, rng_cached_gaussian]),
+        )
+        os.replace(cache_prefix + "_table.tmp.npz", cache_prefix + "_table.npz")
+
+    def _load_partitions(self, cache_prefix):
+        indices = np.load(cache_prefix + "_indices.npy", mmap_mode="r")
+        table = np.load(cache_prefix + "_table.npz")
+        offsets = table["offsets"]
+        self.partitions = [
+            indices[start:end] for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+        # restore the random state of rank 0 (as if the partitions were created).
+        if self.conf.graph.rank == 0:
+            rng_pos, rng_has_gauss, rng_cached_gaussian = table["rng_meta"]
+            self.conf.random_state.set_state(
+                (
+                    "MT19937",
+                    table["rng_keys"],
+                    int(rng_pos),
+                    int(rng_has_gauss),
+                    float(rng_cached_gaussian),
+                )
+            )
+
+        # display the class distribution over the partitions (from the histograms).
+        self.targets_of_partitions = {
+            idx: [
+                (_class, count)
+                for _class, count in zip(table["classes"], counts)
+                if count > 0
+            ]
+            for idx, counts in enumerate(table["histogram"])
+        }
+        if self.conf.graph.rank == 0:
+            self.conf.logger.log(
+                f"load the partitions from {cache_prefix}. the histogram of the targets in the partitions: {self.targets_of_partitions.items()}"
+            )
+
     def _create_indices(self, indices):
         if self.partition_type == "origin":
             pass
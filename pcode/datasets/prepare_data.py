@@ -7,6 +7,8 @@ import torchvision.transforms as transforms
 
 import pcode.datasets.loader.imagenet_folder as imagenet_folder
 import pcode.datasets.loader.pseudo_imagenet_folder as pseudo_imagenet_folder
+from pcode.datasets.loader.cifar_folder import define_cifar_folder
+from pcode.datasets.loader.preprocess_toolkit import define_tensor_transform
 from pcode.datasets.loader.svhn_folder import define_svhn_folder
 from pcode.datasets.loader.femnist import define_femnist_folder
 import pcode.utils.op_paths as op_paths
@@ -23,12 +25,10 @@ def _get_cifar(conf, name, root, split, transform, target_transform, download):
 
     # decide normalize parameter.
     if name == "cifar10":
-        dataset_loader = datasets.CIFAR10
         normalize = (
             transforms.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010))
         )
     elif name == "cifar100":
-        dataset_loader = datasets.CIFAR100
         normalize = (
             transforms.Normalize((0.5071, 0.4867, 0.4408), (0.2675, 0.2565, 0.2761))
         )
@@ -40,7 +40,15 @@ def _get_cifar(conf, name, root, split, transform, target_transform, download):
         normalize = None
 
     # decide data type.
-    if is_train:
+    if conf.tensor_transform:
+        transform = define_tensor_transform(
+            augment=is_train,
+            input_size=32,
+            padding=4,
+            resize=conf.img_size,
+            normalize=normalize,
+        )
+    elif is_train:
         transform = transforms.Compose(
             [
                 transforms.RandomCrop((32, 32), 4),
@@ -57,12 +65,14 @@ def _get_cifar(conf, name, root, split, transform, target_transform, download):
                 transforms.ToTensor(),
             ] + ([normalize] if normalize is not None else [])
         )
-    return dataset_loader(
+    return define_cifar_folder(
+        name=name,
         root=root,
-        train=is_train,
+        is_train=is_train,
         transform=transform,
         target_transform=target_transform,
         download=download,
+        tensor_native=conf.tensor_transform,
     )
 
 
@@ -193,15 +203,19 @@ def _get_svhn(conf, root, split, transform, target_transform, download):
         else None
     )
 
-    transform = transforms.Compose(
-        [transforms.ToTensor()] + ([normalize] if normalize is not None else [])
-    )
+    if conf.tensor_transform:
+        transform = define_tensor_transform(augment=False, normalize=normalize)
+    else:
+        transform = transforms.Compose(
+            [transforms.ToTensor()] + ([normalize] if normalize is not None else [])
+        )
     return define_svhn_folder(
         root=root,
         is_train=is_train,
         transform=transform,
         target_transform=target_transform,
         download=download,
+        tensor_native=conf.tensor_transform,
     )
 
 
@@ -211,13 +225,17 @@ def _get_femnist(conf, root, split, transform, target_transform, download):
             conf.pn_normalize is False
     ), "we've already normalize the image betwewen 0 and 1"
 
-    transform = transforms.Compose([transforms.ToTensor()])
+    if conf.tensor_transform:
+        transform = define_tensor_transform(augment=False)
+    else:
+        transform = transforms.Compose([transforms.ToTensor()])
     return define_femnist_folder(
         root=root,
         is_train=is_train,
         transform=transform,
         target_transform=target_transform,
         download=download,
+        tensor_native=conf.tensor_transform,
     )
 
 
@@ -240,7 +258,14 @@ def _get_imagenet(conf, name, datasets_path, split):
             else None
         )
 
-        if is_train:
+        if conf.tensor_transform and not conf.use_lmdb_data:
+            transform = define_tensor_transform(
+                augment=is_train,
+                input_size=downsampled_img_scale if is_train else None,
+                padding=4,
+                normalize=normalize,
+            )
+        elif is_train:
             transform = transforms.Compose(
                 [
                     transforms.RandomCrop(downsampled_img_scale, padding=4),
@@ -278,7 +303,11 @@ def _get_imagenet(conf, name, datasets_path, split):
     else:
         # root = os.path.join(root, "train" if is_train else "val")
         return imagenet_folder.ImageNetDS(
-            root=root, img_size=int(name[8:]), train=is_train, transform=transform
+            root=root,
+            img_size=int(name[8:]),
+            train=is_train,
+            transform=transform,
+            tensor_native=conf.tensor_transform and is_downsampled,
         )
 
 
@@ -309,6 +338,26 @@ def _get_pseudo_imagenet(conf, root, split="train"):
     )
 
 
+def _get_text(conf, name, split):
+    # the samples are tokenized (once) into the memory-mapped caches of `token_cache_dir`.
+    cache_prefix = (
+        os.path.join(conf.token_cache_dir, name)
+        if conf.token_cache_dir is not None
+        else None
+    )
+    if conf.token_cache_dir is not None:
+        os.makedirs(conf.token_cache_dir, exist_ok=True)
+
+    if name == "ag_news":
+        return AG_news(split, cache_prefix=cache_prefix)
+    elif "dbpedia" in name:
+        return dbpedia_14(split, conf.random_state, cache_prefix=cache_prefix)
+    elif name == "sst":
+        return SST(split, cache_prefix=cache_prefix)
+    else:
+        raise NotImplementedError
+
+
 """the entry for different supported dataset."""
 
 
@@ -346,5 +395,7 @@ def get_dataset(
         return _get_pseudo_imagenet(conf, root, split)
     elif "imagenet" in name:
         return _get_imagenet(conf, name, datasets_path, split)
+    elif name in ["ag_news", "sst"] or "dbpedia" in name:
+        return _get_text(conf, name, split)
     else:
         raise NotImplementedError
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import copy
+
+import torch
+import torch.distributed as dist
+
+import pcode.create_dataset as create_dataset
+import pcode.create_model as create_model
+import pcode.master_utils as master_utils
+import pcode.utils.checkpoint as checkpoint
+from pcode.utils.profiler import define_profiler
+from pcode.utils.tensor_buffer import TensorBuffer
+
+
+def get_edge_rank(conf, worker_rank):
+    """the rank of the edge aggregator of a worker (the workers are assigned round-robin)."""
+    return conf.n_participated + 1 + (worker_rank - 1) % conf.n_edge_aggregators
+
+
+def is_edge_rank(conf, rank):
+    return rank > conf.n_participated
+
+
+def pack_partial(partial):
+    """flatten the partial aggregate (the sums, and their counts/weights) of the hetero aggregator."""
+    sums, normalizers = partial
+    return TensorBuffer(list(sums.values()) + list(normalizers.values()), use_cuda=False)
+
+
+class EdgeAggregator(object):
+    """
+    The (optional) tier between the workers and the Master: an edge aggregator receives the local
+    models of its workers, pre-aggregates them per arch (i.e. the sum of the flattened local models),
+    and forwards one partial aggregate per arch to the Master, together with the training stats.
+    For the pruning/low-rank deployment, the local models are instead pre-aggregated in the master
+    space by the same hetero aggregator as the Master (see `accumulate`), and one partial aggregate is forwarded.
+    The Master then receives O(# of edges) instead of O(# of clients) models per round.
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+
+        # some initializations.
+        self.rank = conf.graph.rank
+        conf.graph.worker_id = conf.graph.rank
+        self.worker_ranks = [
+            worker_rank
+            for worker_rank in range(1, 1 + conf.n_participated)
+            if get_edge_rank(conf, worker_rank) == self.rank
+        ]
+
+        # define the profiler for different phases (only enabled by `track_time`).
+        self.profiler = define_profiler(conf)
+
+        # the edge does not train, but joins the (collective) data partitioning of the workers.
+        dist.barrier()
+        self.dataset = create_dataset.define_dataset(
+            conf, data=conf.data, agg_data_ratio=conf.agg_data_ratio
+        )
+        _, self.data_partitioner = create_dataset.define_data_loader(
+            self.conf,
+            dataset=self.dataset["train"],
+            localdata_id=0,  # random id here.
+            is_train=True,
+            data_partitioner=None,
+        )
+
+        # the layout of the flattened models of the client archs.
+        self.arch_buffers = {}
+        for arch in conf.arch_info["worker"]:
+            _, model = create_model.define_model(
+                conf, to_consistent_model=False, arch=arch, show_stat=False
+            )
+            self.arch_buffers[arch] = TensorBuffer(
+                list(model.state_dict().values()), use_cuda=conf.graph.on_cuda
+            )
+        self.hetero_agg = None
+        if conf.low_rank or conf.pruning:
+            self._init_hetero_aggregator()
+        conf.logger.log(
+            f"Edge-{self.rank} initialized the aggregation of the workers {self.worker_ranks}."
+        )
+
+        # restore the state of the previous run (for the exact resume).
+        if conf.resume is not None:
+            state = checkpoint.load_resume_state(conf)
+            conf.graph.comm_round = state["current_comm_round"]
+
+    def _init_hetero_aggregator(self):
+        # the same archs and label splits as the Master (see `Master.__init__`).
+        self.conf.used_client_archs = self.conf.arch_info["worker"]
+        self.conf.clientid2arch = dict(
+            (
+                client_id,
+                create_model.determine_arch(
+                    self.conf, client_id=client_id, use_complex_arch=True
+                ),
+            )
+            for client_id in range(1, 1 + self.conf.n_clients)
+        )
+        _, master_model = create_model.define_model(
+            self.conf, to_consistent_model=False, show_stat=False, on_cuda=self.conf.graph.on_cuda
+        )
+        client_models = dict(
+            create_model.define_model(self.conf, to_consistent_model=False, arch=arch, show_stat=False)
+            for arch in self.conf.used_client_archs
+        )
+        self.hetero_agg = master_utils.define_hetero_aggregator(
+            self.conf,
+            master_model,
+            client_models,
+            master_utils.get_label_split(self.conf, self.data_partitioner),
+        )
+
+    def run(self):
+        # the resumed run may have already finished all communication rounds.
+        if self.conf.resume is not None and self._terminate_by_complete_training():
+            return
+
+        while True:
+            client_ids, client_archs = self._listen_to_master()
+
+            # check if we need to terminate the training or not.
+            if self.conf.graph.comm_round == -1:
+                dist.barrier()
+                self.conf.logger.log(
+                    f"Edge-{self.rank} finished the federated learning by early-stopping."
+                )
+                return
+
+            with self.profiler("round", comm_round=self.conf.graph.comm_round):
+                # the Master sends the models to the workers.
+                dist.barrier()
+                with self.profiler("aggregate"):
+                    self._aggregate_and_forward(client_ids, client_archs)
+            self.profiler.step()
+            if self.conf.save_resume_state:
+                checkpoint.save_resume_state(
+                    self.conf, {"current_comm_round": self.conf.graph.comm_round}
+                )
+
+            # check if we need to terminate the training or not.
+            if self._terminate_by_complete_training():
+                return
+
+    def _listen_to_master(self):
+        # listen to master, related to the function `_activate_selected_clients` in `master.py`.
+        msg_len = 3
+        if self.conf.split_mix:
+            msg_len += 1
+        if self.conf.dynamic or self.conf.arch_planning:
+            msg_len += 1
+
+        msg = torch.zeros((msg_len, self.conf.n_participated))
+        dist.broadcast(tensor=msg, src=0)
+        self.conf.graph.comm_round = int(msg[1, 0].item())
+
+        # the clients (and their archs) trained by the workers of this edge.
+        client_ids, client_archs = {}, {}
+        for worker_rank in self.worker_ranks:
+            client_id = int(msg[0, worker_rank - 1].item())
+            if client_id <= 0:
+                continue
+            client_ids[worker_rank] = client_id
+            if self.conf.dynamic or self.conf.arch_planning:
+                arch_index = int(msg[msg_len - 1, worker_rank - 1].item())
+                client_archs[worker_rank] = self.conf.arch_info["worker"][arch_index]
+            else:
+                client_archs[worker_rank] = create_model.determine_arch(
+                    self.conf, client_id=client_id, use_complex_arch=True
+                )
+        dist.barrier()
+        return client_ids, client_archs
+
+    def _aggregate_and_forward(self, client_ids, client_archs):
+        # related to the functions `_send_model_to_master` in `worker.py`,
+        # and `_receive_partial_aggregates_from_edges` in `master.py`.
+        dist.barrier()
+
+        flatten_local_models, train_stats, reqs = {}, {}, []
+        for worker_rank in client_ids.keys():
+            flatten_local_models[worker_rank] = torch.zeros_like(
+                self.arch_buffers[client_archs[worker_rank]].buffer
+            )
+            train_stats[worker_rank] = torch.zeros(4)
+            reqs.append(dist.irecv(tensor=flatten_local_models[worker_rank], src=worker_rank))
+            reqs.append(dist.irecv(tensor=train_stats[worker_rank], src=worker_rank))
+        for req in reqs:
+            req.wait()
+
+        if self.hetero_agg is not None:
+            # the sums (and counts/weights) in the master space, keyed by the client ids.
+            _flatten_local_models = {}
+            for worker_rank, client_id in client_ids.items():
+                self.hetero_agg.clientid2arch[client_id] = client_archs[worker_rank]
+                client_tb = copy.copy(self.arch_buffers[client_archs[worker_rank]])
+                client_tb.buffer = flatten_local_models[worker_rank]
+                _flatten_local_models[client_id] = client_tb
+            to_forward = [pack_partial(self.hetero_agg.accumulate(_flatten_local_models)).buffer]
+        else:
+            # sum the local models per arch (exact for the uniform averaging of FedAvg).
+            partial_sums = {}
+            for worker_rank, flatten_local_model in flatten_local_models.items():
+                arch = client_archs[worker_rank]
+                if arch not in partial_sums:
+                    partial_sums[arch] = torch.zeros_like(flatten_local_model)
+                partial_sums[arch].add_(flatten_local_model)
+            to_forward = [
+                partial_sums[arch] for arch in self.conf.arch_info["worker"] if arch in partial_sums
+            ]
+
+        if len(client_ids) > 0:
+            dist.send(
+                tensor=torch.stack([train_stats[worker_rank] for worker_rank in client_ids]),
+                dst=0,
+            )
+            for partial in to_forward:
+                dist.send(tensor=partial, dst=0)
+        dist.barrier()
+        self.conf.logger.log(
+            f"Edge-{self.rank} forwarded the partial aggregates of {len(client_ids)} local models to Master."
+        )
+
+    def _terminate_by_complete_training(self):
+        if self.conf.graph.comm_round == self.conf.n_comm_rounds:
+            dist.barrier()
+            self.conf.logger.log(
+                f"Edge-{self.rank} finished the federated learning: (total comm_rounds={self.conf.graph.comm_round})."
+            )
+            return True
+        else:
+            return False
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import copy
+import time
+
+import torch
+import torch.distributed as dist
+
+import pcode.create_metrics as create_metrics
+import pcode.create_model as create_model
+import pcode.utils.checkpoint as checkpoint
+from pcode.master import Master, get_n_local_epoch
+from pcode.worker import Worker
+from pcode.utils.communication import get_aggregators
+from pcode.utils.tensor_buffer import TensorBuffer
+from pcode.utils.topology import get_gossip_neighbors_info
+
+
+def check_gossip_conf(conf):
+    # each worker is one (persistent) client, and the models are averaged element-wise.
+    assert conf.n_participated == conf.n_clients, "each gossip worker holds one client."
+    assert (
+        len(conf.arch_info["worker"]) == 1
+        and not (conf.low_rank or conf.pruning or conf.split_mix)
+        and not (conf.dynamic or conf.arch_planning)
+    ), "the gossip training only supports the same arch over the workers."
+    assert conf.n_edge_aggregators == 0 and not conf.fednova
+
+
+def is_gossip_eval_round(conf, comm_round):
+    return comm_round % conf.gossip_eval_freq == 0 or comm_round == conf.n_comm_rounds
+
+
+class GossipWorker(Worker):
+    """
+    The worker of the serverless (gossip) training: it keeps its local model over the rounds,
+    and after each local training, it averages its model with its neighbors in the topology
+    (by the `DecentralizedAggregation`, i.e. the non-blocking sends/recvs of the flattened model).
+    Its model is only sent (non-blocking) to the monitor in the evaluation rounds.
+    """
+
+    def __init__(self, conf):
+        check_gossip_conf(conf)
+        self.model = None
+        super(GossipWorker, self).__init__(conf)
+
+        # the worker (of rank r) always trains the client r.
+        conf.graph.client_id = self.rank
+        self.get_label_split()
+        if self.model is None:
+            self._init_local_model()
+            self.start_comm_round = 1
+        self.monitor_req = None
+
+        # the mixing weights of the neighbors (the monitor rank 0 is not in the topology).
+        self.neighbors_info = get_gossip_neighbors_info(
+            list(range(1, 1 + conf.n_participated)), self.rank, conf.gossip_topology
+        )
+        self.decentralized_aggregator = get_aggregators(
+            cur_rank=self.rank,
+            world=conf.graph.ranks,
+            neighbors_info=self.neighbors_info,
+            aggregator_type="decentralized",
+        )
+        conf.logger.log(
+            f"Worker-{self.rank} gossips with the neighbors (mixing weights): {self.neighbors_info}."
+        )
+
+    def _init_local_model(self):
+        self.arch, self.model = create_model.define_model(
+            self.conf, to_consistent_model=False, client_id=self.rank, show_stat=False
+        )
+        self.model_state_dict = self.model.state_dict()
+        self.metrics = create_metrics.Metrics(self.model, task="classification")
+
+    def run(self):
+        # the resumed run may have already finished all communication rounds.
+        if self.conf.resume is not None and self._terminate_by_complete_training():
+            return
+
+        # all workers start from the same model (of the monitor).
+        if self.start_comm_round == 1:
+            self._recv_init_model_from_monitor()
+
+        for comm_round in range(self.start_comm_round, self.conf.n_comm_rounds + 1):
+            self.conf.graph.comm_round = comm_round
+            self.n_local_epochs = get_n_local_epoch(conf=self.conf, n_participated=1)[0]
+
+            with self.profiler("round", comm_round=comm_round):
+                if self.conf.self_distillation > 0 or self.conf.local_prox_term > 0:
+                    self.init_model = self._turn_off_grad(
+                        copy.deepcopy(self.model).to(self.device)
+                    )
+                with self.profiler("train"):
+                    self._train()
+                with self.profiler("gossip"):
+                    self._gossip()
+                if is_gossip_eval_round(self.conf, comm_round):
+                    with self.profiler("send_model"):
+                        self._send_model_to_monitor()
+            self.profiler.step()
+            self._save_resume_state()
+
+        if self.monitor_req is not None:
+            self.monitor_req.wait()
+        self._terminate_by_complete_training()
+
+    def _recv_init_model_from_monitor(self):
+        # related to the function `_broadcast_init_model` in `GossipMonitor`.
+        model_tb = TensorBuffer(list(self.model_state_dict.values()), use_cuda=False)
+        dist.broadcast(tensor=model_tb.buffer, src=0)
+        self._load_flatten_model(model_tb)
+
+    def _load_flatten_model(self, model_tb):
+        model_tb.unpack(self.model_state_dict.values())
+        self.model.load_state_dict(self.model_state_dict, strict=True)
+
+    def _gossip(self):
+        # the model is on cpu after the local training (see `_terminate_comm_round`).
+        gossip_start_time = time.perf_counter()
+        model_tb = TensorBuffer(list(self.model.state_dict().values()), use_cuda=False)
+        for _ in range(self.conf.gossip_n_steps):
+            model_tb.buffer = self.decentralized_aggregator._agg(
+                model_tb.buffer, op="weighted"
+            )
+        self._load_flatten_model(model_tb)
+        self.conf.logger.log(
+            f"Worker-{self.rank} averaged the model with {len(self.neighbors_info) - 1} neighbors "
+            f"({self.conf.gossip_n_steps} gossip steps, {time.perf_counter() - gossip_start_time:.3f}s)."
+        )
+
+    def _send_model_to_monitor(self):
+        # the worker does not wait for the monitor (the last send is completed before the next one).
+        if self.monitor_req is not None:
+            self.monitor_req.wait()
+        self.monitor_tb = TensorBuffer(list(self.model.state_dict().values()), use_cuda=False)
+        self.monitor_req = dist.isend(tensor=self.monitor_tb.buffer, dst=0)
+
+    def _get_resume_state(self):
+        state = super(GossipWorker, self)._get_resume_state()
+        state["model"] = self.model.state_dict()
+        return state
+
+    def _load_resume_state(self):
+        self._init_local_model()
+        state = super(GossipWorker, self)._load_resume_state()
+        self.model.load_state_dict(state["model"])
+        self.start_comm_round = state["current_comm_round"] + 1
+        return state
+
+
+class GossipMonitor(Master):
+    """
+    The rank 0 of the serverless (gossip) training: it only broadcasts the initial model,
+    and evaluates the average of the local models (and their consensus distance)
+    in the evaluation rounds. The workers are not early-stopped.
+    """
+
+    def __init__(self, conf):
+        check_gossip_conf(conf)
+        super(GossipMonitor, self).__init__(conf)
+        assert (
+            self.aggregator.aggregate_fn is None
+        ), "the monitor only evaluates the average of the local models."
+        self.arch = self.used_client_archs[0]
+
+    def run(self):
+        # all workers start from the same model.
+        if self.start_comm_round == 1:
+            self._broadcast_init_model()
+
+        for comm_round in range(self.start_comm_round, self.conf.n_comm_rounds + 1):
+            self.conf.graph.comm_round = comm_round
+            if is_gossip_eval_round(self.conf, comm_round):
+                with self.profiler("round", comm_round=comm_round):
+                    with self.profiler("receive_model"):
+                        flatten_local_models = self._receive_models_from_workers()
+                    with self.profiler("aggregate"):
+                        self._log_consensus_distance(flatten_local_models)
+                        self._aggregate_model_and_evaluate(
+                            flatten_local_models, list(flatten_local_models.keys())
+                        )
+                self.profiler.step()
+                self.conf.logger.log(f"Master (monitor) evaluated the gossip models.\n")
+
+            # saved in every round, to resume at the same round as the workers.
+            if self.conf.save_resume_state:
+                checkpoint.save_resume_state(self.conf, self._get_resume_state())
+
+        # formally stop the training (the workers have finished all communication rounds).
+        dist.barrier()
+        self._finishing()
+
+    def _broadcast_init_model(self):
+        # related to the function `_recv_init_model_from_monitor` in `GossipWorker`.
+        flatten_model = self._get_flatten_client_model(self.arch)
+        dist.broadcast(tensor=flatten_model.buffer, src=0)
+        self.conf.logger.log(f"Master (monitor) broadcast the initial model={self.arch}.")
+
+    def _receive_models_from_workers(self):
+        # related to the function `_send_model_to_monitor` in `GossipWorker`.
+        flatten_local_models, reqs = dict(), []
+        for client_id, world_id in zip(self.client_ids, self.world_ids):
+            client_tb = copy.copy(self._get_flatten_client_model(self.arch))
+            client_tb.buffer = torch.zeros_like(client_tb.buffer)
+            flatten_local_models[client_id] = client_tb
+            reqs.append(dist.irecv(tensor=client_tb.buffer, src=world_id))
+
+        for req in reqs:
+            req.wait()
+        self.conf.logger.log(f"Master (monitor) received all local models.")
+        return flatten_local_models
+
+    def _log_consensus_distance(self, flatten_local_models):
+        # the average squared distance of the local models to their average.
+        buffers = torch.stack(
+            [flatten_local_model.buffer for flatten_local_model in flatten_local_models.values()]
+        )
+        consensus_distance = (buffers - buffers.mean(dim=0)).pow(2).sum(dim=1).mean().item()
+        self.conf.logger.log_metric(
+            name="runtime",
+            values={
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "comm_round": self.conf.graph.comm_round,
+                "consensus_distance": consensus_distance,
+            },
+            tags={"split": "test", "type": "gossip"},
+            display=True,
+        )
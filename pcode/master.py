@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import collections
 import copy
 import os
 import numpy as np
@@ -10,10 +11,14 @@ import pcode.create_dataset as create_dataset
 import pcode.create_metrics as create_metrics
 import pcode.create_model as create_model
 import pcode.master_utils as master_utils
+import pcode.aggregation.utils as agg_utils
 import pcode.utils.checkpoint as checkpoint
 import pcode.utils.cross_entropy as cross_entropy
-from pcode.aggregation import svd_agg, pruning_agg, mix_agg
+from pcode.edge import get_edge_rank, pack_partial
 from pcode.utils.early_stopping import EarlyStoppingTracker
+from pcode.utils.arch_planner import ArchPlanner
+from pcode.utils.profiler import define_profiler
+from pcode.utils.stat_tracker import ClientThroughputTracker
 from pcode.utils.tensor_buffer import TensorBuffer
 
 
@@ -65,18 +70,9 @@ class Master(object):
 
         # create the aggregator and initialize the compressed model properly
         if len(self.used_client_archs[-1].split('_')) > 1:
-            factor = eval(self.used_client_archs[-1].split('_')[-1])
-            if self.conf.split_mix:
-                self.hetero_agg = mix_agg.MixAggregator(conf, self.master_model, self.client_models, self.label_split)
-            elif factor < 1:
-                self.hetero_agg = pruning_agg.HeteroAggregator(conf, self.master_model, self.client_models, self.label_split)
-                print("initilized by splitting model")
-            elif factor > 1:
-                self.hetero_agg = svd_agg.SVDAggregator(conf, self.master_model, self.client_models, self.label_split)
-                print("initialized by spectual!")
-            else:
-                print("the clients failed to be sorted")
-                exit(-1)
+            self.hetero_agg = master_utils.define_hetero_aggregator(
+                conf, self.master_model, self.client_models, self.label_split
+            )
 
             if 'vit' not in self.conf.arch_info["master"]:
                 self.client_models = self.hetero_agg.split_model(self.master_model, self.client_models)
@@ -84,26 +80,20 @@ class Master(object):
         conf.logger.log(
             f"Master initialize the clientid2arch mapping relations: {self.clientid2arch}."
         )
+        self.flatten_client_models = {}
 
-        if self.conf.freeze_bn:
-            self.data_loader = torch.utils.data.DataLoader(
-                self.dataset["train"],
-                batch_size=conf.batch_size,
-                shuffle=False,
-                num_workers=conf.num_workers,
-                pin_memory=conf.pin_memory,
-                drop_last=False
-            )
+        if self.conf.freeze_bn or self.conf.bn_recalibration:
+            # the test models track the bn statistics, which are recalibrated in `fix_bn_stat`
+            # on a small training subset (lazily built in `_get_calibration_loader`).
+            self.calibration_loader = None
+            modified_before = self.conf.freeze_bn, self.conf.need_scaler
             self.conf.freeze_bn = False
-            modified_before = self.conf.need_scaler
-            # Master.conf is pocself.test_modelsessed only in master, so it won't effect the worker's model
+            # Master.conf is possessed only in master, so it won't effect the worker's model
             self.conf.need_scaler = False
             self.test_models = dict(
-                (arch, create_model.define_model(self.conf, to_consistent_model=False, arch=arch)[1].cuda())
+                (arch, create_model.define_model(self.conf, to_consistent_model=False, arch=arch)[1])
                 for arch in self.used_client_archs)
-            self.conf.freeze_bn = True
-            self.conf.need_scaler = modified_before
-
+            self.conf.freeze_bn, self.conf.need_scaler = modified_before
 
         conf.logger.log(f"Master initialized the local training data with workers.")
 
@@ -121,21 +111,17 @@ class Master(object):
         # create test loaders.
         # localdata_id start from 0 to the # of clients - 1. client_id starts from 1 to the # of clients.
         if conf.partitioned_by_user:
+            # one shared test loader over the users to evaluate,
+            # (lazily) built in `_refresh_user_test_loader`.
             self.test_loaders = []
-            for localdata_id in self.client_ids:
-                test_loader, _ = create_dataset.define_data_loader(
-                    conf,
-                    self.dataset["test"],
-                    localdata_id=localdata_id - 1,
-                    is_train=False,
-                    shuffle=False,
-                )
-                self.test_loaders.append(copy.deepcopy(test_loader))
+            self.test_localdata_ids = None
         else:
             test_loader, _ = create_dataset.define_data_loader(
                 conf, self.dataset["test"], is_train=False
             )
-            self.test_loaders = [test_loader]
+            self.test_loaders = [create_dataset.define_cached_test_loader(conf, test_loader)]
+        # the stratified test subset is (lazily) built in `_get_test_loaders`.
+        self.subset_test_loaders = None
 
         # define the criterion and metrics.
         self.criterion = cross_entropy.CrossEntropyLoss(reduction="mean")
@@ -154,6 +140,15 @@ class Master(object):
             clientid2arch=self.clientid2arch
         )
 
+        # the edge aggregators only forward the sum of the local models per arch
+        # (or the partial aggregate in the master space of the pruning/low-rank deployment).
+        if conf.n_edge_aggregators > 0:
+            assert (
+                self.aggregator.aggregate_fn is None
+                and not conf.split_mix
+                and not conf.fednova
+            ), "the edge aggregators only support the FedAvg (of the same/different archs), pruning and low-rank."
+
         # if len(self.used_client_archs) > 1:
         self.coordinator = [create_coordinator.Coordinator(conf, self.metrics) for _ in
                             range(len(self.used_client_archs))]
@@ -161,73 +156,233 @@ class Master(object):
         #     self.coordinator = create_coordinator.Coordinator(conf, self.metrics)
         conf.logger.log(f"Master initialized the aggregator/coordinator.\n")
 
+        # define the profiler for different phases (only enabled by `track_time`).
+        self.profiler = define_profiler(conf)
+
+        # track the training time of the clients (for the straggler-aware client selection).
+        self.throughput_tracker = ClientThroughputTracker(decay=conf.throughput_ema_decay)
+
+        # (re-)plan the client archs from their cost and the measured speed of the clients.
+        self.arch_planner = None
+        if conf.arch_planning:
+            assert not conf.dynamic, "the arch planning replaces the dynamic arch sampling."
+            self.arch_planner = ArchPlanner(
+                conf,
+                self.client_models,
+                self.clientid2arch,
+                sample_input=self.dataset["train"][0][0],
+            )
+            self.clientid2archindex = dict(
+                (client_id, self.used_client_archs.index(arch))
+                for client_id, arch in self.clientid2arch.items()
+            )
+            conf.logger.log(
+                f"Master estimated the relative cost of the client archs: {self.arch_planner.arch_costs}."
+            )
+
         # define early_stopping_tracker.
         self.early_stopping_tracker = EarlyStoppingTracker(
             patience=conf.early_stopping_rounds
         )
 
+        # restore the full state of the previous run (for the exact resume).
+        self.start_comm_round = 1
+        if conf.resume is not None:
+            self._load_resume_state()
+
         # save arguments to disk.
         conf.is_finished = False
         checkpoint.save_arguments(conf)
 
     def run(self):
         to_send_history = False
-        for comm_round in range(1, self.conf.n_comm_rounds + 1):
+        for comm_round in range(self.start_comm_round, self.conf.n_comm_rounds + 1):
             self.conf.graph.comm_round = comm_round
-            self.conf.logger.log(
-                f"Master starting one round of federated learning: (comm_round={comm_round})."
-            )
-
-            # get random n_local_epochs.
-            list_of_local_n_epochs = get_n_local_epoch(
-                conf=self.conf, n_participated=self.conf.n_participated
-            )
-            self.list_of_local_n_epochs = list_of_local_n_epochs
+            with self.profiler("round", comm_round=comm_round):
+                self.conf.logger.log(
+                    f"Master starting one round of federated learning: (comm_round={comm_round})."
+                )
 
-            # random select clients from a pool.
-            if self.conf.dynamic:
-                self.sample_client2arch()
+                # get random n_local_epochs.
+                list_of_local_n_epochs = get_n_local_epoch(
+                    conf=self.conf, n_participated=self.conf.n_participated
+                )
 
-            selected_client_ids = self._random_select_clients()
-            #selected_client_ids = self._uniform_select_clients()
+                # random select clients from a pool.
+                if self.conf.dynamic:
+                    self.sample_client2arch()
+                elif (
+                    self.arch_planner is not None
+                    and comm_round > 1
+                    and (comm_round - 1) % self.conf.arch_plan_every_n_rounds == 0
+                ):
+                    self._plan_client_archs()
+
+                with self.profiler("select_clients"):
+                    selected_client_ids = self._select_clients()
+                    list_of_local_n_epochs = self._adapt_local_n_epochs(
+                        selected_client_ids, list_of_local_n_epochs
+                    )
+                #selected_client_ids = self._uniform_select_clients()
+                self.list_of_local_n_epochs = list_of_local_n_epochs
 
-            # detect early stopping.
-            self._check_early_stopping()
-            if self.conf.contrastive or self.conf.local_history:
-                to_send_history = comm_round > 1
+                # detect early stopping.
+                self._check_early_stopping()
+                if self.conf.contrastive or self.conf.local_history:
+                    to_send_history = comm_round > 1
 
-            self._activate_selected_clients(
-                selected_client_ids, self.conf.graph.comm_round, list_of_local_n_epochs
-            )
+                with self.profiler("activate"):
+                    self._activate_selected_clients(
+                        selected_client_ids, self.conf.graph.comm_round, list_of_local_n_epochs
+                    )
 
-            # will decide to send the model or stop the training.
-            if not self.conf.is_finished:
-                # broadcast the model to activated clients.
-                self._send_model_to_selected_clients(selected_client_ids, to_send_history)
+                # will decide to send the model or stop the training.
+                if not self.conf.is_finished:
+                    # broadcast the model to activated clients.
+                    with self.profiler("send_model"):
+                        self._send_model_to_selected_clients(selected_client_ids, to_send_history)
 
-            else:
-                dist.barrier()
-                self.conf.logger.log(
-                    f"Master finished the federated learning by early-stopping: (current comm_rounds={comm_round}, total_comm_rounds={self.conf.n_comm_rounds})"
-                )
-                return
+                else:
+                    dist.barrier()
+                    self.conf.logger.log(
+                        f"Master finished the federated learning by early-stopping: (current comm_rounds={comm_round}, total_comm_rounds={self.conf.n_comm_rounds})"
+                    )
+                    return
 
-            # wait to receive the local models.
-            flatten_local_models = self._receive_models_from_selected_clients(
-                selected_client_ids
-            )
+                # wait to receive the local models.
+                with self.profiler("receive_model"):
+                    flatten_local_models = self._receive_models_from_selected_clients(
+                        selected_client_ids
+                    )
 
-            # aggregate the local models and evaluate on the validation dataset.
-            self._aggregate_model_and_evaluate(flatten_local_models, selected_client_ids)
+                # aggregate the local models and evaluate on the validation dataset.
+                with self.profiler("aggregate"):
+                    self._aggregate_model_and_evaluate(flatten_local_models, selected_client_ids)
+            self.profiler.step()
 
             # evaluate the aggregated model.
             self.conf.logger.log(f"Master finished one round of federated learning.\n")
+            if self.conf.save_resume_state:
+                checkpoint.save_resume_state(self.conf, self._get_resume_state())
 
         # formally stop the training (the master has finished all communication rounds).
         dist.barrier()
         self._finishing()
 
 
+    def _select_clients(self):
+        if self.conf.client_selection == "drop_stragglers":
+            return self._drop_stragglers_select_clients()
+        elif self.conf.client_selection == "oversample":
+            return self._oversample_select_clients()
+        # "adaptive_steps" selects the clients randomly and adapts their local epochs.
+        return self._random_select_clients()
+
+    def _get_client_costs(self, client_ids):
+        # the relative cost of the client archs (only estimated for the arch planning).
+        if self.arch_planner is None:
+            return [1.0] * len(client_ids)
+        return [
+            self.arch_planner.arch_costs[self.clientid2arch[client_id]]
+            for client_id in client_ids
+        ]
+
+    def _predict_train_time(self, client_ids, list_of_local_n_epochs=None):
+        if list_of_local_n_epochs is None:
+            list_of_local_n_epochs = [self.conf.local_n_epochs] * len(client_ids)
+        return np.array(
+            self.throughput_tracker.predict_time(
+                client_ids, list_of_local_n_epochs, self._get_client_costs(client_ids)
+            )
+        )
+
+    def _plan_client_archs(self):
+        planned_clientid2arch = self.arch_planner.plan(
+            self.throughput_tracker, n_epochs=self.conf.local_n_epochs
+        )
+        changed_clientid2arch = dict(
+            (client_id, arch)
+            for client_id, arch in planned_clientid2arch.items()
+            if self.clientid2arch[client_id] != arch
+        )
+        # update in place, as the mapping is shared with the (hetero) aggregators.
+        self.clientid2arch.update(changed_clientid2arch)
+        self.clientid2archindex.update(
+            (client_id, self.used_client_archs.index(arch))
+            for client_id, arch in changed_clientid2arch.items()
+        )
+        if self.conf.split_mix:
+            self.hetero_agg.refresh_client_slims()
+        self.conf.logger.log(
+            f"Master re-planned the archs of {len(changed_clientid2arch)} clients: {changed_clientid2arch}."
+        )
+
+    def _get_round_deadline(self, predicted_times):
+        if self.conf.round_deadline is not None:
+            return self.conf.round_deadline
+        return self.conf.straggler_deadline_factor * np.median(predicted_times)
+
+    def _drop_stragglers_select_clients(self):
+        # the selected clients whose predicted training time exceeds the deadline are dropped
+        # (their workers skip the round).
+        selected_client_ids = self._random_select_clients()
+        predicted_times = self._predict_train_time(selected_client_ids)
+        deadline = self._get_round_deadline(predicted_times)
+        stragglers = [
+            client_id
+            for client_id, predicted_time in zip(selected_client_ids, predicted_times)
+            if predicted_time > deadline
+        ]
+        if len(stragglers) == len(selected_client_ids):
+            # keep (at least) the predicted fastest client.
+            stragglers.remove(selected_client_ids[int(np.argmin(predicted_times))])
+        if len(stragglers) > 0:
+            selected_client_ids = [
+                client_id for client_id in selected_client_ids if client_id not in stragglers
+            ]
+            self.conf.logger.log(
+                f"Master dropped the predicted stragglers {stragglers} (deadline={deadline:.2f}s)."
+            )
+        return selected_client_ids
+
+    def _oversample_select_clients(self):
+        # draw more candidates, and keep the n_participated clients predicted to finish first.
+        n_candidates = min(
+            self.conf.n_clients,
+            int(np.ceil(self.conf.n_participated * (1 + self.conf.client_oversample_ratio))),
+        )
+        candidate_ids = self.conf.random_state.choice(
+            self.client_ids, n_candidates, replace=False
+        ).tolist()
+        predicted_times = self._predict_train_time(candidate_ids)
+        selected_client_ids = [
+            candidate_ids[idx]
+            for idx in np.argsort(predicted_times, kind="stable")[: self.conf.n_participated]
+        ]
+        selected_client_ids.sort()
+        self.conf.logger.log(
+            f"Master selected {self.conf.n_participated} (predicted fastest) from {n_candidates} candidates: {selected_client_ids}."
+        )
+        return selected_client_ids
+
+    def _adapt_local_n_epochs(self, selected_client_ids, list_of_local_n_epochs):
+        # assign fewer local epochs to the slow clients, s.t. they finish before the deadline.
+        if self.conf.client_selection != "adaptive_steps":
+            return list_of_local_n_epochs
+        n_selected = len(selected_client_ids)
+        predicted_times = self._predict_train_time(
+            selected_client_ids, list_of_local_n_epochs[:n_selected]
+        )
+        deadline = self._get_round_deadline(predicted_times)
+        list_of_local_n_epochs = np.array(list_of_local_n_epochs, dtype=float)
+        for idx, predicted_time in enumerate(predicted_times):
+            if predicted_time > deadline:
+                list_of_local_n_epochs[idx] *= deadline / predicted_time
+        self.conf.logger.log(
+            f"Master adapted the local epochs to the deadline={deadline:.2f}s: {np.round(list_of_local_n_epochs[:n_selected], 2).tolist()}."
+        )
+        return list_of_local_n_epochs.tolist()
+
     def _random_select_clients(self):
         selected_client_ids = self.conf.random_state.choice(
             self.client_ids, self.conf.n_participated, replace=False
@@ -325,7 +480,7 @@ class Master(object):
 
         if self.conf.split_mix:
             msg_len += 1
-        if self.conf.dynamic:
+        if self.conf.dynamic or self.conf.arch_planning:
             msg_len += 1
 
         activation_msg = torch.zeros((msg_len, len(broadcast_client_ids)))
@@ -337,11 +492,13 @@ class Master(object):
             slim_info_len = []
             for client_idx in selected_client_ids:
                 slim_info_len.append(self.hetero_agg.get_client_slim(client_idx))
+            slim_info_len.extend([0] * (len(broadcast_client_ids) - len(selected_client_ids)))
             activation_msg[3, :] = torch.Tensor(slim_info_len)
 
-        if self.conf.dynamic:
+        if self.conf.dynamic or self.conf.arch_planning:
             activation_msg[msg_len - 1, :] = torch.Tensor(
-                [self.clientid2archindex[client_id] for client_id in broadcast_client_ids]
+                # the padded (i.e. skipped) workers have the client_id=0.
+                [self.clientid2archindex.get(client_id, 0) for client_id in broadcast_client_ids]
             )
 
         dist.broadcast(tensor=activation_msg, src=0)
@@ -355,10 +512,7 @@ class Master(object):
 
         for worker_rank, selected_client_id in enumerate(selected_client_ids, start=1):
             arch = self.clientid2arch[selected_client_id]
-            self.client_models[arch] = self.client_models[arch].cpu()
-
-            client_model_state_dict = self.client_models[arch].state_dict()
-            flatten_model = TensorBuffer(list(client_model_state_dict.values()))
+            flatten_model = self._get_flatten_client_model(arch)
             dist.send(tensor=flatten_model.buffer, dst=worker_rank)
             self.conf.logger.log(
                 f"\tMaster send the current model={arch} to process_id={worker_rank}."
@@ -371,7 +525,20 @@ class Master(object):
 
         dist.barrier()
 
+    def _get_flatten_client_model(self, arch):
+        # the client models only change with the aggregation, thus each arch is
+        # flattened once per round (the cache is refreshed in _aggregate_model_and_evaluate).
+        if arch not in self.flatten_client_models:
+            self.client_models[arch] = self.client_models[arch].cpu()
+            self.flatten_client_models[arch] = TensorBuffer(
+                list(self.client_models[arch].state_dict().values())
+            )
+        return self.flatten_client_models[arch]
+
     def _receive_models_from_selected_clients(self, selected_client_ids):
+        if self.conf.n_edge_aggregators > 0:
+            return self._receive_partial_aggregates_from_edges(selected_client_ids)
+
         self.conf.logger.log(f"Master waits to receive the local models.")
         dist.barrier()
 
@@ -379,12 +546,15 @@ class Master(object):
         flatten_local_models = dict()
         for selected_client_id in selected_client_ids:
             arch = self.clientid2arch[selected_client_id]
-            client_tb = TensorBuffer(
-                list(self.client_models[arch].state_dict().values())
-            )
+            client_tb = copy.copy(self._get_flatten_client_model(arch))
             client_tb.buffer = torch.zeros_like(client_tb.buffer)
             flatten_local_models[selected_client_id] = client_tb
 
+        # the training stats (time, # of samples, # of epochs, # of steps) are sent after the local model.
+        train_stats = dict(
+            (client_id, torch.zeros(4)) for client_id in selected_client_ids
+        )
+
         # async to receive model from clients.
         reqs = []
         for client_id, world_id in zip(selected_client_ids, self.world_ids):
@@ -392,14 +562,110 @@ class Master(object):
                 tensor=flatten_local_models[client_id].buffer, src=world_id
             )
             reqs.append(req)
+            reqs.append(dist.irecv(tensor=train_stats[client_id], src=world_id))
 
         for req in reqs:
             req.wait()
 
         dist.barrier()
+        self._update_throughput_tracker(train_stats)
+
+        # normalize the local updates by the # of local steps (before any aggregation scheme).
+        if self.conf.fednova:
+            tau_eff = agg_utils.normalize_local_updates(
+                self.conf,
+                flatten_local_models,
+                flatten_global_models=dict(
+                    (client_id, self._get_flatten_client_model(self.clientid2arch[client_id]))
+                    for client_id in selected_client_ids
+                ),
+                local_steps=dict(
+                    (client_id, stat[3].item()) for client_id, stat in train_stats.items()
+                ),
+            )
+            self.conf.logger.log(
+                f"Master normalized the local updates (FedNova) with tau_eff={tau_eff:.2f}."
+            )
         self.conf.logger.log(f"Master received all local models.")
         return flatten_local_models
 
+    def _receive_partial_aggregates_from_edges(self, selected_client_ids):
+        # related to the function `_aggregate_and_forward` in `edge.py`.
+        self.conf.logger.log(f"Master waits to receive the partial aggregates from the edges.")
+        dist.barrier()
+
+        # the clients (in the order of their workers) pre-aggregated by each edge.
+        edge_client_ids = collections.defaultdict(list)
+        for client_id, world_id in zip(selected_client_ids, self.world_ids):
+            edge_client_ids[get_edge_rank(self.conf, world_id)].append(client_id)
+
+        # init the placeholders, and async to receive the stats and the sums per arch from edges.
+        reqs, edge_train_stats, edge_partial_sums, edge_partials = [], {}, [], []
+        for edge_rank, client_ids in edge_client_ids.items():
+            edge_train_stats[edge_rank] = torch.zeros(len(client_ids), 4)
+            reqs.append(dist.irecv(tensor=edge_train_stats[edge_rank], src=edge_rank))
+            if self.conf.low_rank or self.conf.pruning:
+                # one partial aggregate (in the master space) per edge.
+                partial = self.hetero_agg.init_partial()
+                partial_tb = pack_partial(partial)
+                partial_tb.buffer = torch.zeros_like(partial_tb.buffer)
+                reqs.append(dist.irecv(tensor=partial_tb.buffer, src=edge_rank))
+                edge_partials.append((partial, partial_tb))
+                continue
+            edge_archs = set(self.clientid2arch[client_id] for client_id in client_ids)
+            for arch in self.used_client_archs:
+                if arch in edge_archs:
+                    partial_sum = torch.zeros_like(self._get_flatten_client_model(arch).buffer)
+                    reqs.append(dist.irecv(tensor=partial_sum, src=edge_rank))
+                    edge_partial_sums.append((arch, partial_sum))
+
+        for req in reqs:
+            req.wait()
+        dist.barrier()
+
+        train_stats = dict(
+            (client_id, stat)
+            for edge_rank, client_ids in edge_client_ids.items()
+            for client_id, stat in zip(client_ids, edge_train_stats[edge_rank])
+        )
+        self._update_throughput_tracker(train_stats)
+
+        # the partial aggregates are summed (and normalized) in `_avg_over_archs`.
+        if self.conf.low_rank or self.conf.pruning:
+            partials = []
+            for (sums, normalizers), partial_tb in edge_partials:
+                partial_tb.unpack(list(sums.values()) + list(normalizers.values()))
+                partials.append((sums, normalizers))
+            self.conf.logger.log(
+                f"Master received the partial aggregates of {len(selected_client_ids)} local models from {len(edge_client_ids)} edges."
+            )
+            return partials
+
+        # the average local model of each arch, keyed by one of its clients
+        # (i.e. the per-arch FedAvg of these models is the exact average over all clients).
+        arch_client_ids = collections.defaultdict(list)
+        for client_id in selected_client_ids:
+            arch_client_ids[self.clientid2arch[client_id]].append(client_id)
+        flatten_local_models = dict()
+        for arch, client_ids in arch_client_ids.items():
+            client_tb = copy.copy(self._get_flatten_client_model(arch))
+            client_tb.buffer = sum(
+                partial_sum for _arch, partial_sum in edge_partial_sums if _arch == arch
+            ) / len(client_ids)
+            flatten_local_models[client_ids[0]] = client_tb
+        self.conf.logger.log(
+            f"Master received the partial aggregates of {len(selected_client_ids)} local models from {len(edge_client_ids)} edges."
+        )
+        return flatten_local_models
+
+    def _update_throughput_tracker(self, train_stats):
+        for (client_id, (train_time, n_samples, n_epochs, _)), cost in zip(
+            train_stats.items(), self._get_client_costs(list(train_stats.keys()))
+        ):
+            self.throughput_tracker.update(
+                client_id, train_time.item(), n_samples.item(), n_epochs.item(), cost=cost
+            )
+
     def _receive_label_counts_from_selected_clients(self, selected_client_ids):
         self.conf.logger.log(f"Master waits to receive the local label counts.")
         dist.barrier()
@@ -439,10 +705,18 @@ class Master(object):
         print(label_weights)
         return label_weights, qualified_labels
 
-    def _avg_over_archs(self, flatten_local_models):
+    def _avg_over_archs(self, flatten_local_models, selected_client_ids):
         if self.conf.low_rank or self.conf.pruning or self.conf.split_mix: # hetero deployment
-            self.master_model = self.hetero_agg.aggregate_model(flatten_local_models)
-            self.client_models = self.hetero_agg.split_model(self.master_model,self.client_models)
+            with self.profiler("aggregate_model"):
+                if self.conf.n_edge_aggregators > 0:
+                    # the partial aggregates of the edges (see `_receive_partial_aggregates_from_edges`).
+                    self.master_model = self.hetero_agg.aggregate_partials(
+                        flatten_local_models, selected_client_ids
+                    )
+                else:
+                    self.master_model = self.hetero_agg.aggregate_model(flatten_local_models)
+            with self.profiler("split_model"):
+                self.client_models = self.hetero_agg.split_model(self.master_model,self.client_models)
             return self.client_models
         else:
             # FedAvg:
@@ -459,22 +733,72 @@ class Master(object):
                 self.conf.logger.log(
                     f"Master uniformly average over {len(_flatten_local_models)} received models ({arch})."
                 )
-                fedavg_model = self.aggregator.aggregate(
-                    master_model=self.master_model,
-                    client_models=self.client_models,
-                    flatten_local_models=_flatten_local_models,
-                    aggregate_fn_name="_s1_federated_average",
-                    selected_client_ids=None
-                )
+                with self.profiler("aggregate_model"):
+                    fedavg_model = self.aggregator.aggregate(
+                        master_model=self.master_model,
+                        client_models=self.client_models,
+                        flatten_local_models=_flatten_local_models,
+                        aggregate_fn_name="_s1_federated_average",
+                        selected_client_ids=None
+                    )
                 archs_fedavg_models[arch] = fedavg_model
             return archs_fedavg_models
 
+    def _refresh_user_test_loader(self):
+        n_users = len(self.client_ids)
+        if self.conf.n_eval_users is None or self.conf.n_eval_users >= n_users:
+            localdata_ids = list(range(n_users))
+        else:
+            # use a dedicated random state (of the comm_round) to not perturb the client sampling.
+            random_state = np.random.RandomState(
+                self.conf.manual_seed + self.conf.graph.comm_round
+            )
+            localdata_ids = sorted(
+                random_state.choice(n_users, self.conf.n_eval_users, replace=False).tolist()
+            )
+
+        if localdata_ids != self.test_localdata_ids:
+            test_loader = create_dataset.define_user_test_loader(
+                self.conf, self.dataset["test"], localdata_ids
+            )
+            # only cache the test tensors if the loader is reused (i.e. all users are evaluated).
+            if len(localdata_ids) == n_users:
+                test_loader = create_dataset.define_cached_test_loader(self.conf, test_loader)
+
+            # update in place, as the list is shared with the aggregator.
+            self.test_loaders[:] = [test_loader]
+            self.test_localdata_ids = localdata_ids
+
+    def _get_test_loaders(self):
+        if self.conf.partitioned_by_user:
+            self._refresh_user_test_loader()
+            return self.test_loaders
+        if master_utils.is_full_evaluation(self.conf):
+            return self.test_loaders
+
+        if self.subset_test_loaders is None:
+            subset_test_loader = create_dataset.define_stratified_test_loader(
+                self.conf,
+                self.dataset["test"],
+                subset_size=self.conf.eval_subset_size,
+                random_state=np.random.RandomState(self.conf.manual_seed),
+            )
+            self.subset_test_loaders = (
+                [create_dataset.define_cached_test_loader(self.conf, subset_test_loader)]
+                if subset_test_loader is not None
+                else self.test_loaders
+            )
+        return self.subset_test_loaders
+
     def _aggregate_model_and_evaluate(self, flatten_local_models, selected_client_ids):
+        # the test loaders of this round (the full test set or a stratified subset).
+        test_loaders = self._get_test_loaders()
+
         # uniformly averaged the model before the potential aggregation scheme.
         same_arch = len(self.client_models) == 1
 
         # uniformly average local models with the same architecture.
-        fedavg_models = self._avg_over_archs(flatten_local_models)
+        fedavg_models = self._avg_over_archs(flatten_local_models, selected_client_ids)
         if same_arch:
             fedavg_model = list(fedavg_models.values())[0]
         else:
@@ -492,7 +816,7 @@ class Master(object):
                     fedavg_model,
                     self.criterion,
                     self.metrics,
-                    self.test_loaders,
+                    test_loaders,
                     label=f"fedag_test_loader",
                 )
             # else:
@@ -506,22 +830,24 @@ class Master(object):
                         _fedavg_model,
                         self.criterion,
                         self.metrics,
-                        self.test_loaders,
+                        test_loaders,
                         label=f"fedag_test_loader_{_arch}",
                     )
 
             # aggregate the local models.
-            client_models = self.aggregator.aggregate(
-                master_model=self.master_model,
-                client_models=self.client_models,
-                fedavg_model=fedavg_model,
-                fedavg_models=fedavg_models,
-                flatten_local_models=flatten_local_models,
-                selected_client_ids=selected_client_ids
-            )
+            with self.profiler("distillation"):
+                client_models = self.aggregator.aggregate(
+                    master_model=self.master_model,
+                    client_models=self.client_models,
+                    fedavg_model=fedavg_model,
+                    fedavg_models=fedavg_models,
+                    flatten_local_models=flatten_local_models,
+                    selected_client_ids=selected_client_ids
+                )
             if self.conf.low_rank or self.conf.pruning or self.conf.split_mix:
                 self.master_model.load_state_dict(client_models.state_dict())
-                self.client_models = self.hetero_agg.split_model(self.master_model, self.client_models)
+                with self.profiler("split_model"):
+                    self.client_models = self.hetero_agg.split_model(self.master_model, self.client_models)
             else:
                 # here the 'client_models' are updated in-place.
                 if same_arch:
@@ -541,65 +867,96 @@ class Master(object):
             for arch, _fedavg_model in fedavg_models.items():
                 self.client_models[arch].load_state_dict(_fedavg_model.state_dict())
 
+        # the client models are updated, so refresh their flattened copies.
+        self.flatten_client_models = {}
+
         # evaluate the aggregated model on the test data.
-        #milestones = [int(x) for x in self.conf.lr_milestones.split(",")]
         if same_arch:
-            # to save time, we do not fix the bn statistics from scratch
-            # if self.conf.freeze_bn and self.conf.graph.comm_round >= milestones[0]:
-            #     test_model = self.fix_bn_stat(fedavg_model, arch=self.used_client_archs[0])
-            # else:
             test_model = fedavg_model
-            master_utils.do_validation(
-                self.conf,
-                self.coordinator[0],
-                test_model,
-                # self.master_model,
-                self.criterion,
-                self.metrics,
-                self.test_loaders,
-                label=f"aggregated_test_loader",
-            )
+            if self.conf.bn_recalibration:
+                with self.profiler("bn_recalibration"):
+                    test_model = self.fix_bn_stat([self.used_client_archs[0]], [fedavg_model])[0]
+            with self.profiler("evaluate"):
+                master_utils.do_validation(
+                    self.conf,
+                    self.coordinator[0],
+                    test_model,
+                    # self.master_model,
+                    self.criterion,
+                    self.metrics,
+                    test_loaders,
+                    label=f"aggregated_test_loader",
+                )
 
         else:
-            for index, (arch, _client_model) in enumerate(self.client_models.items()):
-                test_model = copy.deepcopy(_client_model)
+            # evaluate all archs in one sweep over the test data (each batch is loaded once);
+            # the client models are evaluated in place (only the slim mode is switched).
+            archs, test_models = list(self.client_models.keys()), list(self.client_models.values())
 
-                # if self.conf.freeze_bn and self.conf.graph.comm_round >= milestones[0]:
-                #     test_model = self.fix_bn_stat(test_model, arch=arch)
+            if self.conf.bn_recalibration:
+                with self.profiler("bn_recalibration"):
+                    test_models = self.fix_bn_stat(archs, test_models)
 
-                if self.conf.split_mix:
+            if self.conf.split_mix:
+                for arch, test_model in zip(archs, test_models):
                     if self.conf.pruning:
                         test_model.switch_slim_mode(eval(arch.split('_')[-1]))
                     else:
                         test_model.switch_slim_mode(1.0/float(eval(arch.split('_')[-1])))
 
-                master_utils.do_validation(
+            with self.profiler("evaluate"):
+                performances = master_utils.get_avg_perf_of_archs_on_dataloaders(
                     self.conf,
-                    self.coordinator[index],
-                    test_model,
+                    self.coordinator,
+                    test_models,
                     self.criterion,
                     self.metrics,
-                    self.test_loaders,
-                    label=f"aggregated_test_loader_{arch}",
+                    test_loaders,
+                    labels=[f"aggregated_test_loader_{arch}" for arch in archs],
                 )
+                for index, (arch, test_model) in enumerate(zip(archs, test_models)):
+                    master_utils.do_validation(
+                        self.conf,
+                        self.coordinator[index],
+                        test_model,
+                        self.criterion,
+                        self.metrics,
+                        test_loaders,
+                        performance=performances[index],
+                        label=f"aggregated_test_loader_{arch}",
+                    )
+
+            if self.conf.split_mix:
+                for test_model in test_models:
+                    test_model.switch_slim_mode(self.hetero_agg.max_ratio)
         # torch.cuda.empty_cache()
         # return performance.dictionary['top1']
 
 
-    def fix_bn_stat(self, model, arch):
-        with torch.no_grad():
-
-            self.test_models[arch].load_state_dict(model.state_dict(), strict=False)
-            self.test_models[arch] = self.test_models[arch].cuda()
-            self.test_models[arch].train(True)
-
-            # total_step = len(self.data_loader) / self.conf.n_clients * self.conf.n_participated
-            for _input, _target in self.data_loader:
-                input = _input.cuda()
-                self.test_models[arch](input)
+    def _get_calibration_loader(self):
+        if self.calibration_loader is None:
+            self.calibration_loader = create_dataset.define_calibration_loader(
+                self.conf,
+                self.dataset["train"],
+                subset_size=self.conf.bn_calibration_size,
+                random_state=np.random.RandomState(self.conf.manual_seed),
+            )
+        return self.calibration_loader
 
-        return self.test_models[arch]
+    def fix_bn_stat(self, archs, models):
+        """load the (aggregated) models into the test models (with the bn statistics),
+        and recalibrate their bn statistics in one pass over the calibration subset."""
+        if self.conf.split_mix:
+            # the slimmable bn layers do not track the statistics.
+            return models
 
+        test_models = []
+        for arch, model in zip(archs, models):
+            self.test_models[arch].load_state_dict(model.state_dict(), strict=False)
+            test_models.append(self.test_models[arch])
+        return master_utils.recalibrate_bn(
+            self.conf, test_models, self._get_calibration_loader()
+        )
 
     def _check_early_stopping(self):
         meet_flag = False
@@ -639,17 +996,77 @@ class Master(object):
         self.conf.logger.log(f"Master finished the federated learning.")
         self.conf.is_finished = True
         self.conf.finished_comm = _comm_round
+        self.profiler.step()
+        checkpoint.flush_checkpoints(self.conf)
         checkpoint.save_arguments(self.conf)
         os.system(f"echo {self.conf.checkpoint_root} >> {self.conf.job_id}")
 
 
-    def get_label_split(self):
-        label_split = {0: torch.arange(0, self.conf.num_classes)}
-        for client_idx, stat_infos in self.data_partitioner.targets_of_partitions.items():
-            unique_elements = [stat_info[0] for stat_info in stat_infos]
-            label_split[client_idx + 1] = torch.tensor(unique_elements, dtype=torch.int64)
+    def _get_resume_state(self):
+        state = {
+            "current_comm_round": self.conf.graph.comm_round,
+            "master_model": self.master_model.state_dict(),
+            "client_models": dict(
+                (arch, client_model.state_dict())
+                for arch, client_model in self.client_models.items()
+            ),
+            "clientid2arch": self.clientid2arch,
+            "clientid2archindex": getattr(self, "clientid2archindex", None),
+            "coordinator": [
+                coordinator.best_trackers for coordinator in self.coordinator
+            ],
+            "early_stopping_tracker": self.early_stopping_tracker.__dict__,
+            "throughput_tracker": self.throughput_tracker.state_dict(),
+            "rng_state": checkpoint.get_rng_state(self.conf),
+        }
+        if hasattr(self, "hetero_agg"):
+            state["hetero_agg"] = self.hetero_agg.state_dict()
+
+        # the server optimizer states (e.g., of server_momentum) are stored in the conf.
+        state["server_buffers"] = dict(
+            (name, getattr(self.conf, name))
+            for name in ["server_momentum_buffer", "second_server_momentum_buffer"]
+            if hasattr(self.conf, name)
+        )
+        return state
+
+    def _load_resume_state(self):
+        state = checkpoint.load_resume_state(self.conf)
 
-        return label_split
+        self.master_model.load_state_dict(state["master_model"])
+        for arch, client_model_state in state["client_models"].items():
+            self.client_models[arch].load_state_dict(client_model_state)
+        self.clientid2arch = state["clientid2arch"]
+        self.conf.clientid2arch = self.clientid2arch
+        self.aggregator.clientid2arch = self.clientid2arch
+        if state["clientid2archindex"] is not None:
+            self.clientid2archindex = state["clientid2archindex"]
+        if "hetero_agg" in state:
+            self.hetero_agg.load_state_dict(state["hetero_agg"])
+            self.hetero_agg.clientid2arch = self.clientid2arch
+            if self.conf.split_mix:
+                self.hetero_agg.refresh_client_slims()
+
+        for coordinator, best_trackers in zip(self.coordinator, state["coordinator"]):
+            coordinator.best_trackers = best_trackers
+        self.early_stopping_tracker.__dict__.update(state["early_stopping_tracker"])
+        self.throughput_tracker.load_state_dict(state["throughput_tracker"])
+        for name, buffer in state["server_buffers"].items():
+            setattr(
+                self.conf,
+                name,
+                buffer.cuda() if self.conf.graph.on_cuda else buffer,
+            )
+        checkpoint.set_rng_state(self.conf, state["rng_state"])
+
+        self.conf.graph.comm_round = state["current_comm_round"]
+        self.start_comm_round = state["current_comm_round"] + 1
+        self.conf.logger.log(
+            f"Master resumed from {self.conf.resume} (comm_round={self.conf.graph.comm_round})."
+        )
+
+    def get_label_split(self):
+        return master_utils.get_label_split(self.conf, self.data_partitioner)
 
 
 def get_n_local_epoch(conf, n_participated):
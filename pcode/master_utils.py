@@ -2,12 +2,14 @@
 import functools
 
 import torch
+import torch.nn as nn
 import torch.nn.functional as F
 
 import pcode.datasets.mixup_data as mixup
 import pcode.create_dataset as create_dataset
 import pcode.utils.checkpoint as checkpoint
-from pcode.utils.stat_tracker import RuntimeTracker
+from pcode.aggregation import svd_agg, pruning_agg, mix_agg
+from pcode.utils.stat_tracker import RuntimeTracker, GroupRuntimeTracker
 from pcode.utils.logging import display_test_stat, dispaly_best_test_stat
 from pcode.utils.mathdict import MathDict
 
@@ -47,6 +49,51 @@ def inference(
     return loss, output
 
 
+def inference_per_sample(conf, model, metrics, data_batch, tracker):
+    """Evaluate the given model and update the per-sample loss and accuracy to the (per-group) tracker."""
+    output = model(data_batch["input"])
+    target = data_batch["target"]
+
+    loss = F.cross_entropy(output, target, reduction="none")
+    _, pred = output.topk(max(metrics.topks), 1, True, True)
+    correct = pred.eq(target.view(-1, 1))
+    performance = [
+        correct[:, :topk].any(dim=1).float().mul_(100.0) for topk in metrics.topks
+    ]
+    tracker.update_samples(torch.stack([loss] + performance + [torch.zeros_like(loss)]))
+    return output
+
+
+def define_tracker(data_loader, metrics):
+    # the shared test loader of several users (see `create_dataset.define_user_test_loader`)
+    # or the stratified test subset tracks the stat per group.
+    group_indices = getattr(data_loader, "group_indices", None)
+    if group_indices is not None:
+        return GroupRuntimeTracker(
+            group_indices,
+            metrics_to_track=metrics.metric_names,
+            group_weights=getattr(data_loader, "group_weights", None),
+            group_sizes=getattr(data_loader, "group_sizes", None),
+            confidence=getattr(data_loader, "confidence", 0.95),
+        )
+    return RuntimeTracker(metrics_to_track=metrics.metric_names)
+
+
+def _evaluate_batch(conf, model, criterion, metrics, data_batch, tracker):
+    if isinstance(tracker, GroupRuntimeTracker):
+        inference_per_sample(conf, model, metrics, data_batch, tracker)
+    else:
+        inference(
+            conf,
+            model,
+            criterion,
+            metrics,
+            data_batch,
+            tracker,
+            is_training=False,
+        )
+
+
 def do_validation(
     conf,
     coordinator,
@@ -88,6 +135,18 @@ def do_validation(
         conf.logger.log(f"Master saved to checkpoint.")
     return performance
 
+def is_full_evaluation(conf):
+    """Evaluate on the whole test dataset every `full_eval_every_n_rounds` and in the last
+    `full_eval_last_k_rounds`, and on the stratified test subset (if any) in between."""
+    if conf.eval_subset_size is None:
+        return True
+    comm_round = conf.graph.comm_round
+    return (
+        comm_round % conf.full_eval_every_n_rounds == 0
+        or comm_round > conf.n_comm_rounds - conf.full_eval_last_k_rounds
+    )
+
+
 def get_avg_perf_on_dataloaders(
     conf, coordinator, model, criterion, metrics, data_loaders, label
 ):
@@ -109,6 +168,124 @@ def get_avg_perf_on_dataloaders(
     return performance
 
 
+def get_avg_perf_of_archs_on_dataloaders(
+    conf, coordinators, models, criterion, metrics, data_loaders, labels
+):
+    """Get the averaged performance of each model (one per arch) in one sweep over each data_loader."""
+    print(
+        f"\tGet averaged performance of {len(models)} archs from {len(data_loaders)} data_loaders."
+    )
+    performances = [[] for _ in models]
+
+    for idx, data_loader in enumerate(data_loaders):
+        _performances = validate_archs(
+            conf,
+            coordinators,
+            models,
+            criterion,
+            metrics,
+            data_loader,
+            labels=[f"{label}-{idx}" for label in labels],
+        )
+        for performance, _performance in zip(performances, _performances):
+            performance.append(MathDict(_performance))
+    return [
+        functools.reduce(lambda a, b: a + b, performance) / len(performance)
+        for performance in performances
+    ]
+
+
+def validate_archs(
+    conf,
+    coordinators,
+    models,
+    criterion,
+    metrics,
+    data_loader,
+    labels,
+    display=True,
+):
+    """Evaluate several models (e.g. the different archs of the clients) on the same data_loader,
+    where each batch is only loaded (decoded and normalized) once and fed to all models."""
+    if data_loader is None:
+        return [None] * len(models)
+
+    # switch to evaluation mode and place the models to the device.
+    for model in models:
+        model.eval()
+        if conf.graph.on_cuda:
+            model.cuda()
+
+    # evaluate on test_loader.
+    trackers_te = [define_tracker(data_loader, metrics) for _ in models]
+
+    for _input, _target in data_loader:
+        # load data and check performance.
+        data_batch = create_dataset.load_data_batch(
+            conf, _input, _target, is_training=False
+        )
+
+        with torch.no_grad():
+            for model, tracker_te in zip(models, trackers_te):
+                _evaluate_batch(conf, model, criterion, metrics, data_batch, tracker_te)
+
+    # place back models to the cpu.
+    if conf.graph.on_cuda:
+        for model in models:
+            model.cpu()
+
+    # display the test stat.
+    perfs = []
+    for coordinator, tracker_te, label in zip(coordinators, trackers_te, labels):
+        perf = tracker_te()
+        if label is not None:
+            display_test_stat(conf, coordinator, tracker_te, label)
+        if display:
+            conf.logger.log(f"The validation performance ({label}) = {perf}.")
+        perfs.append(perf)
+    return perfs
+
+
+def recalibrate_bn(conf, models, data_loader):
+    """Recalibrate the bn statistics of several models (e.g. the aggregated archs) in one pass
+    over the (calibration) data_loader: the running stats are reset and re-estimated
+    by the cumulative moving average (i.e. momentum=None), while the weights are kept."""
+    if len(data_loader) == 0:
+        # the statistics cannot be re-estimated (i.e. keep the aggregated ones).
+        return models
+
+    bn_layers = []
+    for model in models:
+        # only the bn layers are in the training mode (e.g. no dropout).
+        model.eval()
+        if conf.graph.on_cuda:
+            model.cuda()
+        for module in model.modules():
+            if isinstance(module, nn.modules.batchnorm._BatchNorm) and module.track_running_stats:
+                bn_layers.append((module, module.momentum))
+                module.reset_running_stats()
+                module.momentum = None
+                module.train()
+
+    # e.g. the models without the bn statistics (freeze_bn) do not need the pass.
+    for _input, _target in data_loader if len(bn_layers) > 0 else []:
+        data_batch = create_dataset.load_data_batch(
+            conf, _input, _target, is_training=False
+        )
+        with torch.no_grad():
+            for model in models:
+                model(data_batch["input"])
+
+    # restore the momentum, and place back models to the cpu.
+    for module, momentum in bn_layers:
+        module.momentum = momentum
+        module.eval()
+    if conf.graph.on_cuda:
+        for model in models:
+            model.cpu()
+    return models
+
+
 def validate(
     conf,
     coordinator,
@@ -131,7 +308,7 @@ def validate(
         model = model.cuda()
 
     # evaluate on test_loader.
-    tracker_te = RuntimeTracker(metrics_to_track=metrics.metric_names)
+    tracker_te = define_tracker(data_loader, metrics)
 
     for _input, _target in data_loader:
         # load data and check performance.
@@ -140,15 +317,7 @@ def validate(
         )
 
         with torch.no_grad():
-            inference(
-                conf,
-                model,
-                criterion,
-                metrics,
-                data_batch,
-                tracker_te,
-                is_training=False,
-            )
+            _evaluate_batch(conf, model, criterion, metrics, data_batch, tracker_te)
 
     # place back model to the cpu.
     if conf.graph.on_cuda:
@@ -231,3 +400,30 @@ def ensembled_validate(
     perf = tracker_te()
     conf.logger.log(f"The performance of the ensenmbled model: {perf}.")
     return perf
+
+
+def get_label_split(conf, data_partitioner):
+    """the labels of each client (the client 0, i.e. the master, has all labels)."""
+    label_split = {0: torch.arange(0, conf.num_classes)}
+    for client_idx, stat_infos in data_partitioner.targets_of_partitions.items():
+        unique_elements = [stat_info[0] for stat_info in stat_infos]
+        label_split[client_idx + 1] = torch.tensor(unique_elements, dtype=torch.int64)
+    return label_split
+
+
+def define_hetero_aggregator(conf, master_model, client_models, label_split):
+    """the aggregator of the hetero deployment (split-mix, pruning or low-rank clients)."""
+    factor = eval(conf.used_client_archs[-1].split('_')[-1])
+    if conf.split_mix:
+        return mix_agg.MixAggregator(conf, master_model, client_models, label_split)
+    elif factor < 1:
+        hetero_agg = pruning_agg.HeteroAggregator(conf, master_model, client_models, label_split)
+        print("initilized by splitting model")
+        return hetero_agg
+    elif factor > 1:
+        hetero_agg = svd_agg.SVDAggregator(conf, master_model, client_models, label_split)
+        print("initialized by spectual!")
+        return hetero_agg
+    else:
+        print("the clients failed to be sorted")
+        exit(-1)
@@ -4,14 +4,15 @@ import numpy as np
 import operator
 from collections import OrderedDict
 from typing import Union, List, Type
-from .resnet import resnet
+from .resnet import resnet, ResNet_imagenet
 import torch
 import torch.nn as nn
 import torch.nn.functional as func
 
 from .bn_ops import get_bn_layer, DualNormLayer
 from .slimmable_ops import SlimmableConv2d, SlimmableLinear, SwitchableLayer1D, \
-    SlimmableBatchNorm2d, SlimmableBatchNorm1d, SlimmableOpMixin
+    SlimmableBatchNorm2d, SlimmableBatchNorm1d, SlimmableOpMixin, \
+    fused_conv2d, fused_norm, fused_linear, fused_sequential
 
 class BaseModule(nn.Module):
     def set_bn_mode(self, is_noised: Union[bool, torch.Tensor]):
@@ -138,6 +139,13 @@ class SlimmableMixin(object):
                 m.mix_forward_num = mix_forward_num
 
 
+    def refresh_slim_cache(self):
+        """Drop the materialized sub-layer params, e.g. after loading the aggregated model."""
+        for m in self.modules():
+            if isinstance(m, SlimmableOpMixin):
+                m.refresh_slim_cache()
+
+
 class Ensemble(nn.Module):
     def __init__(self, full_net: SlimmableMixin, weights=None):
         super().__init__()
@@ -340,6 +348,7 @@ class EnsembleNet(BaseModule, SlimmableMixin):
         self.mix_forward_num = 0
         # self._total_slim_ratio = self.slim_ratio
         self.base_idxs = list(range(num_ens))
+        self.use_fused_forward = conf.fused_split_mix
 
     @property
     def input_shape(self):
@@ -369,6 +378,8 @@ class EnsembleNet(BaseModule, SlimmableMixin):
 
     def forward(self, x):
         base_idxs = self.current_slice()
+        if self.use_fused_forward and len(base_idxs) > 1:
+            return self.fused_forward(x, base_idxs)
         logits = [self[i](x) for i in base_idxs]
         if len(base_idxs) > 1:
             logits = torch.mean(torch.stack(logits, dim=-1), dim=-1)
@@ -377,6 +388,18 @@ class EnsembleNet(BaseModule, SlimmableMixin):
 
         return logits
 
+    def fused_forward(self, x, base_idxs=None, reduction='mean'):
+        """Forward the bases (by default, the current slice) at once as one grouped net.
+        reduction='stack' returns the logits of the bases as [batch, num_classes, n_bases]."""
+        base_idxs = self.current_slice() if base_idxs is None else base_idxs
+        logits = _fused_resnet_forward([self[i] for i in base_idxs], x)
+        if reduction == 'mean':
+            return torch.mean(logits, dim=1)
+        elif reduction == 'stack':
+            return logits.permute(0, 2, 1)
+        else:
+            raise ValueError(f"Invalid reduction: {reduction}")
+
     def current_slice(self):
         start = self.slim_bias_idx
         # end = start + int(len(self) * self.slim_ratio)
@@ -421,6 +444,46 @@ class EnsembleNet(BaseModule, SlimmableMixin):
         return destination
 
 
+def _fused_block_forward(blocks, x):
+    block = blocks[0]
+    residual = x
+    if block.downsample is not None:
+        residual = fused_sequential(x, [_block.downsample for _block in blocks])
+
+    conv_names = [name for name in ['conv1', 'conv2', 'conv3'] if hasattr(block, name)]
+    out = x
+    for i, name in enumerate(conv_names):
+        out = fused_conv2d(out, [getattr(_block, name) for _block in blocks])
+        if getattr(block, 'need_scaler', False):
+            out = block.scaler(out)
+        out = fused_norm(out, [getattr(_block, f'bn{i + 1}') for _block in blocks])
+        if i < len(conv_names) - 1:
+            out = func.relu(out)
+
+    out = out + residual
+    return func.relu(out)
+
+
+def _fused_resnet_forward(bases, x):
+    """The fused counterpart of `ResNet_imagenet.forward` for n bases: [batch, n, num_classes]."""
+    net = bases[0]
+    assert isinstance(net, ResNet_imagenet) and not net.projection, \
+        "The fused forward only supports the (non-projected) ResNet_imagenet bases."
+
+    out = fused_conv2d(x, [base.conv1 for base in bases], shared_input=True)
+    if net.need_scaler:
+        out = net.scaler(out)
+    out = func.relu(fused_norm(out, [base.bn1 for base in bases]))
+
+    for name in ['layer1', 'layer2', 'layer3', 'layer4']:
+        for blocks in zip(*[getattr(base, name) for base in bases]):
+            out = _fused_block_forward(blocks, out)
+
+    out = func.adaptive_avg_pool2d(out, 1)
+    out = out.view(out.size(0), -1)
+    return fused_linear(out, [base.classifier for base in bases])
+
+
 class SlimmableDigitModel(BaseModule, SlimmableMixin):
     """
     Model for benchmark experiment on Digits.
@@ -2,6 +2,7 @@
 Ref: https://github.com/htwang14/CAT/blob/1152f7095d6ea0026c7344b00fefb9f4990444f2/models/FiLM.py#L35
 """
 import numpy as np
+import torch
 import torch.nn as nn
 from torch.nn import functional as F
 from torch.nn.modules.batchnorm import _BatchNorm
@@ -49,12 +50,44 @@ class SlimmableOpMixin(object):
             mix_num = int(1/self.slim_ratio)
         elif mix_num == 0:
             print("WARNING: not mix anything.")
-        out = 0.
-        for shift_idx in range(0, mix_num):
-            out = out + self._forward_with_partial_weight(x, shift_idx)
-        return out * 1. / mix_num
+        # the op is linear in its (partial) params for a given input, thus averaging the
+        # outputs of the shifted sub-ops equals one forward with the averaged params.
+        def _mix_params():
+            partial_params = zip(*[self._get_partial_params(shift_idx) for shift_idx in range(0, mix_num)])
+            return [
+                None if params[0] is None else sum(params) * 1. / mix_num for params in partial_params
+            ]
+        return self._forward_with_params(x, *self._cached_params(('mix', mix_num), _mix_params))
 
     def _forward_with_partial_weight(self, x, slim_bias_idx, out_slim_bias_idx=None):
+        return self._forward_with_params(x, *self._cached_params(
+            (slim_bias_idx, out_slim_bias_idx),
+            lambda: self._get_partial_params(slim_bias_idx, out_slim_bias_idx)))
+
+    def _cached_params(self, key, get_params_fn):
+        """Materialize contiguous sub-layer params per (width, base index) for the forward passes
+        without grad. An entry is refreshed once the full params are modified (e.g. after the
+        aggregation or a local step), which is detected by the tensor version counters."""
+        if self.weight is None or (torch.is_grad_enabled() and self.weight.requires_grad):
+            return get_params_fn()
+
+        key = (self.slim_ratio,) + key
+        version = tuple(
+            (param.data_ptr(), param._version) for param in (self.weight, self.bias) if param is not None)
+        cache = self.__dict__.setdefault('_slim_cache', {})
+        if key not in cache or cache[key][0] != version:
+            cache[key] = (version, [
+                None if param is None else param.detach().contiguous() for param in get_params_fn()
+            ])
+        return cache[key][1]
+
+    def refresh_slim_cache(self):
+        self.__dict__['_slim_cache'] = {}
+
+    def _get_partial_params(self, slim_bias_idx, out_slim_bias_idx=None):
+        raise NotImplementedError()
+
+    def _forward_with_params(self, x, weight, bias):
         raise NotImplementedError()
 
     def _compute_slice_bound(self, in_channels, out_channels, slim_bias_idx, out_slim_bias_idx=None):
@@ -107,11 +140,13 @@ class _SlimmableBatchNorm(_BatchNorm, SlimmableOpMixin):
         else:
             return self.mix_forward(x, mix_num=self.mix_forward_num)
 
-    def _forward_with_partial_weight(self, input, slim_bias_idx, out_slim_bias_idx=None):
+    def _get_partial_params(self, slim_bias_idx, out_slim_bias_idx=None):
         out_idx0, out_idx1 = self._compute_slice_bound(self.num_features, slim_bias_idx)
         weight = self.weight[out_idx0:out_idx1]
         bias = self.bias[out_idx0:out_idx1]
+        return weight, bias
 
+    def _forward_with_params(self, input, weight, bias):
         # ----- copy from parent implementation ----
         self._check_input_dim(input)
 
@@ -235,11 +270,14 @@ class SlimmableConv2d(nn.Conv2d, SlimmableOpMixin):
         else:
             return self.mix_forward(x, mix_num=self.mix_forward_num)
 
-    def _forward_with_partial_weight(self, x, slim_bias_idx, out_slim_bias_idx=None):
+    def _get_partial_params(self, slim_bias_idx, out_slim_bias_idx=None):
         out_idx0, out_idx1, in_idx0, in_idx1 = self._compute_slice_bound(
             self.in_channels, self.out_channels, slim_bias_idx, out_slim_bias_idx)
         weight = self.weight[out_idx0:out_idx1, in_idx0:in_idx1]
         bias = self.bias[out_idx0:out_idx1] if self.bias is not None else None
+        return weight, bias
+
+    def _forward_with_params(self, x, weight, bias):
         y = F.conv2d(
             x, weight, bias, self.stride, self.padding,
             self.dilation, self.groups)
@@ -304,11 +342,14 @@ class SlimmableLinear(nn.Linear, SlimmableOpMixin):
         else:
             return self.mix_forward(x, mix_num=self.mix_forward_num)
 
-    def _forward_with_partial_weight(self, x, slim_bias_idx, out_slim_bias_idx=None):
+    def _get_partial_params(self, slim_bias_idx, out_slim_bias_idx=None):
         out_idx0, out_idx1, in_idx0, in_idx1 = self._compute_slice_bound(
             self.in_features, self.out_features, slim_bias_idx, out_slim_bias_idx)
         weight = self.weight[out_idx0:out_idx1, in_idx0:in_idx1]
         bias = self.bias[out_idx0:out_idx1] if self.bias is not None else None
+        return weight, bias
+
+    def _forward_with_params(self, x, weight, bias):
         out = F.linear(x, weight, bias)
         return out / self.slim_ratio if self.training and not self.non_slimmable_out else out
 
@@ -332,3 +373,77 @@ class SlimmableLinear(nn.Linear, SlimmableOpMixin):
         elif name == 'bias' and param is not None:
             param = param[out_idx_bias:(out_idx_bias + self.out_features)]
         return param
+
+
+"""Fused execution of independent (same-architecture) bases.
+The n bases are laid side by side on the channel dim, s.t. every layer becomes one
+grouped op (groups = n_bases) instead of n small ops in a python loop.
+"""
+
+
+def fused_conv2d(x, convs, shared_input=False):
+    """x holds the inputs of the n convs concatenated on the channel dim,
+    or a single input for all convs if shared_input."""
+    conv = convs[0]
+    weight = torch.cat([_conv.weight for _conv in convs], dim=0)
+    bias = torch.cat([_conv.bias for _conv in convs], dim=0) if conv.bias is not None else None
+    groups = conv.groups if shared_input else conv.groups * len(convs)
+    return F.conv2d(x, weight, bias, conv.stride, conv.padding, conv.dilation, groups)
+
+
+def fused_norm(x, norms):
+    norm = norms[0]
+    weight = torch.cat([_norm.weight for _norm in norms]) if norm.weight is not None else None
+    bias = torch.cat([_norm.bias for _norm in norms]) if norm.bias is not None else None
+    if isinstance(norm, nn.GroupNorm):
+        # the groups of a base never span the channels of the other bases.
+        return F.group_norm(x, norm.num_groups * len(norms), weight, bias, norm.eps)
+
+    assert isinstance(norm, _BatchNorm), f"Cannot fuse the norm layer {type(norm)}."
+    if norm.momentum is None:
+        exponential_average_factor = 0.0
+    else:
+        exponential_average_factor = norm.momentum
+    if norm.training and norm.track_running_stats:
+        for _norm in norms:
+            _norm.num_batches_tracked.add_(1)
+        if norm.momentum is None:  # use cumulative moving average
+            exponential_average_factor = 1.0 / float(norm.num_batches_tracked)
+
+    bn_training = norm.training or (norm.running_mean is None and norm.running_var is None)
+    use_running_stats = norm.running_mean is not None and (not norm.training or norm.track_running_stats)
+    running_mean = torch.cat([_norm.running_mean for _norm in norms]) if use_running_stats else None
+    running_var = torch.cat([_norm.running_var for _norm in norms]) if use_running_stats else None
+    y = F.batch_norm(x, running_mean, running_var, weight, bias, bn_training,
+                     exponential_average_factor, norm.eps)
+
+    # write the updated running stats back to the bases.
+    if use_running_stats and norm.training:
+        with torch.no_grad():
+            for _norm, _mean, _var in zip(norms, running_mean.chunk(len(norms)),
+                                          running_var.chunk(len(norms))):
+                _norm.running_mean.copy_(_mean)
+                _norm.running_var.copy_(_var)
+    return y
+
+
+def fused_linear(x, linears):
+    """x: [batch, n * in_features] -> [batch, n, out_features]."""
+    weight = torch.stack([_linear.weight for _linear in linears])
+    out = torch.einsum("bni,noi->bno", x.view(x.size(0), len(linears), -1), weight)
+    if linears[0].bias is not None:
+        out = out + torch.stack([_linear.bias for _linear in linears]).unsqueeze(0)
+    return out
+
+
+def fused_sequential(x, sequentials):
+    for layers in zip(*sequentials):
+        layer = layers[0]
+        if isinstance(layer, nn.Conv2d):
+            x = fused_conv2d(x, layers)
+        elif isinstance(layer, (_BatchNorm, nn.GroupNorm)):
+            x = fused_norm(x, layers)
+        else:
+            # parameter-free layers (e.g. relu, scaler) are shared by the bases.
+            x = layer(x)
+    return x
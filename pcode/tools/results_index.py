@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import numbers
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from pcode.utils.op_paths import list_files
+from pcode.utils.op_files import read_json
+
+
+"""a columnar (incrementally updated) index of the runtime logs of the experiments."""
+
+# the fields of a runtime record that are not metrics.
+META_FIELDS = {
+    "measurement",
+    "split",
+    "type",
+    "time",
+    "comm_round",
+    "worker_id",
+    "client_id",
+    "epoch",
+    "local_index",
+}
+ROW_COLUMNS = [
+    "run_id",
+    "file_id",
+    "record_id",
+    "split",
+    "type",
+    "comm_round",
+    "time",
+    "metric",
+    "value",
+]
+CATEGORICAL_COLUMNS = ["split", "type", "metric"]
+
+
+def _get_storage_format():
+    try:
+        import pyarrow.parquet  # noqa
+
+        return "parquet"
+    except ImportError:
+        return "npz"
+
+
+class ResultsIndex(object):
+    """One row per (run, record, metric) over all experiments under `root_path`.
+
+    The index is stored under `{root_path}/.results_index` (as parquet if pyarrow is available,
+    otherwise as npz); `update` only (re-)indexes the log files that are new or modified,
+    and the appended part of the streaming `log.jsonl` files.
+    """
+
+    def __init__(self, root_path, index_folder=".results_index"):
+        self.root_path = root_path
+        self.index_path = os.path.join(root_path, index_folder)
+        self.storage_format = _get_storage_format()
+        self._load()
+
+    """load/save the index."""
+
+    def _load(self):
+        meta_path = os.path.join(self.index_path, "meta.json")
+        rows_path = os.path.join(self.index_path, f"rows.{self.storage_format}")
+        if os.path.exists(meta_path) and os.path.exists(rows_path):
+            meta = read_json(meta_path)
+            self.runs = {int(run_id): run for run_id, run in meta["runs"].items()}
+            self.files = {
+                int(file_id): _file for file_id, _file in meta["files"].items()
+            }
+            self.rows = self._load_rows(rows_path)
+        else:
+            self.runs, self.files = {}, {}
+            self.rows = _build_rows({column: [] for column in ROW_COLUMNS})
+        self._build_arguments()
+
+    def _load_rows(self, rows_path):
+        if self.storage_format == "parquet":
+            return pd.read_parquet(rows_path)
+        with np.load(rows_path) as columns:
+            return _build_rows({column: columns[column] for column in ROW_COLUMNS})
+
+    def save(self):
+        os.makedirs(self.index_path, exist_ok=True)
+        rows_path = os.path.join(self.index_path, f"rows.{self.storage_format}")
+        if self.storage_format == "parquet":
+            self.rows.to_parquet(rows_path + ".tmp", index=False)
+        else:
+            with open(rows_path + ".tmp", "wb") as f:
+                np.savez(
+                    f,
+                    **{
+                        column: self.rows[column].to_numpy(
+                            dtype=str if column in CATEGORICAL_COLUMNS else None
+                        )
+                        for column in ROW_COLUMNS
+                    },
+                )
+        os.replace(rows_path + ".tmp", rows_path)
+
+        # the meta is written last.
+        meta_path = os.path.join(self.index_path, "meta.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"runs": self.runs, "files": self.files}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    """update the index."""
+
+    def update(self, save=True):
+        path2run_id = {run["path"]: run_id for run_id, run in self.runs.items()}
+        path2file_id = {_file["path"]: file_id for file_id, _file in self.files.items()}
+        existing_run_ids, existing_file_ids = set(), set()
+        dropped_file_ids, new_rows = set(), []
+
+        for folder_path in self._list_experiment_folders():
+            arguments_path = os.path.join(folder_path, "arguments.json")
+            if not os.path.exists(arguments_path):
+                continue
+
+            # register the run.
+            run_id = path2run_id.get(folder_path, None)
+            if run_id is None:
+                run_id = max(self.runs.keys(), default=-1) + 1
+                self.runs[run_id] = {"path": folder_path}
+                path2run_id[folder_path] = run_id
+            self.runs[run_id]["arguments"] = read_json(arguments_path)
+            existing_run_ids.add(run_id)
+
+            for shard, file_path in _list_log_files(folder_path):
+                stat = os.stat(file_path)
+                file_id = path2file_id.get(file_path, None)
+                if file_id is None:
+                    file_id = max(self.files.keys(), default=-1) + 1
+                    path2file_id[file_path] = file_id
+                    self.files[file_id] = {
+                        "path": file_path,
+                        "offset": 0,
+                        "num_records": 0,
+                    }
+                existing_file_ids.add(file_id)
+
+                _file = self.files[file_id]
+                if (
+                    _file.get("size") == stat.st_size
+                    and _file.get("mtime") == stat.st_mtime
+                ):
+                    continue
+
+                # only parse the appended lines of the (append-only) jsonl file.
+                is_appended = (
+                    file_path.endswith(".jsonl")
+                    and _file.get("size") is not None
+                    and stat.st_size >= _file["size"]
+                )
+                if not is_appended:
+                    dropped_file_ids.add(file_id)
+                    _file.update({"offset": 0, "num_records": 0})
+                records, _file["offset"] = _read_log_file(
+                    file_path, offset=_file["offset"]
+                )
+                new_rows.append(
+                    _records_to_columns(
+                        records, run_id, file_id, first_record_id=_file["num_records"]
+                    )
+                )
+                _file.update(
+                    {
+                        "run_id": run_id,
+                        "shard": shard,
+                        "size": stat.st_size,
+                        "mtime": stat.st_mtime,
+                        "num_records": _file["num_records"] + len(records),
+                    }
+                )
+
+        # remove the runs/files that do not exist anymore.
+        dropped_file_ids |= set(self.files.keys()) - existing_file_ids
+        self.runs = {k: v for k, v in self.runs.items() if k in existing_run_ids}
+        self.files = {k: v for k, v in self.files.items() if k in existing_file_ids}
+
+        # update the rows.
+        rows = [self.rows[~self.rows["file_id"].isin(list(dropped_file_ids))]]
+        rows += [_build_rows(columns) for columns in new_rows]
+        self.rows = pd.concat(rows, ignore_index=True)
+        for column in CATEGORICAL_COLUMNS:
+            self.rows[column] = self.rows[column].astype("category")
+        self._build_arguments()
+
+        if save:
+            self.save()
+        return self
+
+    def _list_experiment_folders(self):
+        if not os.path.exists(self.root_path):
+            return []
+        return sorted(
+            folder_path
+            for folder_path in list_files(self.root_path)
+            if os.path.isdir(folder_path)
+            and "pickle" not in folder_path
+            and folder_path != self.index_path
+        )
+
+    def _build_arguments(self):
+        run_ids = sorted(self.runs.keys())
+        self.arguments = pd.DataFrame.from_records(
+            [self.runs[run_id].get("arguments", {}) for run_id in run_ids],
+            index=pd.Index(run_ids, dtype=np.int64),
+        )
+
+    """query the index."""
+
+    def select_runs(self, conditions=None, threshold=1e-8):
+        """The vectorized counterpart of `show_results.is_meet_conditions`:
+        conditions={name: [value_1, ..., value_k]} selects the runs matching
+        any of the k combinations of values."""
+        if conditions is None:
+            return self.arguments.index.to_numpy()
+
+        is_selected = np.zeros(len(self.arguments), dtype=bool)
+        for values in zip(*conditions.values()):
+            is_matched = np.ones(len(self.arguments), dtype=bool)
+            for name, value in zip(conditions.keys(), values):
+                if name not in self.arguments:
+                    is_matched &= value is None
+                    continue
+
+                column = self.arguments[name]
+                if value is None:
+                    is_matched &= column.isna().to_numpy()
+                elif isinstance(value, numbers.Number) and not isinstance(value, bool):
+                    numeric_column = pd.to_numeric(column, errors="coerce")
+                    is_matched &= (
+                        ((numeric_column - value).abs() <= threshold)
+                        .fillna(False)
+                        .to_numpy()
+                    )
+                else:
+                    is_matched &= (column == value).to_numpy()
+            is_selected |= is_matched
+        return self.arguments.index.to_numpy()[is_selected]
+
+    def query(self, conditions=None, split=None, type=None, metric=None):
+        """Return the rows of the selected runs, filtered by split/type/metric
+        (each can be a value or a list of values)."""
+        is_selected = np.ones(len(self.rows), dtype=bool)
+        if conditions is not None:
+            is_selected &= (
+                self.rows["run_id"].isin(self.select_runs(conditions)).to_numpy()
+            )
+        for column, values in [("split", split), ("type", type), ("metric", metric)]:
+            if values is not None:
+                values = values if isinstance(values, (list, tuple)) else [values]
+                is_selected &= self.rows[column].isin(values).to_numpy()
+        return self.rows[is_selected]
+
+    def to_records(self, conditions=None):
+        """Return the list of (arguments, info) in the format of
+        `show_results.extract_list_of_records` (as consumed by `plot`)."""
+        run_ids = self.select_runs(conditions)
+        rows = self.query(
+            split="test",
+            type=[
+                "aggregated_test_loader-0",
+                "fedag_test_loader-0",
+                "ensemble_test_loader",
+            ],
+        )
+        rows = rows[rows["run_id"].isin(run_ids)]
+        file_id2shard = {
+            file_id: _file["shard"] for file_id, _file in self.files.items()
+        }
+
+        records = []
+        for run_id, run_rows in rows.groupby("run_id", sort=True, observed=True):
+            records.append(
+                (
+                    self.runs[run_id]["arguments"],
+                    _reorganize_rows(run_rows, file_id2shard),
+                )
+            )
+        print("we have {}/{} records.".format(len(records), len(self.runs)))
+        return records
+
+
+"""parse the log files."""
+
+
+def _list_log_files(folder_path):
+    """return the (shard, path) of the runtime logs (of the first rank) of the experiment."""
+    sub_folder_paths = sorted(
+        sub_folder_path
+        for sub_folder_path in list_files(folder_path)
+        if os.path.isdir(sub_folder_path)
+        and ".tar" not in sub_folder_path
+        and "pickle" not in sub_folder_path
+    )
+    if len(sub_folder_paths) == 0:
+        return []
+
+    log_files = []
+    for file in os.listdir(sub_folder_paths[0]):
+        if file in ("log.jsonl", "log.json"):
+            log_files.append((0, file))
+        elif file.startswith("log-") and file.endswith(".json"):
+            log_files.append((int(file[len("log-") : -len(".json")]), file))
+    return [
+        (shard, os.path.join(sub_folder_paths[0], file))
+        for shard, file in sorted(log_files)
+    ]
+
+
+def _read_log_file(file_path, offset=0):
+    """return the records and the offset (in bytes) of the parsed part of the file."""
+    if not file_path.endswith(".jsonl"):
+        with open(file_path) as f:
+            return json.load(f), 0
+
+    records = []
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            # stop at the (possibly) truncated last line of a running experiment.
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records, offset
+
+
+def _parse_time(string):
+    try:
+        return datetime.strptime(string, "%Y-%m-%d %H:%M:%S").timestamp()
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _records_to_columns(records, run_id, file_id, first_record_id=0):
+    columns = {column: [] for column in ROW_COLUMNS}
+    for record_id, record in enumerate(records, start=first_record_id):
+        if record.get("measurement", None) != "runtime":
+            continue
+
+        _time = _parse_time(record.get("time", None))
+        for metric, value in record.items():
+            if (
+                metric in META_FIELDS
+                or not isinstance(value, numbers.Number)
+                or isinstance(value, bool)
+            ):
+                continue
+            columns["run_id"].append(run_id)
+            columns["file_id"].append(file_id)
+            columns["record_id"].append(record_id)
+            columns["split"].append(record.get("split", ""))
+            columns["type"].append(record.get("type", ""))
+            columns["comm_round"].append(record.get("comm_round", np.nan))
+            columns["time"].append(_time)
+            columns["metric"].append(metric)
+            columns["value"].append(value)
+    return columns
+
+
+def _build_rows(columns):
+    rows = pd.DataFrame(
+        {
+            "run_id": np.asarray(columns["run_id"], dtype=np.int32),
+            "file_id": np.asarray(columns["file_id"], dtype=np.int32),
+            "record_id": np.asarray(columns["record_id"], dtype=np.int64),
+            "split": pd.Categorical(np.asarray(columns["split"], dtype=str)),
+            "type": pd.Categorical(np.asarray(columns["type"], dtype=str)),
+            "comm_round": np.asarray(columns["comm_round"], dtype=np.float64),
+            "time": np.asarray(columns["time"], dtype=np.float64),
+            "metric": pd.Categorical(np.asarray(columns["metric"], dtype=str)),
+            "value": np.asarray(columns["value"], dtype=np.float64),
+        }
+    )
+    return rows
+
+
+def _reorganize_rows(rows, file_id2shard):
+    """The counterpart of `show_results.reorganize_records` on the rows of one run."""
+
+    def _parse(_type):
+        _rows = rows[rows["type"] == _type]
+        if len(_rows) == 0:
+            return [], [], [], [], []
+        table = _rows.pivot_table(
+            index=["file_id", "record_id"],
+            columns="metric",
+            values="value",
+            aggfunc="last",
+            observed=True,
+        )
+        meta = _rows.groupby(["file_id", "record_id"], observed=True)[
+            ["comm_round", "time"]
+        ].first()
+        table = table.join(meta)
+
+        # sort the records by (shard, record_id).
+        shards = [
+            file_id2shard.get(file_id, 0)
+            for file_id in table.index.get_level_values("file_id")
+        ]
+        order = np.lexsort(
+            (table.index.get_level_values("record_id").to_numpy(), shards)
+        )
+        table = table.iloc[order]
+
+        def _get(metric, default):
+            if metric not in table:
+                return [default] * len(table)
+            return table[metric].fillna(default).tolist()
+
+        time = [
+            datetime.fromtimestamp(_time) if not np.isnan(_time) else None
+            for _time in table["time"]
+        ]
+        return (
+            time,
+            table["comm_round"].tolist(),
+            _get("loss", np.nan),
+            _get("top1", 0),
+            _get("top5", 0),
+        )
+
+    if (rows["type"] == "fedag_test_loader-0").sum() == 0:
+        te_time, te_epoch, te_loss, te_top1, te_top5 = _parse(
+            "aggregated_test_loader-0"
+        )
+        return {
+            "te_time": te_time,
+            "te_step": te_epoch,
+            "te_loss": te_loss,
+            "te_top1": te_top1,
+            "te_top5": te_top5,
+        }
+
+    (
+        te_fedavg_time,
+        te_fedavg_epoch,
+        te_fedavg_loss,
+        te_fedavg_top1,
+        te_fedavg_top5,
+    ) = _parse("fedag_test_loader-0")
+    _, _, te_aggreg_loss, te_aggreg_top1, te_aggreg_top5 = _parse(
+        "aggregated_test_loader-0"
+    )
+    _, _, te_ensemble_loss, te_ensemble_top1, te_ensemble_top5 = _parse(
+        "ensemble_test_loader"
+    )
+    return {
+        "te_time": te_fedavg_time,
+        "te_step": te_fedavg_epoch,
+        "te_avg_loss": te_fedavg_loss,
+        "te_avg_top1": te_fedavg_top1,
+        "te_avg_top5": te_fedavg_top5,
+        "te_loss": te_aggreg_loss,
+        "te_top1": te_aggreg_top1,
+        "te_top5": te_aggreg_top5,
+        "te_ensemble_loss": te_ensemble_loss,
+        "te_ensemble_top1": te_ensemble_top1,
+        "te_ensemble_top5": te_ensemble_top5,
+    }
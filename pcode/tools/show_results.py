@@ -40,6 +40,7 @@ def load_raw_info_from_experiments(root_path):
         folder_path
         for folder_path in list_files(root_path)
         if "pickle" not in folder_path
+        and not os.path.basename(folder_path).startswith(".")
     ]
 
     info = []
@@ -76,9 +77,14 @@ def _get_info_from_the_folder(folder_path):
 
 
 def _parse_runtime_infos(file_folder):
-    existing_json_files = [file for file in os.listdir(file_folder) if "json" in file]
+    existing_json_files = [
+        file for file in os.listdir(file_folder) if file.endswith(".json")
+    ]
 
-    if "log.json" in existing_json_files:
+    if "log.jsonl" in os.listdir(file_folder):
+        # streaming logging fashion.
+        return _parse_runtime_info(os.path.join(file_folder, "log.jsonl"))
+    elif "log.json" in existing_json_files:
         # old logging fashion.
         return _parse_runtime_info(os.path.join(file_folder, "log.json"))
     else:
@@ -95,40 +101,61 @@ def _parse_runtime_infos(file_folder):
         )
 
 
-def _parse_runtime_info(json_file_path):
+def _load_runtime_lines(json_file_path):
     with open(json_file_path) as json_file:
-        lines = json.load(json_file)
-
-        # distinguish lines to different types.
-        tr_lines, aggregated_test_lines, fedavg_test_lines, ensemble_test_lines = (
-            [],
-            [],
-            [],
-            [],
-        )
+        if json_file_path.endswith(".jsonl"):
+            # skip the (possibly) truncated last line of a running experiment.
+            lines = []
+            for line in json_file:
+                try:
+                    lines.append(json.loads(line))
+                except ValueError:
+                    pass
+            return lines
+        return json.load(json_file)
 
-        for line in lines:
-            if line["measurement"] != "runtime":
-                continue
-
-            try:
-                _time = str2time(line["time"], "%Y-%m-%d %H:%M:%S")
-            except RuntimeError:
-                _time = None
-            line["time"] = _time
-
-            if line["split"] == "train":
-                tr_lines.append(line)
-            elif line["split"] == "test":
-                if line["type"] == "aggregated_test_loader-0":
-                    aggregated_test_lines.append(line)
-                elif line["type"] == "fedag_test_loader-0":
-                    fedavg_test_lines.append(line)
-                elif line["type"] == "ensemble_test_loader":
-                    ensemble_test_lines.append(line)
+
+def _parse_runtime_info(json_file_path):
+    lines = _load_runtime_lines(json_file_path)
+
+    # distinguish lines to different types.
+    tr_lines, aggregated_test_lines, fedavg_test_lines, ensemble_test_lines = (
+        [],
+        [],
+        [],
+        [],
+    )
+
+    for line in lines:
+        if line["measurement"] != "runtime":
+            continue
+
+        try:
+            _time = str2time(line["time"], "%Y-%m-%d %H:%M:%S")
+        except RuntimeError:
+            _time = None
+        line["time"] = _time
+
+        if line["split"] == "train":
+            tr_lines.append(line)
+        elif line["split"] == "test":
+            if line["type"] == "aggregated_test_loader-0":
+                aggregated_test_lines.append(line)
+            elif line["type"] == "fedag_test_loader-0":
+                fedavg_test_lines.append(line)
+            elif line["type"] == "ensemble_test_loader":
+                ensemble_test_lines.append(line)
     return tr_lines, fedavg_test_lines, aggregated_test_lines, ensemble_test_lines
 
 
+def load_records_from_index(root_path, conditions=None):
+    """The indexed counterpart of `load_raw_info_from_experiments` + `extract_list_of_records`:
+    only the new/modified log files are parsed (see `results_index.ResultsIndex`)."""
+    from pcode.tools.results_index import ResultsIndex
+
+    return ResultsIndex(root_path).update().to_records(conditions)
+
+
 """extract the results based on the condition."""
 
 
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import copy
+import os
+from statistics import median
+
+import numpy as np
+import torch
+
+from pcode.utils.flops_counter import get_model_complexity_info
+
+
+def get_arch_costs(conf, client_models, sample_input=None):
+    """Estimate the relative (to the largest arch) training cost of the client archs.
+
+    The cost is given by the flops of the arch (by `flops_counter`) for the image inputs,
+    and by the # of parameters otherwise. For split_mix, all archs share the (max) slimmable
+    model and the cost is linear in the # of bases trained by the client.
+    """
+    archs = list(client_models.keys())
+    if conf.split_mix:
+        if conf.pruning:
+            ratios = [eval(arch.split("_")[-1]) for arch in archs]
+        else:
+            ratios = [1.0 / float(eval(arch.split("_")[-1])) for arch in archs]
+        costs = dict(zip(archs, ratios))
+    else:
+        costs = {}
+        for arch, model in client_models.items():
+            if isinstance(sample_input, torch.Tensor):
+                # count on a copy, as the counter attaches its hooks/methods to the model.
+                with open(os.devnull, "w") as ost, torch.no_grad():
+                    flops, _ = get_model_complexity_info(
+                        copy.deepcopy(model).cpu(),
+                        tuple(sample_input.shape),
+                        print_per_layer_stat=False,
+                        as_strings=False,
+                        ost=ost,
+                    )
+            else:
+                flops = sum(param.numel() for param in model.parameters())
+            costs[arch] = float(flops)
+
+    max_cost = max(costs.values())
+    return dict((arch, cost / max_cost) for arch, cost in costs.items())
+
+
+class ArchPlanner(object):
+    """
+    Plan the arch of each client (i.e. its rank factor for low_rank, its width for pruning,
+    or its # of bases for split_mix) from the estimated cost of the archs and the measured
+    speed of the clients, s.t. each client finishes its local training within the deadline.
+
+    The speed of a client is its training time per local epoch and per unit of cost
+    (tracked by the `ClientThroughputTracker`); each client is assigned the largest arch
+    predicted to meet the deadline (or the smallest arch if none does).
+    """
+
+    def __init__(self, conf, client_models, clientid2arch, sample_input=None):
+        self.conf = conf
+        self.arch_costs = get_arch_costs(conf, client_models, sample_input)
+        self.archs_by_cost = sorted(self.arch_costs, key=lambda arch: self.arch_costs[arch])
+
+        # the relative deadline is anchored to the average cost of the initial assignment.
+        self.reference_cost = np.mean(
+            [self.arch_costs[arch] for arch in clientid2arch.values()]
+        )
+
+    def get_deadline(self, throughput_tracker, n_epochs):
+        if self.conf.round_deadline is not None:
+            return self.conf.round_deadline
+        return (
+            self.conf.straggler_deadline_factor
+            * median(throughput_tracker.epoch_time.values())
+            * self.reference_cost
+            * n_epochs
+        )
+
+    def plan(self, throughput_tracker, n_epochs):
+        """Return the planned arch of each (seen) client."""
+        if len(throughput_tracker.epoch_time) == 0:
+            return {}
+
+        deadline = self.get_deadline(throughput_tracker, n_epochs)
+        clientid2arch = {}
+        for client_id, unit_time in throughput_tracker.epoch_time.items():
+            fitted_archs = [
+                arch
+                for arch in self.archs_by_cost
+                if unit_time * self.arch_costs[arch] * n_epochs <= deadline
+            ]
+            clientid2arch[client_id] = (
+                fitted_archs[-1] if len(fitted_archs) > 0 else self.archs_by_cost[0]
+            )
+        return clientid2arch
@@ -1,15 +1,27 @@
 # -*- coding: utf-8 -*-
+import os
+import re
+import copy
 import time
+import queue
+import atexit
 import shutil
 import json
+import random
+import threading
 from os.path import join
 
+import numpy as np
 import torch
+import torch.distributed as dist
 
 from pcode.utils.op_paths import build_dirs
 from pcode.utils.op_files import is_jsonable
 
 
+_N_RESUME_STATES = 2
+
+
 def get_checkpoint_folder_name(conf):
     # get optimizer info.
     optim_info = "{}".format(conf.optimizer)
@@ -51,12 +63,6 @@ def init_checkpoint(conf, rank=None):
         build_dirs(conf.checkpoint_dir)
 
 
-def _save_to_checkpoint(state, dirname, filename):
-    checkpoint_path = join(dirname, filename)
-    torch.save(state, checkpoint_path)
-    return checkpoint_path
-
-
 def save_arguments(conf):
     # save the configure file to the checkpoint.
     # write_pickle(conf, path=join(conf.checkpoint_root, "arguments.pickle"))
@@ -75,24 +81,224 @@ def save_arguments(conf):
 
 
 def save_to_checkpoint(conf, state, is_best, dirname, filename, save_all=False):
-    # save full state.
-    checkpoint_path = _save_to_checkpoint(state, dirname, filename)
-    best_model_path = join(dirname, "model_best.pth.tar")
+    if conf.checkpoint_fp16 or conf.async_checkpoint:
+        state = snapshot_state(state, fp16=conf.checkpoint_fp16)
+
+    if conf.async_checkpoint:
+        # write the (snapshotted) state in the background.
+        get_checkpoint_writer(conf).submit(
+            write_checkpoint, conf, state, is_best, dirname, filename, save_all
+        )
+    else:
+        write_checkpoint(conf, state, is_best, dirname, filename, save_all=save_all)
+
+
+def write_checkpoint(conf, state, is_best, dirname, filename, save_all=False):
+    # save full state (atomically).
+    checkpoint_path = _save_to_checkpoint_atomic(state, dirname, filename)
     if is_best:
-        shutil.copyfile(checkpoint_path, best_model_path)
-    if save_all:
-        shutil.copyfile(
+        _link_or_copy(checkpoint_path, join(dirname, "model_best.pth.tar"))
+
+    # keep the checkpoint of this round.
+    comm_round = state["current_comm_round"]
+    is_saved_model = (
+        conf.save_some_models is not None
+        and str(comm_round) in conf.save_some_models
+    )
+    is_periodic = (
+        conf.checkpoint_every_n_rounds is not None
+        and comm_round % conf.checkpoint_every_n_rounds == 0
+    )
+    if save_all or is_saved_model or is_periodic:
+        _link_or_copy(
             checkpoint_path,
-            join(
-                dirname, "checkpoint_c_round_%s.pth.tar" % state["current_comm_round"]
-            ),
+            join(dirname, "checkpoint_c_round_%s.pth.tar" % comm_round),
+        )
+    if conf.checkpoint_keep_last_k is not None:
+        _apply_retention(conf, dirname, keep_last_k=conf.checkpoint_keep_last_k)
+    return checkpoint_path
+
+
+def _save_to_checkpoint_atomic(state, dirname, filename):
+    checkpoint_path = join(dirname, filename)
+    torch.save(state, checkpoint_path + ".tmp")
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+    return checkpoint_path
+
+
+def _link_or_copy(src_path, dst_path):
+    """hard-link the checkpoint (i.e., no copy of the data) if possible;
+    note that the atomic rename of the next checkpoint does not affect the link."""
+    tmp_path = dst_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src_path, tmp_path)
+    except OSError:
+        shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+
+
+def _apply_retention(conf, dirname, keep_last_k):
+    """only keep the last k round checkpoints (except the ones in `save_some_models`)."""
+    round_checkpoints = []
+    for file in os.listdir(dirname):
+        matched = re.match(r"^checkpoint_c_round_(\d+)\.pth\.tar$", file)
+        if matched is None:
+            continue
+        if (
+            conf.save_some_models is not None
+            and matched.group(1) in conf.save_some_models
+        ):
+            continue
+        round_checkpoints.append((int(matched.group(1)), file))
+
+    round_checkpoints = sorted(round_checkpoints)
+    n_removed = max(len(round_checkpoints) - max(keep_last_k, 0), 0)
+    for _, file in round_checkpoints[:n_removed]:
+        os.remove(join(dirname, file))
+
+
+def snapshot_state(state, fp16=False):
+    """a (detached) cpu copy of the state, safe to be written by another thread;
+    the floating-point tensors are optionally stored in fp16."""
+    if isinstance(state, torch.Tensor):
+        tensor = state.detach().to("cpu", copy=True)
+        if fp16 and tensor.is_floating_point():
+            tensor = tensor.half()
+        return tensor
+    elif isinstance(state, dict):
+        return type(state)(
+            (key, snapshot_state(value, fp16=fp16)) for key, value in state.items()
+        )
+    elif isinstance(state, (list, tuple)):
+        return type(state)(snapshot_state(value, fp16=fp16) for value in state)
+    else:
+        return copy.deepcopy(state)
+
+
+class CheckpointWriter(object):
+    """Write the checkpoints in a background thread.
+
+    The state is snapshotted (to cpu) by the caller, so the caller can continue
+    to update the model; at most `max_pending` writes are queued (i.e., the caller
+    only blocks if the disk cannot keep up).
+    """
+
+    def __init__(self, max_pending=2):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, write_fn, *args, **kwargs):
+        self._raise_error()
+        self.queue.put((write_fn, args, kwargs))
+
+    def _run(self):
+        while True:
+            write_fn, args, kwargs = self.queue.get()
+            try:
+                write_fn(*args, **kwargs)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """wait until all pending checkpoints are written."""
+        self.queue.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError(f"failed to write the checkpoint: {error}")
+
+
+def get_checkpoint_writer(conf):
+    if getattr(conf, "checkpoint_writer", None) is None:
+        conf.checkpoint_writer = CheckpointWriter()
+    return conf.checkpoint_writer
+
+
+def flush_checkpoints(conf):
+    if getattr(conf, "checkpoint_writer", None) is not None:
+        conf.checkpoint_writer.flush()
+
+
+"""exact resume of the federated learning."""
+
+
+def get_rng_state(conf):
+    rng_state = {
+        "random_state": conf.random_state.get_state(),
+        "numpy": np.random.get_state(),
+        "random": random.getstate(),
+        "torch": torch.get_rng_state(),
+    }
+    if conf.graph.on_cuda:
+        rng_state["cuda"] = torch.cuda.get_rng_state_all()
+    return rng_state
+
+
+def set_rng_state(conf, rng_state):
+    conf.random_state.set_state(rng_state["random_state"])
+    np.random.set_state(rng_state["numpy"])
+    random.setstate(rng_state["random"])
+    torch.set_rng_state(rng_state["torch"])
+    if conf.graph.on_cuda and "cuda" in rng_state:
+        torch.cuda.set_rng_state_all(rng_state["cuda"])
+
+
+def save_resume_state(conf, state):
+    """save the full state of the current process (for the exact resume) to
+    `{checkpoint_dir}/resume_c_round_{comm_round}.pth.tar`; only the last few rounds are kept,
+    so that all processes can agree on a common round after a crash."""
+    state = snapshot_state(state)
+    if conf.async_checkpoint:
+        get_checkpoint_writer(conf).submit(
+            _write_resume_state, conf.checkpoint_dir, state
+        )
+    else:
+        _write_resume_state(conf.checkpoint_dir, state)
+
+
+def _write_resume_state(dirname, state):
+    _save_to_checkpoint_atomic(
+        state, dirname, "resume_c_round_%s.pth.tar" % state["current_comm_round"]
+    )
+    for comm_round in _list_resume_rounds(dirname)[:-_N_RESUME_STATES]:
+        os.remove(join(dirname, "resume_c_round_%s.pth.tar" % comm_round))
+
+
+def _list_resume_rounds(dirname):
+    comm_rounds = []
+    for file in os.listdir(dirname) if os.path.exists(dirname) else []:
+        matched = re.match(r"^resume_c_round_(\d+)\.pth\.tar$", file)
+        if matched is not None:
+            comm_rounds.append(int(matched.group(1)))
+    return sorted(comm_rounds)
+
+
+def load_resume_state(conf):
+    """load the resume state (from the checkpoint_root `conf.resume` of the previous run)
+    of the latest comm_round that is available for all processes."""
+    dirname = join(conf.resume, str(conf.graph.rank))
+    comm_rounds = _list_resume_rounds(dirname)
+    latest_comm_round = torch.tensor(comm_rounds[-1] if len(comm_rounds) > 0 else 0)
+    if dist.is_available() and dist.is_initialized():
+        dist.all_reduce(latest_comm_round, op=dist.ReduceOp.MIN)
+    latest_comm_round = int(latest_comm_round)
+
+    if latest_comm_round not in comm_rounds:
+        raise FileNotFoundError(
+            f"no resume state of comm_round={latest_comm_round} in {dirname}."
         )
-    elif conf.save_some_models is not None:
-        if str(state["current_comm_round"]) in conf.save_some_models:
-            shutil.copyfile(
-                checkpoint_path,
-                join(
-                    dirname,
-                    "checkpoint_c_round_%s.pth.tar" % state["current_comm_round"],
-                ),
-            )
+    resume_path = join(dirname, "resume_c_round_%s.pth.tar" % latest_comm_round)
+    try:
+        return torch.load(resume_path, map_location="cpu", weights_only=False)
+    except TypeError:
+        # the `weights_only` argument is not supported by the old pytorch.
+        return torch.load(resume_path, map_location="cpu")
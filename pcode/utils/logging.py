@@ -2,7 +2,9 @@
 import os
 import json
 import time
+import atexit
 import platform
+import collections
 
 from pcode.utils.op_files import write_txt
 
@@ -69,6 +71,67 @@ class Logger:
         return True if len(self.values) > 1e4 else False
 
 
+class JSONLLogger(Logger):
+    """
+    Streaming logger: each record is appended as one line to an open (line-buffered)
+    `log.jsonl`, so the cost of a record does not depend on the length of the run.
+    Only the latest `buffer_size` records are kept in memory,
+    and the files are fsynced at most every `fsync_interval` seconds.
+    """
+
+    def __init__(self, file_folder, buffer_size=1000, fsync_interval=60):
+        super(JSONLLogger, self).__init__(file_folder)
+        self.file_json = os.path.join(file_folder, "log.jsonl")
+        self.values = collections.deque(maxlen=buffer_size)
+        self.fsync_interval = fsync_interval
+
+        # keep the files open (line-buffered).
+        self.json_fp = open(self.file_json, "a", buffering=1)
+        self.txt_fp = open(self.file_txt, "a", buffering=1)
+        self.last_fsync_time = time.time()
+        atexit.register(self.close)
+
+    def log_metric(self, name, values, tags, display=False):
+        super(JSONLLogger, self).log_metric(name, values, tags, display=display)
+        self.json_fp.write(json.dumps(self.values[-1], default=_to_json) + "\n")
+
+    def save_json(self):
+        """
+        The records are already written: only fsync the files (periodically).
+        """
+        if time.time() - self.last_fsync_time >= self.fsync_interval:
+            self.fsync()
+
+    def save_txt(self, value):
+        self.txt_fp.write(value + "\n")
+
+    def fsync(self):
+        for fp in [self.json_fp, self.txt_fp]:
+            if not fp.closed:
+                fp.flush()
+                os.fsync(fp.fileno())
+        self.last_fsync_time = time.time()
+
+    def close(self):
+        self.fsync()
+        self.json_fp.close()
+        self.txt_fp.close()
+
+
+def _to_json(value):
+    # e.g., numpy scalars.
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def define_logger(conf):
+    if conf.log_backend == "jsonl":
+        return JSONLLogger(conf.checkpoint_dir)
+    elif conf.log_backend == "json":
+        return Logger(conf.checkpoint_dir)
+    else:
+        raise NotImplementedError(f"the log_backend={conf.log_backend} is not supported.")
+
+
 def display_args(conf):
     print("\n\nparameters: ")
     for arg in vars(conf):
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import collections
+from contextlib import contextmanager
+from io import StringIO
+
+import torch
+
+
+class PhaseProfiler(object):
+    """
+    Low-overhead hierarchical profiler of the phases of the federated learning.
+
+    The phases can be nested, and are identified by their path (e.g. `round/aggregate/split_model`).
+    The events are streamed to a Chrome trace (`chrome://tracing` or https://ui.perfetto.dev)
+    and the accumulated time per phase is exported as a Prometheus textfile.
+
+    Example:
+    >>> profiler = PhaseProfiler(rank=0, trace_path="trace.json", prometheus_path="phases.prom")
+    ... with profiler("round", comm_round=1):
+    ...     with profiler("aggregate"):
+    ...         aggregate()
+    ... profiler.step()
+    """
+
+    def __init__(
+        self,
+        rank=0,
+        process_name=None,
+        enabled=True,
+        cuda_sync=False,
+        trace_path=None,
+        prometheus_path=None,
+        max_pending_events=4096,
+    ):
+        self.rank = rank
+        self.enabled = enabled
+        self.cuda_sync = cuda_sync and torch.cuda.is_available()
+        self.trace_path = trace_path
+        self.prometheus_path = prometheus_path
+        self.max_pending_events = max_pending_events
+
+        # align the (monotonic) timestamps of different processes with the wall clock.
+        self._time_offset = time.time() - time.perf_counter()
+        self._stack = []
+        self._events = []
+        self.totals = collections.defaultdict(float)
+        self.call_counts = collections.defaultdict(int)
+        self.step_totals = collections.defaultdict(float)
+
+        if self.enabled and self.trace_path is not None:
+            self._init_trace(process_name or f"rank-{rank}")
+
+    @contextmanager
+    def __call__(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+
+        self._stack.append(name)
+        path = "/".join(self._stack)
+        self._cuda_sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._cuda_sync()
+            duration = time.perf_counter() - start
+            self._stack.pop()
+
+            self.totals[path] += duration
+            self.call_counts[path] += 1
+            self.step_totals[path] += duration
+            if self.trace_path is not None:
+                self._events.append((name, path, start, duration, args))
+                if len(self._events) >= self.max_pending_events:
+                    self._flush_trace()
+
+    def step(self):
+        """Finish one step (e.g. one comm round), and export the profiled phases."""
+        if not self.enabled:
+            return
+        if self.trace_path is not None:
+            self._flush_trace()
+        if self.prometheus_path is not None:
+            self._write_prometheus()
+        self.step_totals = collections.defaultdict(float)
+
+    def summary(self):
+        """Return a summary in string-form of all the phases recorded so far."""
+        with StringIO() as buffer:
+            print("--- Phase summary --------------------------------------", file=buffer)
+            print("  Phase                          |  Count | Average time", file=buffer)
+            for path in sorted(self.totals):
+                count = self.call_counts[path]
+                print(
+                    f"- {path:30s} | {count:6d} | {self.totals[path] / count:11.5f}s",
+                    file=buffer,
+                )
+            print("---------------------------------------------------------", file=buffer)
+            return buffer.getvalue()
+
+    def _cuda_sync(self):
+        if self.cuda_sync:
+            torch.cuda.synchronize()
+
+    def _init_trace(self, process_name):
+        # the chrome trace (json array format) does not require the closing bracket,
+        # so the events can be appended to the file.
+        with open(self.trace_path, "w") as f:
+            f.write("[\n")
+            f.write(
+                json.dumps(
+                    {
+                        "name": "process_name",
+                        "ph": "M",
+                        "pid": self.rank,
+                        "args": {"name": process_name},
+                    }
+                )
+                + ",\n"
+            )
+
+    def _flush_trace(self):
+        if len(self._events) == 0:
+            return
+        with open(self.trace_path, "a") as f:
+            for name, path, start, duration, args in self._events:
+                event = {
+                    "name": name,
+                    "cat": path.split("/")[0],
+                    "ph": "X",
+                    "ts": (start + self._time_offset) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": self.rank,
+                    "tid": 0,
+                    "args": dict(path=path, **args),
+                }
+                f.write(json.dumps(event) + ",\n")
+        self._events = []
+
+    def _write_prometheus(self):
+        metrics = [
+            (
+                "fedhm_phase_seconds_total",
+                "counter",
+                "Accumulated time spent in the phase.",
+                self.totals,
+            ),
+            (
+                "fedhm_phase_calls_total",
+                "counter",
+                "Number of times the phase was entered.",
+                self.call_counts,
+            ),
+            (
+                "fedhm_phase_last_step_seconds",
+                "gauge",
+                "Time spent in the phase during the last step (comm round).",
+                self.step_totals,
+            ),
+        ]
+        lines = []
+        for metric_name, metric_type, metric_help, values in metrics:
+            lines.append(f"# HELP {metric_name} {metric_help}")
+            lines.append(f"# TYPE {metric_name} {metric_type}")
+            for path in sorted(values):
+                lines.append(
+                    f'{metric_name}{{rank="{self.rank}",phase="{path}"}} {values[path]}'
+                )
+
+        # the textfile collector may read the file at any time, so we replace it atomically.
+        with open(self.prometheus_path + ".tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(self.prometheus_path + ".tmp", self.prometheus_path)
+
+
+def define_profiler(conf):
+    """define the phase profiler of the current process (exported to its checkpoint_dir)."""
+    rank = conf.graph.rank
+    return PhaseProfiler(
+        rank=rank,
+        process_name=(
+            ("monitor" if conf.gossip else "master")
+            if rank == 0
+            else f"edge-{rank}"
+            if rank > conf.n_participated
+            else f"worker-{rank}"
+        ),
+        enabled=conf.track_time,
+        cuda_sync=conf.profiler_cuda_sync,
+        trace_path=os.path.join(conf.checkpoint_dir, "trace.json"),
+        prometheus_path=os.path.join(conf.checkpoint_dir, "phases.prom"),
+    )
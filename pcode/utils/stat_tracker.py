@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 from copy import deepcopy
+from statistics import NormalDist, median
+
+import torch
 
 from pcode.utils.communication import global_average
 
@@ -111,6 +114,88 @@ class RuntimeTracker(object):
         return dict((name, val.avg) for name, val in self.stat.items())
 
 
+class GroupRuntimeTracker(object):
+    """Tracking the per-group stat of an evaluation, e.g. over the samples of several users,
+    or over the strata (classes) of a stratified test subset.
+
+    The per-sample values are scattered to their groups (`group_indices` maps the sample position
+    to its group), and the stat is the weighted average of the group averages
+    (each group is weighted equally by default).
+    If the `group_sizes` (of the population) are given, the `{name}_ci` half-width of the
+    confidence interval of the (stratified) estimate is also returned.
+    """
+
+    def __init__(
+        self,
+        group_indices,
+        metrics_to_track=["top1"],
+        group_weights=None,
+        group_sizes=None,
+        confidence=0.95,
+    ):
+        self.metrics_to_track = metrics_to_track
+        self.things_to_track = ["loss"] + metrics_to_track + ["loss2"]
+        self.group_indices = torch.as_tensor(group_indices, dtype=torch.long)
+        self.n_groups = (
+            int(self.group_indices.max()) + 1 if len(self.group_indices) > 0 else 0
+        )
+        self.group_weights = (
+            torch.ones(self.n_groups, dtype=torch.float64)
+            if group_weights is None
+            else torch.as_tensor(group_weights, dtype=torch.float64)
+        )
+        self.group_sizes = (
+            None
+            if group_sizes is None
+            else torch.as_tensor(group_sizes, dtype=torch.float64)
+        )
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.reset()
+
+    def reset(self):
+        self.pointer = 0
+        self.sums = torch.zeros(
+            len(self.things_to_track), self.n_groups, dtype=torch.float64
+        )
+        self.square_sums = torch.zeros_like(self.sums)
+        self.counts = torch.zeros(self.n_groups, dtype=torch.float64)
+
+    def update_samples(self, sample_stat):
+        """sample_stat: [len(things_to_track), n_samples] of the next samples (in order)."""
+        n_samples = sample_stat.size(1)
+        group_indices = self.group_indices[self.pointer : self.pointer + n_samples]
+        sample_stat = sample_stat.detach().cpu().double()
+        self.sums.index_add_(1, group_indices, sample_stat)
+        self.square_sums.index_add_(1, group_indices, sample_stat ** 2)
+        self.counts.index_add_(
+            0, group_indices, torch.ones(n_samples, dtype=torch.float64)
+        )
+        self.pointer += n_samples
+
+    def __call__(self):
+        evaluated = self.counts > 0
+        if not evaluated.any():
+            return dict((name, 0.0) for name in self.things_to_track)
+        counts = self.counts[evaluated]
+        weights = self.group_weights[evaluated] / self.group_weights[evaluated].sum()
+        group_avgs = self.sums[:, evaluated] / counts
+        stat = dict(
+            (name, (group_avgs[idx] * weights).sum().item())
+            for idx, name in enumerate(self.things_to_track)
+        )
+
+        if self.group_sizes is not None:
+            # the variance of the stratified estimate (with the finite population correction).
+            group_vars = (
+                self.square_sums[:, evaluated] - counts * group_avgs ** 2
+            ) / (counts - 1).clamp(min=1)
+            fpc = 1 - counts / self.group_sizes[evaluated]
+            variances = (weights ** 2 * fpc * group_vars.clamp(min=0) / counts).sum(dim=1)
+            for idx, name in enumerate(self.things_to_track[:-1]):
+                stat[f"{name}_ci"] = self.z * variances[idx].sqrt().item()
+        return stat
+
+
 class BestPerf(object):
     def __init__(self, best_perf=None, larger_is_better=True):
         self.best_perf = best_perf
@@ -124,9 +209,21 @@ class BestPerf(object):
     def _define_meter(self):
         self.meter = MaxMeter() if self.larger_is_better else MinMeter()
 
-    def update(self, perf, perf_location):
-        self.is_best = self.meter.update(perf)
+    def update(self, perf, perf_location, interval=None):
+        if interval is None:
+            self.is_best = self.meter.update(perf)
+        else:
+            # an estimate (e.g. on a test subset) with the half-width of its confidence interval,
+            # is only considered as the best if it is significantly better.
+            best_perf = self.meter.value()
+            bound = perf - interval if self.larger_is_better else perf + interval
+            self.is_best = best_perf is None or (
+                bound > best_perf if self.larger_is_better else bound < best_perf
+            )
+            if self.is_best:
+                self.meter.update(perf)
         self.cur_perf = perf
+        self.cur_interval = interval
 
         if self.is_best:
             self.best_perf = perf
@@ -136,6 +233,49 @@ class BestPerf(object):
     def get_best_perf_loc(self):
         return self.best_perf_locs[-1] if len(self.best_perf_locs) != 0 else 0
 
+class ClientThroughputTracker(object):
+    """
+    Keeps track of the exponential moving average of the training time (per local epoch)
+    and of the throughput (samples per second) of each client, reported with its local model.
+    The training time can be normalized by the (relative) cost of the arch used by the client.
+    """
+
+    def __init__(self, decay=0.5):
+        self.decay = decay
+        self.epoch_time = {}
+        self.throughput = {}
+
+    def update(self, client_id, train_time, n_samples, n_epochs, cost=1.0):
+        if train_time <= 0 or n_epochs <= 0:
+            return
+        for stat, value in (
+            (self.epoch_time, train_time / n_epochs / cost),
+            (self.throughput, n_samples / train_time),
+        ):
+            stat[client_id] = (
+                value
+                if client_id not in stat
+                else self.decay * stat[client_id] + (1 - self.decay) * value
+            )
+
+    def predict_time(self, client_ids, n_epochs, costs=None):
+        """Predict the training time of the clients for their n_epochs (and arch costs);
+        the time of the unseen clients is the median of the seen clients."""
+        default = median(self.epoch_time.values()) if len(self.epoch_time) > 0 else 0.0
+        costs = [1.0] * len(client_ids) if costs is None else costs
+        return [
+            self.epoch_time.get(client_id, default) * _n_epochs * cost
+            for client_id, _n_epochs, cost in zip(client_ids, n_epochs, costs)
+        ]
+
+    def state_dict(self):
+        return {"epoch_time": dict(self.epoch_time), "throughput": dict(self.throughput)}
+
+    def load_state_dict(self, state):
+        self.epoch_time = dict(state["epoch_time"])
+        self.throughput = dict(state["throughput"])
+
+
 import torch
 class LogitTracker():
     def __init__(self, unique_labels,device):
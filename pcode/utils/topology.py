@@ -72,3 +72,45 @@ def define_graph_topology(world, world_conf, n_participated, on_cuda):
         world_conf=world_conf,
         on_cuda=on_cuda,
     )
+
+
+def get_gossip_neighbors(ranks, topology="ring"):
+    """the (undirected) neighbors of each rank in the gossip topology."""
+    n_nodes = len(ranks)
+    neighbors = dict((rank, set()) for rank in ranks)
+    for index, rank in enumerate(ranks):
+        if topology == "ring":
+            offsets = [1, -1]
+        elif topology == "exponential":
+            # the neighbors at the distance of the powers of 2 (i.e. O(log n) degree).
+            offsets = [
+                sign * 2 ** k
+                for k in range(max(1, (n_nodes - 1).bit_length()))
+                for sign in [1, -1]
+            ]
+        elif topology == "complete":
+            offsets = list(range(1, n_nodes))
+        else:
+            raise NotImplementedError(f"the gossip topology={topology} is not supported yet.")
+
+        for offset in offsets:
+            neighbor_rank = ranks[(index + offset) % n_nodes]
+            if neighbor_rank != rank:
+                neighbors[rank].add(neighbor_rank)
+                neighbors[neighbor_rank].add(rank)
+    return neighbors
+
+
+def get_gossip_neighbors_info(ranks, rank, topology="ring"):
+    """the mixing weights of a rank and its neighbors, by the Metropolis-Hastings rule
+    (i.e. w_ij = 1 / (1 + max(d_i, d_j))), s.t. the mixing matrix is symmetric and doubly stochastic."""
+    neighbors = get_gossip_neighbors(ranks, topology)
+    neighbors_info = dict(
+        (
+            neighbor_rank,
+            1.0 / (1 + max(len(neighbors[rank]), len(neighbors[neighbor_rank]))),
+        )
+        for neighbor_rank in sorted(neighbors[rank])
+    )
+    neighbors_info[rank] = 1.0 - sum(neighbors_info.values())
+    return neighbors_info
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import copy
+import time
 
 import numpy as np
 import torch
@@ -14,10 +15,12 @@ import pcode.create_optimizer as create_optimizer
 import pcode.create_scheduler as create_scheduler
 import pcode.datasets.mixup_data as mixup
 import pcode.local_training.compressor as compressor
+import pcode.utils.checkpoint as checkpoint
+from pcode.edge import get_edge_rank
 from pcode.utils.logging import display_training_stat
 from pcode.utils.stat_tracker import RuntimeTracker
 from pcode.utils.tensor_buffer import TensorBuffer
-from pcode.utils.timer import Timer
+from pcode.utils.profiler import define_profiler
 
 
 class Worker(object):
@@ -29,12 +32,8 @@ class Worker(object):
         conf.graph.worker_id = conf.graph.rank
         self.device = torch.device("cuda" if self.conf.graph.on_cuda else "cpu")
 
-        # define the timer for different operations.
-        # if we choose the `train_fast` mode, then we will not track the time.
-        self.timer = Timer(
-            verbosity_level=1 if conf.track_time else 0,
-            log_fn=conf.logger.log_metric,
-        )
+        # define the profiler for different phases (only enabled by `track_time`).
+        self.profiler = define_profiler(conf)
         self.arch = None
         # create dataset (as well as the potential data_partitioner) for training.
         dist.barrier()
@@ -82,15 +81,29 @@ class Worker(object):
             f"Worker-{conf.graph.worker_id} initialized dataset/criterion.\n"
         )
 
+        # restore the state of the previous run (for the exact resume).
+        if conf.resume is not None:
+            self._load_resume_state()
+
 
     def run(self):
+        # the resumed run may have already finished all communication rounds.
+        if self.conf.resume is not None and self._terminate_by_complete_training():
+            return
+
         while True:
             self._listen_to_master()
 
             if self.conf.graph.client_id <= 0:
+                # the idle worker (e.g. of a dropped straggler) only joins the barriers of the round.
+                if self._terminate_by_early_stopping():
+                    return
                 dist.barrier()
                 dist.barrier()
                 dist.barrier()
+                self._save_resume_state()
+                if self._terminate_by_complete_training():
+                    return
                 continue
 
             # check if we need to terminate the training or not.
@@ -98,34 +111,65 @@ class Worker(object):
                 return
 
 
-            self._recv_model_from_master()
-            self._train()
-
-            self._send_model_to_master(self.model)
+            with self.profiler("round", comm_round=self.conf.graph.comm_round):
+                with self.profiler("receive_model"):
+                    self._recv_model_from_master()
+                with self.profiler("train"):
+                    self._train()
+                with self.profiler("send_model"):
+                    self._send_model_to_master(self.model)
+            self.profiler.step()
+            self._save_resume_state()
 
             # check if we need to terminate the training or not.
             if self._terminate_by_complete_training():
                 return
 
+    def _save_resume_state(self):
+        if not self.conf.save_resume_state:
+            return
+        checkpoint.save_resume_state(self.conf, self._get_resume_state())
+
+    def _get_resume_state(self):
+        return {
+            "current_comm_round": self.conf.graph.comm_round,
+            "global_optimizer": self.global_optimizer.state_dict(),
+            "global_lr_scheduler": self.global_scheduler.lr_scheduler.state_dict(),
+            "rng_state": checkpoint.get_rng_state(self.conf),
+        }
+
+    def _load_resume_state(self):
+        state = checkpoint.load_resume_state(self.conf)
+        self.global_optimizer.load_state_dict(state["global_optimizer"])
+        self.global_scheduler.lr_scheduler.load_state_dict(state["global_lr_scheduler"])
+        checkpoint.set_rng_state(self.conf, state["rng_state"])
+        self.conf.graph.comm_round = state["current_comm_round"]
+        self.conf.logger.log(
+            f"Worker-{self.conf.graph.worker_id} resumed from {self.conf.resume} (comm_round={self.conf.graph.comm_round})."
+        )
+        return state
+
     def _listen_to_master(self):
         # listen to master, related to the function `_activate_selected_clients` in `master.py`.
         msg_len = 3
         if self.conf.split_mix:
             msg_len += 1
-        if self.conf.dynamic:
+        if self.conf.dynamic or self.conf.arch_planning:
             msg_len += 1
 
         msg = torch.zeros((msg_len, self.conf.n_participated))
         dist.broadcast(tensor=msg, src=0)
 
-        self.conf.graph.client_id, self.conf.graph.comm_round, self.n_local_epochs = (
-            msg[:3, self.conf.graph.rank - 1].to(int).cpu().numpy().tolist()
+        self.conf.graph.client_id, self.conf.graph.comm_round = (
+            msg[:2, self.conf.graph.rank - 1].to(int).cpu().numpy().tolist()
         )
+        # the local epochs can be fractional (e.g. adapted to the deadline of the round).
+        self.n_local_epochs = msg[2, self.conf.graph.rank - 1].item()
 
         if self.conf.split_mix:
             self.slim_length = msg[3, self.conf.graph.rank - 1].to(int).cpu().numpy().tolist()
 
-        if self.conf.dynamic:
+        if self.conf.dynamic or self.conf.arch_planning:
             self.arch_index = msg[msg_len - 1][self.conf.graph.rank - 1].to(int).cpu().numpy().tolist()
             archs = self.conf.arch_info["worker"]
             self.arch = archs[self.arch_index]
@@ -173,6 +217,9 @@ class Worker(object):
 
 
     def _train(self):
+        # the training stats are reported to the master with the local model.
+        self.train_start_time = time.perf_counter()
+        self.n_trained_samples = 0
         self._turn_on_grad()
         self.model.train()
 
@@ -220,14 +267,30 @@ class Worker(object):
 
             for _input, _target in self.train_loader:
                 # load data
-                with self.timer("load_data", epoch=self.scheduler.epoch_):
+                with self.profiler("load_data"):
                     data_batch = create_dataset.load_data_batch(
                         self.conf, _input, _target,is_training=True,device=self.device
                     )
 
+                self.n_trained_samples += len(_target)
+
                 self.optimizer.zero_grad()
-                if self.conf.split_mix:
-                    with self.timer("forward_pass", epoch=self.scheduler.epoch_):
+                if self.conf.split_mix and self.conf.fused_split_mix:
+                    with self.profiler("forward_backward"):
+                        # one grouped forward/backward over all the sampled bases.
+                        outputs = self.model.fused_forward(
+                            data_batch["input"], base_idxs=self.slim_shifts.tolist(), reduction='stack'
+                        )
+                        total_loss = 0
+                        for idx in range(outputs.size(-1)):
+                            loss, performance, output = self._inference(data_batch, output=outputs[..., idx])
+                            total_loss += loss
+                        total_loss.backward()
+
+                        loss = total_loss / self.slim_length
+
+                elif self.conf.split_mix:
+                    with self.profiler("forward_backward"):
                         total_loss = 0
                         for in_slim_shift in self.slim_shifts:
                             self.model.switch_slim_mode(self.atom_slim_ratio, slim_bias_idx=in_slim_shift)
@@ -240,18 +303,19 @@ class Worker(object):
 
                 else:
                     # inference and get current performance.
-                    with self.timer("forward_pass", epoch=self.scheduler.epoch_):
+                    with self.profiler("forward"):
                         loss, performance, output = self._inference(data_batch)
 
-                    if self.conf.local_prox_term != 0:
-                        loss = self._local_training_with_prox(loss,output.size(0))
-                    else:
-                        loss = self._local_training_with_self_distillation(
-                            loss, output, data_batch)
-                    loss.backward()
-                    self._add_frob_grad()
+                        if self.conf.local_prox_term != 0:
+                            loss = self._local_training_with_prox(loss,output.size(0))
+                        else:
+                            loss = self._local_training_with_self_distillation(
+                                loss, output, data_batch)
+                    with self.profiler("backward"):
+                        loss.backward()
+                        self._add_frob_grad()
 
-                with self.timer("backward_pass", epoch=self.scheduler.epoch_):
+                with self.profiler("optimizer"):
 
                     self.optimizer.step()
                     self.scheduler.step()
@@ -267,7 +331,7 @@ class Worker(object):
                             performance[idx - 1], idx, n_samples=bsz
                         )
                 # efficient local training.
-                with self.timer("compress_model", epoch=self.scheduler.epoch_):
+                with self.profiler("compress_model"):
                     if hasattr(self, "model_compression_fn"):
                         self.model_compression_fn.compress_model(
                             param_groups=self.optimizer.param_groups
@@ -281,7 +345,7 @@ class Worker(object):
                         self.conf.display_tracked_time
                         and self.scheduler.local_index % self.conf.summary_freq == 0
                 ):
-                    self.conf.logger.log(self.timer.summary())
+                    self.conf.logger.log(self.profiler.summary())
 
                 # check divergence.
                 # if self.tracker.stat["loss"].avg > 1e3 or np.isnan(
@@ -320,10 +384,11 @@ class Worker(object):
         return total_loss / self.slim_length
 
 
-    def _inference(self, data_batch):
+    def _inference(self, data_batch, output=None):
         """Inference on the given model and get loss and accuracy."""
         # do the forward pass and get the output.
-        output = self.model(data_batch["input"])
+        if output is None:
+            output = self.model(data_batch["input"])
 
         if self.conf.mask:
             label_mask = torch.zeros(self.conf.num_classes, device=self.device)
@@ -471,10 +536,27 @@ class Worker(object):
         if self.conf.split_mix:
             model.switch_slim_mode(self.max_ratio)
         flatten_model = TensorBuffer(list(model.state_dict().values()))
-        dist.send(tensor=flatten_model.buffer, dst=0)
+        # the local model is pre-aggregated by the edge of the worker (if any).
+        dst = (
+            get_edge_rank(self.conf, self.rank) if self.conf.n_edge_aggregators > 0 else 0
+        )
+        dist.send(tensor=flatten_model.buffer, dst=dst)
+        dist.send(
+            tensor=torch.Tensor(
+                [
+                    self.train_time,
+                    self.n_trained_samples,
+                    self.conf.epoch_,
+                    self.n_local_steps,
+                ]
+            ),
+            dst=dst,
+        )
         dist.barrier()
 
     def _terminate_comm_round(self):
+        self.train_time = time.perf_counter() - self.train_start_time
+        self.n_local_steps = self.scheduler.local_index
 
         # history_model = self._turn_off_grad(copy.deepcopy(self.model).cuda())
         self.model = self.model.cpu()
@@ -511,6 +593,17 @@ class Worker(object):
             return False
 
     def _is_finished_one_comm_round(self):
+        # the local epochs can be capped by a budget of optimizer steps and/or wall-clock time.
+        if (
+            self.conf.local_n_steps is not None
+            and self.scheduler.local_index >= self.conf.local_n_steps
+        ):
+            return True
+        if (
+            self.conf.local_time_budget is not None
+            and time.perf_counter() - self.train_start_time >= self.conf.local_time_budget
+        ):
+            return True
         return True if self.conf.epoch_ >= self.n_local_epochs else False
 
     def exp_lr_scheduler(self, epoch, decay=0.98, init_lr=0.1, lr_decay_epoch=1):
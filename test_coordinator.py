@@ -0,0 +1,36 @@
+import functools
+import types
+
+from pcode.create_coordinator import Coordinator
+from pcode.utils.mathdict import MathDict
+
+
+def define_coordinator(comm_round=1):
+    conf = types.SimpleNamespace(graph=types.SimpleNamespace(comm_round=comm_round))
+    metrics = types.SimpleNamespace(metric_names=["top1", "top5"])
+    return Coordinator(conf, metrics)
+
+
+def test_update_perf_with_mathdict():
+    # the averaged performance over the data_loaders (as in `get_avg_perf_on_dataloaders`).
+    performances = [
+        MathDict({"loss": 1.0, "top1": 60.0, "top5": 90.0, "top1_ci": 2.0}),
+        MathDict({"loss": 0.5, "top1": 70.0, "top5": 94.0, "top1_ci": 4.0}),
+    ]
+    performance = functools.reduce(lambda a, b: a + b, performances) / len(performances)
+
+    coordinator = define_coordinator()
+    coordinator.update_perf(performance)
+    assert coordinator.key_metric.best_perf == 65.0
+    assert coordinator.best_trackers["loss"].best_perf == 0.75
+    assert "top1_ci" not in coordinator.best_trackers
+
+
+def test_update_perf_within_interval():
+    coordinator = define_coordinator()
+    coordinator.update_perf(MathDict({"loss": 1.0, "top1": 60.0, "top5": 90.0, "top1_ci": 2.0}))
+
+    # the improvement within the confidence interval does not count as the new best.
+    coordinator.conf.graph.comm_round = 2
+    coordinator.update_perf(MathDict({"loss": 1.0, "top1": 61.0, "top5": 90.0, "top1_ci": 2.0}))
+    assert not coordinator.key_metric.is_best
@@ -0,0 +1,150 @@
+import os
+import types
+
+import numpy as np
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+
+import pcode.create_model as create_model
+from pcode.master import Master
+from pcode.utils.profiler import define_profiler
+from pcode.worker import Worker
+
+
+N_PARTICIPATED = 3
+
+
+def define_conf(rank, n_comm_rounds):
+    conf = types.SimpleNamespace(
+        graph=types.SimpleNamespace(rank=rank, on_cuda=False, comm_round=0, client_id=0),
+        logger=types.SimpleNamespace(log=lambda *args, **kwargs: None, save_json=lambda: None),
+        n_clients=6,
+        n_participated=N_PARTICIPATED,
+        n_comm_rounds=n_comm_rounds,
+        n_edge_aggregators=0,
+        random_state=np.random.RandomState(6),
+        client_selection="drop_stragglers",
+        round_deadline=None,
+        straggler_deadline_factor=1.5,
+        local_n_epochs=1,
+        min_local_epochs=None,
+        split_mix=False,
+        dynamic=False,
+        arch_planning=False,
+        contrastive=False,
+        local_history=False,
+        is_finished=False,
+        target_perf=None,
+        save_resume_state=False,
+        resume=None,
+        gossip=False,
+        track_time=False,
+        profiler_cuda_sync=False,
+        checkpoint_dir=".",
+    )
+    conf.graph.worker_id = rank
+    return conf
+
+
+def define_master(conf, early_stopping_round):
+    # the (real) comm round loop of the master; the model exchange only joins the same barriers.
+    master = Master.__new__(Master)
+    master.conf = conf
+    master.client_ids = list(range(1, 1 + conf.n_clients))
+    master.world_ids = list(range(1, 1 + conf.n_participated))
+    master.start_comm_round = 1
+    master.arch_planner = None
+    master.profiler = define_profiler(conf)
+    # the last selected client is always predicted to miss the deadline.
+    master._predict_train_time = lambda client_ids, list_of_local_n_epochs=None: np.array(
+        [1.0] * (len(client_ids) - 1) + [10.0]
+    )
+    master.coordinator = [types.SimpleNamespace(key_metric=types.SimpleNamespace(cur_perf=None))]
+    master.early_stopping_tracker = lambda perf: conf.graph.comm_round == early_stopping_round
+    master._send_model_to_selected_clients = lambda client_ids, to_send_history: dist.barrier()
+    master._receive_models_from_selected_clients = lambda client_ids: [
+        dist.barrier(),
+        dist.barrier(),
+    ]
+    master._aggregate_model_and_evaluate = lambda flatten_local_models, client_ids: None
+    master._finishing = lambda _comm_round=None: setattr(conf, "is_finished", True)
+    master.selected_client_ids = []
+
+    select_clients = master._drop_stragglers_select_clients
+
+    def _select_clients():
+        master.selected_client_ids.append(select_clients())
+        return master.selected_client_ids[-1]
+
+    master._select_clients = _select_clients
+    return master
+
+
+def define_worker(conf):
+    worker = Worker.__new__(Worker)
+    worker.conf = conf
+    worker.rank = conf.graph.rank
+    worker.profiler = define_profiler(conf)
+    worker.get_label_split = lambda: None
+    worker._recv_model_from_master = lambda: dist.barrier()
+    worker._train = lambda: None
+    worker._send_model_to_master = lambda model: [dist.barrier(), dist.barrier()]
+    return worker
+
+
+def run_process(rank, world_size, port, n_comm_rounds, early_stopping_round, results):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    create_model.define_model = lambda conf, **kwargs: ("arch", nn.Linear(2, 2))
+
+    conf = define_conf(rank, n_comm_rounds)
+    if rank == 0:
+        master = define_master(conf, early_stopping_round)
+        master.run()
+        results[rank] = master.selected_client_ids
+    else:
+        define_worker(conf).run()
+        results[rank] = conf.graph.comm_round
+    dist.destroy_process_group()
+
+
+def run_world(port, n_comm_rounds, early_stopping_round=None):
+    ctx = mp.get_context("fork")
+    results = ctx.Manager().dict()
+    processes = [
+        ctx.Process(
+            target=run_process,
+            args=(rank, 1 + N_PARTICIPATED, port, n_comm_rounds, early_stopping_round, results),
+        )
+        for rank in range(1 + N_PARTICIPATED)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+    hanged = [process.pid for process in processes if process.is_alive()]
+    for process in processes:
+        if process.is_alive():
+            process.kill()
+    assert len(hanged) == 0, "the processes did not terminate (mismatched collectives)."
+    assert all(process.exitcode == 0 for process in processes)
+    return dict(results)
+
+
+def test_drop_stragglers_until_the_last_round():
+    results = run_world(port=29611, n_comm_rounds=3)
+
+    # one worker is idle in every round, including the last one.
+    assert all(
+        len(selected_client_ids) == N_PARTICIPATED - 1 for selected_client_ids in results[0]
+    )
+    assert len(results[0]) == 3
+    assert all(results[rank] == 3 for rank in range(1, 1 + N_PARTICIPATED))
+
+
+def test_drop_stragglers_with_early_stopping():
+    results = run_world(port=29612, n_comm_rounds=5, early_stopping_round=2)
+    assert len(results[0]) == 2
+    assert all(results[rank] == -1 for rank in range(1, 1 + N_PARTICIPATED))
@@ -0,0 +1,93 @@
+import os
+import random
+import types
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import pcode.utils.checkpoint as checkpoint
+
+
+def define_conf(root, resume=None, async_checkpoint=False):
+    conf = types.SimpleNamespace(
+        graph=types.SimpleNamespace(rank=0, on_cuda=False),
+        random_state=np.random.RandomState(6),
+        checkpoint_dir=os.path.join(root, "0"),
+        async_checkpoint=async_checkpoint,
+        resume=resume,
+    )
+    os.makedirs(conf.checkpoint_dir, exist_ok=True)
+    return conf
+
+
+def define_model_and_optimizer():
+    model = nn.Sequential(nn.Linear(8, 16), nn.Dropout(0.5), nn.Linear(16, 4))
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+    return model, optimizer
+
+
+def run_rounds(conf, model, optimizer, start_comm_round, end_comm_round):
+    # every source of randomness of a comm round (client sampling, data, dropout, local steps).
+    for comm_round in range(start_comm_round, end_comm_round + 1):
+        n_local_steps = conf.random_state.choice([1, 2, 3]) + np.random.randint(2) + random.randint(0, 1)
+        for _ in range(n_local_steps):
+            loss = model(torch.randn(5, 8)).pow(2).mean()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+        checkpoint.save_resume_state(
+            conf,
+            {
+                "current_comm_round": comm_round,
+                "model": model.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "rng_state": checkpoint.get_rng_state(conf),
+            },
+        )
+    checkpoint.flush_checkpoints(conf)
+
+
+def seed_all(seed):
+    np.random.seed(seed)
+    random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def test_resume_is_bit_identical(tmp_path):
+    seed_all(0)
+    model, optimizer = define_model_and_optimizer()
+    run_rounds(define_conf(str(tmp_path / "full")), model, optimizer, 1, 6)
+
+    # the interrupted run (with the async writer), killed after the 4th comm round.
+    seed_all(0)
+    _model, _optimizer = define_model_and_optimizer()
+    run_rounds(
+        define_conf(str(tmp_path / "interrupted"), async_checkpoint=True), _model, _optimizer, 1, 4
+    )
+
+    # resume in a fresh process state (i.e. the other seeds and a new model).
+    seed_all(1)
+    resumed_model, resumed_optimizer = define_model_and_optimizer()
+    conf = define_conf(str(tmp_path / "resumed"), resume=str(tmp_path / "interrupted"))
+    conf.random_state = np.random.RandomState(1)
+    state = checkpoint.load_resume_state(conf)
+    assert state["current_comm_round"] == 4
+    resumed_model.load_state_dict(state["model"])
+    resumed_optimizer.load_state_dict(state["optimizer"])
+    checkpoint.set_rng_state(conf, state["rng_state"])
+    run_rounds(conf, resumed_model, resumed_optimizer, state["current_comm_round"] + 1, 6)
+
+    for param, resumed_param in zip(model.parameters(), resumed_model.parameters()):
+        assert torch.equal(param, resumed_param)
+
+
+def test_only_the_last_resume_states_are_kept(tmp_path):
+    conf = define_conf(str(tmp_path))
+    model, optimizer = define_model_and_optimizer()
+    run_rounds(conf, model, optimizer, 1, 5)
+    assert sorted(os.listdir(conf.checkpoint_dir)) == [
+        "resume_c_round_4.pth.tar",
+        "resume_c_round_5.pth.tar",
+    ]
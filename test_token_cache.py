@@ -0,0 +1,25 @@
+import types
+
+import numpy as np
+import torch
+import torch.utils.data as data
+
+from pcode.create_dataset import load_data_batch
+from pcode.datasets.loader.token_cache import TokenCache, pad_token_batch
+
+
+def test_padded_batch_through_load_data_batch(tmp_path):
+    cache = TokenCache.build(str(tmp_path / "tokens"), [[5, 6, 7], [8], [9, 10]])
+    dataset = [(cache[idx], idx) for idx in range(len(cache))]
+    _input, _target = next(
+        iter(data.DataLoader(dataset, batch_size=3, collate_fn=pad_token_batch))
+    )
+
+    # the inputs are moved to the device in place (the cpu stands for the cuda device here).
+    conf = types.SimpleNamespace(graph=types.SimpleNamespace(on_cuda=True), use_mixup=False)
+    data_batch = load_data_batch(conf, _input, _target, is_training=False, device="cpu")
+    input_ids, attention_mask = data_batch["input"]
+    assert input_ids.tolist() == [[5, 6, 7], [8, 0, 0], [9, 10, 0]]
+    assert attention_mask.tolist() == [[1, 1, 1], [1, 0, 0], [1, 1, 0]]
+    assert data_batch["target"].tolist() == [0, 1, 2]
+    assert np.array_equal(TokenCache(str(tmp_path / "tokens")).lengths, [3, 1, 2])